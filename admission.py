@@ -0,0 +1,148 @@
+"""Per-endpoint admission control.
+
+Expensive endpoints (statement rendering, password hashing, SMTP) get a
+fixed number of concurrent slots per worker process and a bounded queue of
+requests waiting for one. A request that finds the queue full, or waits
+longer than ``ADMISSION_WAIT_SECONDS``, is turned away at once with
+``503`` and ``Retry-After`` instead of tying up a worker thread, so cheap
+pages keep being served under load.
+
+Slots are released when the server closes the response iterable, so a
+streamed download holds its slot until the last byte is sent. That is done
+by WSGI middleware rather than ``Response.call_on_close``: a ``send_file``
+response hands the server its ``wsgi.file_wrapper`` directly, and the
+Response object's own ``close`` is then never called. Only meaningful with
+threaded workers (gunicorn ``gthread``); a sync worker serves one request at
+a time.
+"""
+import threading
+
+from flask import Response, request
+from werkzeug.wsgi import ClosingIterator
+
+# Where _before leaves the request's gate for the middleware to release
+ENVIRON_KEY = 'admission.gate'
+
+
+def parse_limits(text):
+    """``'main.download=2:4, main.login@POST=4'`` -> ``{(endpoint, method): (slots, queue)}``.
+
+    ``@METHOD`` limits only that method (method None means any); the queue
+    length defaults to twice the slots.
+    """
+    limits = {}
+    for item in (text or '').split(','):
+        target, _, spec = item.strip().partition('=')
+        if not target or not spec:
+            continue
+        endpoint, _, method = target.strip().partition('@')
+        slots, _, queue = spec.partition(':')
+        limits[endpoint, method.upper() or None] = (int(slots), int(queue) if queue else 2 * int(slots))
+    return limits
+
+
+class Gate:
+    def __init__(self, slots, queue):
+        self.slots = slots
+        self.queue = queue
+        self._semaphore = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def enter(self, timeout):
+        """Take a slot, waiting at most ``timeout`` seconds. False if refused."""
+        if self._semaphore.acquire(blocking=False):
+            return self._admit()
+        with self._lock:
+            if self.waiting >= self.queue:
+                self.rejected_full += 1
+                return False
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        acquired = self._semaphore.acquire(timeout=timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected_timeout += 1
+        return acquired and self._admit()
+
+    def _admit(self):
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'slots': self.slots, 'queue': self.queue,
+                'in_flight': self.in_flight, 'waiting': self.waiting, 'max_waiting': self.max_waiting,
+                'admitted': self.admitted, 'rejected_full': self.rejected_full,
+                'rejected_timeout': self.rejected_timeout,
+            }
+
+
+class AdmissionControl:
+    def __init__(self, app=None):
+        self.gates = {}
+        self.wait = 2.0
+        self.retry_after = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.gates = {
+            key: Gate(slots, queue)
+            for key, (slots, queue) in parse_limits(app.config.get('ADMISSION_LIMITS')).items()
+        }
+        self.wait = app.config.get('ADMISSION_WAIT_SECONDS', self.wait)
+        self.retry_after = app.config.get('ADMISSION_RETRY_AFTER', self.retry_after)
+        app.before_request(self._before)
+        app.wsgi_app = self._middleware(app.wsgi_app)
+        app.extensions['admission'] = self
+
+    def stats(self):
+        return {
+            endpoint + (f'@{method}' if method else ''): gate.stats()
+            for (endpoint, method), gate in self.gates.items()
+        }
+
+    def _before(self):
+        gate = self.gates.get((request.endpoint, request.method)) or self.gates.get((request.endpoint, None))
+        if gate is None:
+            return None
+        if not gate.enter(self.wait):
+            return Response(
+                'The server is busy, please try again shortly.', status=503, mimetype='text/plain',
+                headers={'Retry-After': str(self.retry_after)},
+            )
+        request.environ[ENVIRON_KEY] = gate
+        return None
+
+    @staticmethod
+    def _middleware(wsgi_app):
+        def admitted(environ, start_response):
+            try:
+                app_iter = wsgi_app(environ, start_response)
+            except BaseException:
+                gate = environ.pop(ENVIRON_KEY, None)
+                if gate is not None:
+                    gate.leave()
+                raise
+            gate = environ.pop(ENVIRON_KEY, None)
+            if gate is None:
+                return app_iter
+            # Released once the server has sent the body and closed the
+            # iterable, whatever kind of iterable it is
+            return ClosingIterator(app_iter, gate.leave)
+        return admitted
@@ -1,415 +1,672 @@
 import os
+import hashlib
+import hmac
 import random
 import string
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from functools import wraps
-import tempfile
 
+import click
 from flask import (
-    Flask, render_template_string, request, redirect, url_for,
-    session, flash, send_file
-)
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_mail import Mail, Message
-from dotenv import load_dotenv
-from fpdf import FPDF
-from sqlalchemy import extract, func
-
-# Load environment
-load_dotenv()
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY') or os.urandom(24)
-
-# PostgreSQL config (SQLAlchemy + psycopg2)
-POSTGRES_USER = os.getenv('POSTGRES_USER', 'expense_user')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', '')
-POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-POSTGRES_DB = os.getenv('POSTGRES_DB', 'expense_tracker_db')
-
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}"
-    f"@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Mail config
-app.config.update(
-    MAIL_SERVER=os.getenv('MAIL_SERVER', 'smtp.gmail.com'),
-    MAIL_PORT=int(os.getenv('MAIL_PORT', 587)),
-    MAIL_USERNAME=os.getenv('MAIL_USERNAME'),
-    MAIL_PASSWORD=os.getenv('MAIL_PASSWORD'),
-    MAIL_USE_TLS=os.getenv('MAIL_USE_TLS', 'True') == 'True',
-    MAIL_USE_SSL=os.getenv('MAIL_USE_SSL', 'False') == 'True',
+    Blueprint, Flask, current_app, render_template, stream_template, request,
+    redirect, url_for, session, flash, get_flashed_messages, Response,
+    stream_with_context, abort, jsonify, send_file
 )
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import any_, bindparam, delete as sa_delete, func, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-mail = Mail(app)
-
-# SQLAlchemy + Migrate
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-
-# ---------- Models ----------
-class User(db.Model):
-    __tablename__ = 'users'
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(255), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, server_default=db.func.now())
-    expenses = db.relationship('Expense', backref='user', cascade='all, delete-orphan', lazy=True)
-
-class OTPVerification(db.Model):
-    __tablename__ = 'otp_verification'
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(255))
-    otp = db.Column(db.String(10))
-    expires_at = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, server_default=db.func.now())
-
-class Expense(db.Model):
-  __tablename__ = 'expenses'
-  id = db.Column(db.Integer, primary_key=True)
-  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
-  amount = db.Column(db.Numeric(12,2))
-  category = db.Column(db.String(100))
-  currency = db.Column(db.String(10))
-  country = db.Column(db.String(100))
-  description = db.Column(db.Text)
-  date = db.Column(db.Date)
-  created_at = db.Column(db.DateTime, server_default=db.func.now())
-
-# New Credit model
-class Credit(db.Model):
-  __tablename__ = 'credits'
-  id = db.Column(db.Integer, primary_key=True)
-  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
-  amount = db.Column(db.Numeric(12,2))
-  created_at = db.Column(db.DateTime, server_default=db.func.now())
-
-# Try create tables at startup (safe for dev)
-try:
-    with app.app_context():
-        db.create_all()
-except Exception as e:
-    print("DB setup warning:", e)
+import importer
+import ledger
+import search
+from admission import AdmissionControl
+from bench import bench_cli, seed_bench_command
+from charts import CHART_FORMATS, PLACEHOLDER_SVG, ChartRenderer
+from config import Config
+from db_pool import install_pool_events, pool_stats
+from exports import ExportRunner
+from fx import FxRates, load_rates, read_rates
+from mail_queue import MailQueue
+from metrics import Metrics
+from models import db, User, OTPVerification, Expense, MonthlyTotal, Credit, LedgerBalance, Receipt, ExportJob
+from passwords import PasswordHasher
+from periodic import PeriodicTask
+from profiling import Profiler
+from ratelimit import RateLimits
+from receipts import IMAGE_KINDS, PLACEHOLDER_SVG as RECEIPT_PLACEHOLDER_SVG, RECEIPT_TYPES, ReceiptStore, UploadConflict
+from statement_cache import StatementCache
+
+# Extensions are bound to the app in create_app(). Heavy optional modules
+# (fpdf, Flask-Mail) are imported where they are used, so a worker only
+# pays for them once a request actually needs them.
+metrics = Metrics()
+admission = AdmissionControl()
+profiler = Profiler()
+mail_queue = MailQueue()
+hasher = PasswordHasher()
+statement_cache = StatementCache()
+fx_rates = FxRates()
+charts = ChartRenderer()
+receipt_store = ReceiptStore()
+export_runner = ExportRunner()
+rate_limits = RateLimits(otp_send='3/600', otp_send_ip='10/600', otp_verify='5/600', otp_verify_ip='30/600')
+
+# cli_group=None keeps the blueprint's commands at the top level (`flask rollups`)
+bp = Blueprint('main', __name__, cli_group=None)
 
 # --- Helpers ---
 def login_required(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
         if 'user_id' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return wrapped
 
+def api_login_required(f):
+    """Like login_required, but answers JSON 401 instead of redirecting."""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify(error='not logged in'), 401
+        return f(*args, **kwargs)
+    return wrapped
+
+def admin_required(f):
+    """Allow only requests carrying the configured X-Admin-Token."""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        token = current_app.config.get('ADMIN_TOKEN')
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not token or not hmac.compare_digest(supplied, token):
+            abort(404)
+        return f(*args, **kwargs)
+    return wrapped
+
+# Cursor date for expenses without one; they page after all dated rows
+UNDATED_CURSOR = 'undated'
+
+def encode_cursor(row):
+    """Dashboard keyset cursor for an expense row: ``<iso date>_<id>``."""
+    return f"{row.date.isoformat() if row.date else UNDATED_CURSOR}_{row.id}"
+
+def parse_cursor(value):
+    """Decode a cursor from the URL; returns ``(date, id)`` (date None for an
+    undated row) or None if malformed."""
+    day, _, row_id = (value or '').partition('_')
+    try:
+        return None if day == UNDATED_CURSOR else datetime.strptime(day, '%Y-%m-%d').date(), int(row_id)
+    except ValueError:
+        return None
+
+def month_range(day):
+    """Half-open ``[start, end)`` bounds of the month containing ``day``."""
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def year_range(day):
+    """Half-open ``[start, end)`` bounds of the year containing ``day``."""
+    start = day.replace(month=1, day=1)
+    return start, start.replace(year=start.year + 1)
+
+def add_months(day, n):
+    """First day of the month ``n`` months after ``day``'s (``n`` may be negative)."""
+    year, month = divmod(day.year * 12 + day.month - 1 + n, 12)
+    return day.replace(year=year, month=month + 1, day=1)
+
+def rate_date(month, today):
+    """The date whose exchange rate converts a month's total: its last day,
+    or today for the month in progress."""
+    return min(month_range(month)[1] - timedelta(days=1), today)
+
+# Hot queries live in functions so `flask check-query-plans` can EXPLAIN
+# exactly what the routes run. Keep period filters as plain range
+# comparisons on the column; wrapping it (extract(), date_trunc()) hides the
+# column from its index.
+
+def expense_page_query(user_id, after=None, before=None, query=None, undated=False):
+    """A user's dated expenses (or with ``undated``, those without a date) in
+    dashboard order, positioned by keyset cursor.
+
+    With ``before`` the rows come back oldest-first (the caller reverses
+    them); otherwise newest-first, starting after ``after`` if given.
+    ``query`` narrows the rows (e.g. search results); by default it is all
+    of the user's expenses. Undated rows come after every dated one and are
+    ordered by id alone, so a cursor from the other group bounds nothing
+    (``fetch_page`` combines the two).
+    """
+    if query is None:
+        query = Expense.query.filter_by(user_id=user_id)
+    if undated:
+        query = query.filter(Expense.date.is_(None))
+        key, order = Expense.id, (Expense.id,)
+
+        def bound(cursor):
+            return cursor[1] if cursor[0] is None else None
+    else:
+        # Two range scans rather than one ORDER BY ... NULLS LAST, which
+        # the (user_id, date, id) index can't serve on Postgres
+        query = query.filter(Expense.date.isnot(None))
+        key, order = tuple_(Expense.date, Expense.id), (Expense.date, Expense.id)
+
+        def bound(cursor):
+            return cursor if cursor[0] is not None else None
+    if before:
+        if bound(before) is not None:
+            query = query.filter(key > bound(before))
+        return query.order_by(*(column.asc() for column in order))
+    if after and bound(after) is not None:
+        query = query.filter(key < bound(after))
+    return query.order_by(*(column.desc() for column in order))
+
+def fetch_page(user_id, after, before, page_size, query=None):
+    """One dashboard-ordered page of ``expense_page_query`` rows; returns
+    ``(rows, next_cursor, prev_cursor)``."""
+    # Fetch one extra row to know whether another page exists
+    limit = page_size + 1
+
+    def fetch(undated, n):
+        return expense_page_query(user_id, after, before, query, undated).limit(n).all()
+
+    if before:
+        # Walking back from an undated row passes the other undated rows first
+        rows = fetch(True, limit) if before[0] is None else []
+        if len(rows) < limit:
+            rows += fetch(False, limit - len(rows))
+    else:
+        rows = fetch(False, limit) if after is None or after[0] is not None else []
+        if len(rows) < limit:
+            rows += fetch(True, limit - len(rows))
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+    if not rows:
+        return rows, None, None
+    return rows, encode_cursor(rows[-1]) if has_next else None, encode_cursor(rows[0]) if has_prev else None
+
+def monthly_totals_query(user_id, start=None, end=None):
+    """A user's rollup ``(month, currency, total)`` rows, optionally within ``[start, end)``."""
+    query = db.session.query(MonthlyTotal.month, MonthlyTotal.currency, MonthlyTotal.total).filter(
+        MonthlyTotal.user_id == user_id)
+    if start is not None:
+        query = query.filter(MonthlyTotal.month >= start, MonthlyTotal.month < end)
+    return query
+
+def latest_credit_query(user_id):
+    return Credit.query.filter_by(user_id=user_id).order_by(Credit.id.desc())
+
+def statement_query(user_id, start=None, end=None):
+    """A user's expenses in statement order, optionally within ``[start, end)``."""
+    query = Expense.query.filter_by(user_id=user_id)
+    if start is not None:
+        query = query.filter(Expense.date >= start, Expense.date < end)
+    return query.order_by(Expense.date.desc(), Expense.id.desc())
+
+def statement_row_count(user_id, start=None, end=None):
+    """Expenses in a statement period: dated ones from the rollups, plus the
+    undated ones (not in any rollup) for the all-time statement, which lists
+    them last."""
+    query = db.session.query(func.coalesce(func.sum(MonthlyTotal.count), 0)).filter(MonthlyTotal.user_id == user_id)
+    if start is not None:
+        return query.filter(MonthlyTotal.month >= start, MonthlyTotal.month < end).scalar()
+    return query.scalar() + Expense.query.filter_by(user_id=user_id, date=None).count()
+
+def statement_version_query(user_id, start=None, end=None):
+    """The user's data version for a period: the sum of its rollup row versions.
+
+    Every expense write bumps the version of the month it lands in, so this
+    changes whenever anything in the period does.
+    """
+    query = db.session.query(func.coalesce(func.sum(MonthlyTotal.version), 0)).filter(MonthlyTotal.user_id == user_id)
+    if start is not None:
+        query = query.filter(MonthlyTotal.month >= start, MonthlyTotal.month < end)
+    return query
+
+def analytics_query(user_id, start, end):
+    """Expense totals grouped by (month, category, currency) within ``[start, end)``."""
+    month = month_start(Expense.date)
+    return db.session.query(
+        month, Expense.category, Expense.currency, func.sum(Expense.amount), func.count(Expense.id),
+    ).filter(
+        Expense.user_id == user_id, Expense.date >= start, Expense.date < end,
+    ).group_by(month, Expense.category, Expense.currency)
+
+def home_currency():
+    """The logged-in user's chosen currency for totals."""
+    return session.get('home_currency') or current_app.config['HOME_CURRENCY']
+
+def bump_data_version(user_id):
+    """Mark the user's data as changed, in the current transaction."""
+    db.session.execute(
+        update(User).where(User.id == user_id)
+        .values(data_version=User.data_version + 1, data_updated_at=datetime.now(timezone.utc).replace(tzinfo=None))
+    )
+
+def page_validators(*parts):
+    """Strong ETag and Last-Modified for a page built from the user's data.
+
+    One primary-key lookup of the user's data version; ``parts`` add whatever
+    else the page depends on (query args, currency, rates). Pages also depend
+    on today's date (month and year totals), so both validators roll over
+    at midnight.
+    """
+    version, updated_at = db.session.query(User.data_version, User.data_updated_at).filter(
+        User.id == session['user_id']).one()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    key = '|'.join(str(p) for p in (
+        session['user_id'], version, datetime.now().date(), current_app.config['RELEASE'], *parts))
+    etag = hashlib.sha256(key.encode()).hexdigest()[:32]
+    return etag, max(updated_at or midnight, midnight)
+
+def not_modified(etag, last_modified):
+    """A 304 response if the client's copy is current, else None.
+
+    Never when flashes are waiting: the page would have shown them.
+    """
+    if session.get('_flashes'):
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Private, and always revalidated: the validators carry the freshness
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def converted_monthly_totals(user_id, home, today, start=None, end=None):
+    """Rollup totals converted into ``home``, as NumPy arrays.
+
+    Returns ``(months, amounts, missing)``. A month is converted at the rate
+    on its last day (today's for the current month); ``amounts`` is NaN for
+    currencies with no rate, which are listed in ``missing``.
+    """
+    import numpy as np
+
+    rows = monthly_totals_query(user_id, start, end).all()
+    months = [r.month for r in rows]
+    rate_dates = [rate_date(m, today) for m in months]
+    amounts, missing = fx_rates.convert([r.total for r in rows], [r.currency for r in rows], rate_dates, home)
+    return np.array(months, dtype='datetime64[D]'), amounts, missing
+
+def converted_credit(credit, home):
+    """A credit's amount in ``home``, or None when there is no rate for it."""
+    import numpy as np
+
+    day = (credit.created_at or datetime.now()).date()
+    amounts, _ = fx_rates.convert([credit.amount], [credit.currency], [day], home)
+    return None if np.isnan(amounts[0]) else float(amounts[0])
+
+def converted_balance(balances, home, day):
+    """Sum ledger ``{currency: balance}`` into ``home`` at ``day``'s rates.
+
+    Returns ``(total, missing)``; balances in currencies without a rate are
+    left out and listed in ``missing``.
+    """
+    import numpy as np
+
+    if not balances:
+        return 0.0, set()
+    amounts, missing = fx_rates.convert(list(balances.values()), list(balances), [day] * len(balances), home)
+    return float(np.nansum(amounts)), missing
+
+def analytics_breakdowns(user_id, home, today, months):
+    """Per-category and per-month totals in ``home`` over the last ``months`` months.
+
+    Returns ``(by_category, by_month, missing)``: two pandas DataFrames with
+    ``amount`` and ``count`` columns (categories largest first; every month
+    of the window, oldest first) and the currencies that had no rate.
+    """
+    import pandas as pd
+
+    start, end = add_months(today, 1 - months), month_range(today)[1]
+    frame = pd.DataFrame(
+        analytics_query(user_id, start, end).all(),
+        columns=['month', 'category', 'currency', 'total', 'count'],
+    )
+    # SQLite hands the month back as text
+    frame['month'] = pd.to_datetime(frame['month']).dt.date
+    frame['amount'], missing = fx_rates.convert(
+        frame['total'], frame['currency'], [rate_date(m, today) for m in frame['month']], home)
+    frame['category'] = frame['category'].fillna('').replace('', 'Uncategorised')
+
+    by_category = frame.groupby('category')[['amount', 'count']].sum().sort_values('amount', ascending=False)
+    window = [add_months(start, i) for i in range(months)]
+    by_month = frame.groupby('month')[['amount', 'count']].sum().reindex(window, fill_value=0)
+    return by_category, by_month, missing
+
+def month_start(col):
+    """SQL expression truncating a date column to the first of its month."""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return func.date(col, 'start of month')
+    return func.cast(func.date_trunc('month', col), db.Date)
+
+def add_to_monthly_totals(deltas, expense_date, currency, amount, count=1):
+    """Accumulate one expense's contribution into a ``deltas`` dict."""
+    if expense_date is None:
+        return
+    key = (expense_date.replace(day=1), currency or '')
+    total, n = deltas.get(key, (Decimal(0), 0))
+    deltas[key] = (total + Decimal(str(amount or 0)), n + count)
+
+def apply_monthly_totals(user_id, deltas):
+    """Upsert rollup deltas for a user in the current transaction.
+
+    ``deltas`` maps ``(month, currency)`` to ``(amount, count)``; callers
+    build it with ``add_to_monthly_totals`` and commit together with the
+    expense rows themselves.
+    """
+    if not deltas:
+        return
+    table = MonthlyTotal.__table__
+    insert = sqlite_insert if db.session.get_bind().dialect.name == 'sqlite' else pg_insert
+    stmt = insert(table).values([
+        {'user_id': user_id, 'month': month, 'currency': currency, 'total': total, 'count': n, 'version': 1}
+        for (month, currency), (total, n) in deltas.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.month, table.c.currency],
+        set_={
+            'total': table.c.total + stmt.excluded.total,
+            'count': table.c.count + stmt.excluded.count,
+            'version': table.c.version + 1,
+        },
+    )
+    db.session.execute(stmt)
+
+def invalidate_statements(user_id, deltas):
+    """Drop cached statements for the months a committed write touched."""
+    statement_cache.invalidate(user_id, {month for month, _ in deltas})
+
+def load_expense_file(user_id, stream, filename):
+    """Import a CSV/XLSX file of expenses for a user and commit it."""
+    # The ledger gets one entry per day and currency rather than per row
+    daily = {}
+
+    def add_to_totals(deltas, expense_date, currency, amount):
+        add_to_monthly_totals(deltas, expense_date, currency, amount)
+        key = (currency or '', expense_date or datetime.now().date())
+        daily[key] = daily.get(key, Decimal(0)) - Decimal(str(amount or 0))
+
+    result, deltas = importer.import_expenses(
+        user_id, importer.read_rows(stream, filename), add_to_totals,
+        batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+    )
+    apply_monthly_totals(user_id, deltas)
+    ledger.post(user_id, [(currency, day, amount, 'import', None) for (currency, day), amount in sorted(daily.items())])
+    if result.imported:
+        bump_data_version(user_id)
+    db.session.commit()
+    invalidate_statements(user_id, deltas)
+    return result
+
+def create_expenses(user_id, rows, deltas):
+    """Insert validated expense rows with one multi-row INSERT ... RETURNING.
+
+    Returns the new ids in the order of ``rows``.
+    """
+    if not rows:
+        return []
+    table = Expense.__table__
+    for row in rows:
+        row['user_id'] = user_id
+        add_to_monthly_totals(deltas, row['date'], row['currency'], row['amount'])
+    result = db.session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows)
+    ids = [row_id for (row_id,) in result]
+    ledger.post(user_id, [
+        (row['currency'], row['date'] or datetime.now().date(), -Decimal(str(row['amount'] or 0)), 'expense', row_id)
+        for row, row_id in zip(rows, ids)
+    ])
+    return ids
+
+def delete_expenses(user_id, ids, deltas):
+    """Delete the user's expenses among ``ids`` in one statement; returns the ids removed."""
+    if not ids:
+        return set()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # One statement shape (and plan) whatever the number of ids
+        matches = Expense.id == any_(bindparam('ids', list(ids), type_=ARRAY(db.Integer)))
+    else:
+        matches = Expense.id.in_(ids)
+    removed = db.session.execute(
+        sa_delete(Expense)
+        .where(Expense.user_id == user_id, matches)
+        .returning(Expense.id, Expense.date, Expense.currency, Expense.amount)
+    ).all()
+    for _, exp_date, currency, amount in removed:
+        add_to_monthly_totals(deltas, exp_date, currency, -amount, count=-1)
+    post_reversals(user_id, removed)
+    return {row_id for row_id, *_ in removed}
+
+def post_reversals(user_id, removed):
+    """Cancel deleted expenses ``(id, date, currency, amount)`` in the ledger.
+
+    Reversals are dated like the expense, so balances on past dates no
+    longer count it either.
+    """
+    ledger.post(user_id, [
+        (currency, exp_date or datetime.now().date(), amount or 0, 'reversal', row_id)
+        for row_id, exp_date, currency, amount in removed
+    ])
+
 def generate_otp():
     return ''.join(random.choices(string.digits, k=6))
 
-def send_otp_email(email, otp):
-    try:
-        msg = Message("ExpenseTracker OTP", sender=app.config.get('MAIL_USERNAME'), recipients=[email])
-        msg.body = f"Your OTP for password reset is: {otp}\nIt expires in 10 minutes."
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print("Mail sending failed:", e)
-        return False
-
-# --- Base HTML (unchanged structure but fixed CSS JS issues) ---
-BASE_HTML = """
-<!doctype html>
-<html lang="en">
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>Expense Tracker</title>
-<!-- Font Awesome for icons -->
-<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.2/css/all.min.css" crossorigin="anonymous" referrerpolicy="no-referrer" />
-<style>
-  :root{
-    --bg:#0b0b0c; --card:#121213; --muted:#9aa0a6; --accent:#4a90e2; --success:#28a745; --danger:#e04545; --text:#eef2f3;
-    --radius:12px;
-  }
-  html,body{height:100%;margin:0;font-family:Segoe UI,Roboto,Inter,Arial;background:linear-gradient(180deg,var(--bg),#070708);color:var(--text);}
-  .wrap{max-width:980px;margin:18px auto;padding:16px;}
-  .navbar{display:flex;justify-content:space-between;align-items:center;padding:12px;background:var(--card);border-radius:14px;box-shadow:0 8px 30px rgba(0,0,0,0.6);position:relative;}
-  .brand{font-weight:700;font-size:1.2rem;display:flex;align-items:center;gap:8px}
-  .brand i{color:var(--accent);font-size:1.3em;}
-  .navlinks{display:flex;gap:6px;align-items:center;flex-wrap:wrap}
-  .navlinks a{color:var(--text);text-decoration:none;margin-left:12px;padding:6px 10px;border-radius:8px;display:flex;align-items:center;gap:6px;transition:background 0.2s;}
-  .navlinks a:hover{background:rgba(74,144,226,0.12);}
-  .menu-toggle{display:none;cursor:pointer;background:none;border:none;padding:8px;position:absolute;right:12px;top:12px;z-index:20;color:var(--accent);font-size:1.6em;}
-  .container{margin-top:14px}
-  .card{background:linear-gradient(180deg, rgba(255,255,255,0.02), rgba(255,255,255,0.01)); padding:16px;border-radius:var(--radius);box-shadow:0 8px 30px rgba(0,0,0,0.5);}
-  label{display:block;color:var(--muted);margin-bottom:6px}
-  input, select, textarea { width:100%; box-sizing:border-box; padding:12px 14px; border-radius:10px; border:1px solid rgba(255,255,255,0.04); background:#0f1011; color:var(--text); font-size:1rem; margin-bottom:12px; outline:none; }
-  input:focus, select:focus, textarea:focus { box-shadow:0 8px 20px rgba(74,144,226,0.06); border-color:rgba(74,144,226,0.18) }
-  .row{display:flex;gap:12px;flex-wrap:wrap}
-  .col{flex:1;min-width:160px}
-  .btn{display:inline-block;padding:10px 14px;border-radius:10px;border:none;cursor:pointer;font-weight:700;transition:background 0.2s,box-shadow 0.2s;box-shadow:0 2px 8px rgba(74,144,226,0.04);}
-  .btn i{margin-right:4px;}
-  .btn-primary{background:var(--accent);color:white}
-  .btn-primary:hover{background:#357abd;}
-  .btn-success{background:var(--success);color:white}
-  .btn-success:hover{background:#218838;}
-  .btn-danger{background:var(--danger);color:white}
-  .btn-danger:hover{background:#b83232;}
-  .muted{color:var(--muted)}
-  .table{width:100%;border-collapse:collapse;margin-top:10px}
-  .table th,.table td{padding:10px;border-bottom:1px solid rgba(255,255,255,0.03);text-align:left;font-size:0.95rem;white-space:nowrap}
-  .table th i{margin-right:4px;}
-  .action-btns{display:flex;gap:6px;}
-  footer{margin-top:16px;padding:12px;text-align:center;color:var(--muted);font-size:0.9rem}
-  .form-wrap{max-width:520px;margin:12px auto}
-  .pw-wrap{position:relative;display:flex;align-items:center}
-  .pw-toggle{position:absolute;right:18px;top:50%;transform:translateY(-50%);cursor:pointer;font-size:14px;color:#ccc;user-select:none}
-  .alert{padding:10px;border-radius:8px;margin-bottom:12px}
-  .alert-info{background:#0b2a3a;color:#cdeaf8}
-  .alert-success{background:rgba(40,167,69,0.08);color:var(--success)}
-  .alert-danger{background:rgba(224,69,69,0.06);color:var(--danger)}
-  .table-container{overflow:auto}
-  @media (max-width:900px){
-    .wrap{padding:12px}
-    .brand{font-size:1.05rem}
-  }
-  @media (max-width:700px){
-    .navbar{flex-direction:column;align-items:flex-start;gap:8px;}
-    .navlinks{width:100%;justify-content:flex-end}
-    .brand{margin-bottom:4px;}
-    .menu-toggle{display:block;}
-    .menu-toggle{display:block; top:-1.5px !important;}
-    .navlinks{display:none;flex-direction:column;gap:0;background:var(--card);position:absolute;top:56px;right:12px;min-width:160px;padding:10px 0;border-radius:10px;box-shadow:0 8px 30px rgba(0,0,0,0.4);z-index:10;}
-    .navlinks.show{display:flex;}
-    .navlinks a{margin:0;padding:12px 18px;}
-  }
-  @media (max-width:520px){
-    .row{flex-direction:column}
-    .wrap{padding:8px}
-    .form-wrap{padding:8px}
-    .navlinks{width:100%;justify-content:flex-end}
-    .table th,.table td{font-size:0.9rem}
-    .navbar{padding:8px;}
-    .brand{font-size:0.98rem;}
-    .btn{padding:8px 10px;font-size:0.98em;}
-  }
-</style>
-<script>
-  function toggleInputPassword(id, el){
-    var p = document.getElementById(id); if(!p) return;
-    if(p.type === 'password'){ p.type='text'; el.innerText='HIDE'; } else { p.type='password'; el.innerText='SHOW'; }
-  }
-  function confirmDelete(){ return confirm('Delete this expense?'); }
-  function calculateTotal(){
-    var amount = parseFloat(document.querySelector("input[name='amount']").value || 0);
-    var qty = parseFloat(prompt('Enter quantity:') || 0);
-    if(!isNaN(amount) && !isNaN(qty)){ alert('Total = ' + (amount*qty).toFixed(2)); } else { alert('Enter valid numbers'); }
-  }
-  // Hamburger menu toggle
-  function toggleMenu(){
-    var nav = document.getElementById('navlinks');
-    if(nav){ nav.classList.toggle('show'); }
-  }
-
-  // Close menu if clicking outside
-  document.addEventListener('click', function(event) {
-    var nav = document.getElementById('navlinks');
-    var menuBtn = document.querySelector('.menu-toggle');
-    if (!nav || !menuBtn) return;
-    var isMenuOpen = nav.classList.contains('show');
-    if (!isMenuOpen) return;
-    // If click is NOT inside navlinks or menu button, close menu
-    if (!nav.contains(event.target) && !menuBtn.contains(event.target)) {
-      nav.classList.remove('show');
+def store_otp(email, otp, expires_at):
+    """Replace the email's OTP (if any) with a new one: a single upsert."""
+    table = OTPVerification.__table__
+    insert = sqlite_insert if db.session.get_bind().dialect.name == 'sqlite' else pg_insert
+    stmt = insert(table).values(email=email, otp=otp, expires_at=expires_at, created_at=func.now())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.email],
+        set_={'otp': stmt.excluded.otp, 'expires_at': stmt.excluded.expires_at, 'created_at': stmt.excluded.created_at},
+    )
+    db.session.execute(stmt)
+
+def sweep_expired_otps():
+    """Delete expired OTPs; returns how many were removed."""
+    removed = OTPVerification.query.filter(OTPVerification.expires_at < datetime.now()).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+otp_sweeper = PeriodicTask(sweep_expired_otps, 'OTP_SWEEP_SECONDS')
+
+def snapshot_balances():
+    """Snapshot every ledger at the end of last month; returns how many were taken."""
+    return ledger.take_snapshots(ledger.previous_month_end(datetime.now().date()))
+
+balance_snapshotter = PeriodicTask(snapshot_balances, 'LEDGER_SNAPSHOT_SECONDS', default=3600)
+
+def sweep_receipts():
+    """Drop abandoned receipt uploads and requeue stuck processing; see ReceiptStore.sweep."""
+    return receipt_store.sweep()
+
+receipt_sweeper = PeriodicTask(sweep_receipts, 'RECEIPT_SWEEP_SECONDS')
+
+def sweep_caches():
+    """Evict the statement and chart caches down to their budgets, including
+    files other workers wrote; see StatementCache.evict."""
+    for cache in (statement_cache, charts.cache):
+        if cache.enabled:
+            cache.evict()
+
+cache_sweeper = PeriodicTask(sweep_caches, 'STATEMENT_CACHE_SWEEP_SECONDS')
+
+def receipt_json(receipt):
+    return {
+        'id': receipt.id, 'status': receipt.status, 'filename': receipt.filename, 'size': receipt.size,
+        'sha256': receipt.sha256, 'expense_id': receipt.expense_id, 'error': receipt.error,
+        'amount': str(receipt.amount) if receipt.amount is not None else None,
+        'date': receipt.date.isoformat() if receipt.date else None, 'category': receipt.category,
+        'url': url_for('main.receipt_file', receipt_id=receipt.id, kind='display'),
+        'thumbnail_url': url_for('main.receipt_file', receipt_id=receipt.id, kind='thumb'),
     }
-  });
-</script>
-</head>
-<body>
-  <div class="wrap">
-    <nav class="navbar">
-      <div class="brand"><i class="fa-solid fa-wallet"></i><a href="{{ url_for('dashboard') }}" style="color:inherit;text-decoration:none">ExpenseTracker</a></div>
-      <button class="menu-toggle" onclick="toggleMenu()" aria-label="Menu"><i class="fa-solid fa-bars"></i></button>
-      <div class="navlinks" id="navlinks">
-        {% if session.user_id %}
-          <span class="muted" style="margin-right:8px"><i class="fa-solid fa-user"></i> Hi {{ session.email }}</span>
-          <a href="{{ url_for('dashboard') }}"><i class="fa-solid fa-chart-line"></i>Dashboard</a>
-          <a href="{{ url_for('add_expense') }}"><i class="fa-solid fa-plus"></i>Add</a>
-          <a href="{{ url_for('download') }}"><i class="fa-solid fa-file-arrow-down"></i>Download</a>
-          <a href="{{ url_for('logout') }}"><i class="fa-solid fa-right-from-bracket"></i>Logout</a>
-        {% else %}
-          <a href="{{ url_for('login') }}"><i class="fa-solid fa-right-to-bracket"></i>Login</a>
-          <a href="{{ url_for('register') }}"><i class="fa-solid fa-user-plus"></i>Register</a>
-        {% endif %}
-      </div>
-    </nav>
-
-    <div class="container">
-      {% with messages = get_flashed_messages(with_categories=true) %}
-        {% if messages %}
-          {% for category, msg in messages %}
-            <div class="alert {% if category=='success' %}alert-success{% elif category=='danger' %}alert-danger{% else %}alert-info{% endif %}">{{ msg }}</div>
-          {% endfor %}
-        {% endif %}
-      {% endwith %}
-
-      {{ content|safe }}
-    </div>
-
-    <footer>BUILT BY MOHAMMED AKEEF FAROOQI<br>
-    <a href="https://mail.google.com/mail/?view=cm&fs=1&to=mf.akeef@gmail.com&su=Inquiry&body=Hello%20I%20have%20an%20issue%20with%20this%20Tracker..."
-        target="_blank"style="text-decoration: none; color: inherit;">CONTACT US</a></footer>
-  </div>
-</body>
-</html>
-"""
-#  • <a href="mailto:mf.akeef@gmail.com" style="color:inherit">mf.akeef@gmail.com</a>
+
+def too_many_requests(template, wait, **context):
+    """Re-render a form with a 429 after a rate limit was hit."""
+    flash(f'Too many attempts. Try again in {int(wait) + 1} seconds.', 'danger')
+    return render_template(template, **context), 429, {'Retry-After': str(int(wait) + 1)}
+
+def send_otp_email(email, otp):
+    """Queue the OTP email for background delivery; returns the mail job id."""
+    from flask_mail import Message
+
+    mail_queue.start()
+    msg = Message("ExpenseTracker OTP", sender=current_app.config.get('MAIL_USERNAME'), recipients=[email])
+    msg.body = f"Your OTP for password reset is: {otp}\nIt expires in 10 minutes."
+
+    def undelivered(message, error):
+        print("Mail sending failed:", error)
+        print("Generated OTP for", email, "->", otp)
+
+    return mail_queue.enqueue(msg, on_failure=undelivered)
+
+# Dropdown data for the add-expense form: (country, currency, symbol, flag)
+COUNTRIES = sorted([
+    ('India', 'INR', '₹', ''),
+    ('United States', 'USD', '$', ''),
+    ('United Kingdom', 'GBP', '£', ''),
+    ('Canada', 'CAD', '$', ''),
+    ('Australia', 'AUD', '$', ''),
+    ('Germany', 'EUR', '€', ''),
+    ('France', 'EUR', '€', ''),
+    ('Japan', 'JPY', '¥', ''),
+    ('China', 'CNY', '¥', ''),
+    ('Singapore', 'SGD', '$', ''),
+    # ... (add more as needed)
+])
+CATEGORIES = [
+    'Food', 'Travel', 'Bills', 'Groceries', 'Shopping', 'Health', 'Education', 'Entertainment',
+    'Rent', 'Utilities', 'Transport', 'Fuel', 'Insurance', 'Gifts', 'Charity', 'Investment',
+    'Kids', 'Pets', 'Personal Care', 'Fitness', 'Phone', 'Internet', 'Subscriptions', 'Other'
+]
+
 # --- Routes ---
 
-@app.route('/')
+@bp.route('/')
 def index():
-    return redirect(url_for('dashboard') if session.get('user_id') else url_for('login'))
+    return redirect(url_for('main.dashboard') if session.get('user_id') else url_for('main.login'))
 
 # Register
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email = (request.form.get('email') or '').strip().lower()
         password = request.form.get('password') or ''
         if not email or not password:
             flash('Email and password required', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         if User.query.filter_by(email=email).first():
             flash('This email may already be registered', 'danger')
-            return redirect(url_for('register'))
-        pw_hash = generate_password_hash(password)
+            return redirect(url_for('main.register'))
         try:
+            pw_hash = hasher.hash(password)
             user = User(email=email, password_hash=pw_hash)
             db.session.add(user)
             db.session.commit()
             flash('Registered successfully — login now', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         except Exception as e:
             db.session.rollback()
             print("Register error:", e)
             flash('Server error during registration', 'danger')
-            return redirect(url_for('register'))
-
-    content = """
-    <div class="card form-wrap">
-      <h2>Register</h2>
-      <form method="POST" autocomplete="off">
-        <label>Email</label>
-        <input type="email" name="email" required placeholder="you@example.com">
-        <label>Password</label>
-        <div class="pw-wrap">
-          <input id="reg_pw" type="password" name="password" required placeholder="At least 6 characters">
-          <span class="pw-toggle" onclick="toggleInputPassword('reg_pw', this)">SHOW</span>
-        </div>
-        <button class="btn btn-primary" type="submit">Register</button>
-        <p class="muted small">Already registered? <a href="{{ url_for('login') }}">Login</a></p>
-      </form>
-    </div>
-    """
-    return render_template_string(BASE_HTML, content=content)
+            return redirect(url_for('main.register'))
+
+    return render_template('register.html')
 
 # Login
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = (request.form.get('email') or '').strip().lower()
         password = request.form.get('password') or ''
         if not email or not password:
             flash('Provide email and password', 'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            valid = bool(user) and hasher.verify(user.password_hash, password)
+        except Exception as e:
+            print("Login hashing error:", e)
+            flash('Server busy, please try again', 'danger')
+            return redirect(url_for('main.login'))
+        if valid:
+            if hasher.needs_rehash(user.password_hash):
+                # Stored hash predates the current work factor; upgrade it
+                # now that we have the plaintext.
+                try:
+                    user.password_hash = hasher.hash(password)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print("Rehash error:", e)
             session.clear()
             session['user_id'] = user.id
             session['email'] = user.email
+            session['home_currency'] = user.home_currency
             flash('Login successful', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid credentials', 'danger')
 
-    content = """
-    <div class="card form-wrap">
-      <h2>Login</h2>
-      <form method="POST" autocomplete="off">
-        <label>Email</label>
-        <input type="email" name="email" required placeholder="you@example.com">
-        <label>Password</label>
-        <div class="pw-wrap">
-          <input id="login_pw" type="password" name="password" required placeholder="Password">
-          <span class="pw-toggle" onclick="toggleInputPassword('login_pw', this)">SHOW</span>
-        </div>
-        <button class="btn btn-primary" type="submit">Login</button>
-        <p class="muted small"><a href="{{ url_for('reset_request') }}">Forgot password?</a></p>
-        <p class="muted small">New? <a href="{{ url_for('register') }}">Register here</a></p>
-      </form>
-    </div>
-    """
-    rendered_content = render_template_string(content)
-    return render_template_string(BASE_HTML, content=rendered_content)
+    return render_template('login.html')
  
 # Logout
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     session.clear()
     flash('Logged out', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # Reset request (send OTP)
-@app.route('/reset_request', methods=['GET', 'POST'])
+@bp.route('/reset_request', methods=['GET', 'POST'])
 def reset_request():
     if request.method == 'POST':
         email = (request.form.get('email') or '').strip().lower()
         if not email:
             flash('Enter your registered email', 'danger')
-            return redirect(url_for('reset_request'))
+            return redirect(url_for('main.reset_request'))
+        wait = rate_limits.hit(otp_send=email, otp_send_ip=request.remote_addr)
+        if wait:
+            return too_many_requests('reset_request.html', wait)
         otp = generate_otp()
         expires_at = datetime.now() + timedelta(minutes=10)
         try:
-            # remove old OTPs
-            OTPVerification.query.filter_by(email=email).delete()
-            db.session.commit()
-            # add new
-            new = OTPVerification(email=email, otp=otp, expires_at=expires_at)
-            db.session.add(new)
+            store_otp(email, otp, expires_at)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             print("OTP DB error:", e)
             flash('Server error creating OTP', 'danger')
-            return redirect(url_for('reset_request'))
+            return redirect(url_for('main.reset_request'))
 
-        sent = send_otp_email(email, otp)
-        if sent:
-            flash('OTP sent to your email (expires in 10 minutes)', 'success')
-        else:
-            print("Generated OTP for", email, "->", otp)
-            flash('Could not send email; OTP generated on server (check console).', 'info')
-
-        return redirect(url_for('otp_verify', email=email))
-
-    content = """
-    <div class="card form-wrap">
-      <h2>Reset Password</h2>
-      <form method="POST">
-        <label>Email</label>
-        <input type="email" name="email" required placeholder="Registered email">
-        <button class="btn btn-primary" type="submit">Send OTP</button>
-      </form>
-    </div>
-    """
-    return render_template_string(BASE_HTML, content=content)
+        session['otp_mail_job'] = send_otp_email(email, otp)
+        flash('OTP is on its way to your email (expires in 10 minutes)', 'success')
+        return redirect(url_for('main.otp_verify', email=email))
+
+    return render_template('reset_request.html')
 
 # OTP verify
-@app.route('/otp-verify', methods=['GET', 'POST'])
-@app.route('/otp-verify/<email>', methods=['GET', 'POST'])
+@bp.route('/otp-verify', methods=['GET', 'POST'])
+@bp.route('/otp-verify/<email>', methods=['GET', 'POST'])
 def otp_verify(email=None):
     email = (email or request.args.get('email') or request.form.get('email') or '').strip().lower()
     if request.method == 'POST':
@@ -417,191 +674,201 @@ def otp_verify(email=None):
         otp_input = (request.form.get('otp') or '').strip()
         if not email or not otp_input:
             flash('Email and OTP required', 'danger')
-            return redirect(url_for('reset_request'))
-        row = OTPVerification.query.filter_by(email=email).order_by(OTPVerification.id.desc()).first()
+            return redirect(url_for('main.reset_request'))
+        wait = rate_limits.hit(otp_verify=email, otp_verify_ip=request.remote_addr)
+        if wait:
+            return too_many_requests('otp_verify.html', wait, email=email, mail_status=None)
+        row = OTPVerification.query.filter_by(email=email).first()
         if not row:
             flash('No OTP found for this email. Request a new one.', 'danger')
-            return redirect(url_for('reset_request'))
+            return redirect(url_for('main.reset_request'))
         db_otp, expires_at = row.otp, row.expires_at
         if datetime.now() > expires_at:
             flash('OTP expired. Request a new one.', 'danger')
-            return redirect(url_for('reset_request'))
-        if otp_input != db_otp:
+            return redirect(url_for('main.reset_request'))
+        if not hmac.compare_digest(otp_input.encode(), (db_otp or '').encode()):
             flash('Incorrect OTP', 'danger')
-            return redirect(url_for('otp_verify', email=email))
+            return redirect(url_for('main.otp_verify', email=email))
         session['verified_email'] = email
         flash('OTP verified — set your new password', 'success')
-        return redirect(url_for('reset_password'))
-
-    content = f"""
-    <div class="card form-wrap">
-      <h2>Verify OTP</h2>
-      <form method="POST">
-        <label>Email</label>
-        <input type="email" name="email" required value="{email}">
-        <label>OTP (6 digits)</label>
-        <input type="text" name="otp" maxlength="6" required placeholder="123456">
-        <button class="btn btn-primary" type="submit">Verify OTP</button>
-      </form>
-      <p class="muted small">Didn't get OTP? <a href="{{ url_for('reset_request') }}">Send again</a></p>
-    </div>
-    """
-    return render_template_string(BASE_HTML, content=content)
+        return redirect(url_for('main.reset_password'))
+
+    mail_status = mail_queue.status(session.get('otp_mail_job'))
+    return render_template('otp_verify.html', email=email, mail_status=mail_status)
 
 # Set new password (after OTP)
-@app.route('/reset_password', methods=['GET', 'POST'])
+@bp.route('/reset_password', methods=['GET', 'POST'])
 def reset_password():
     if 'verified_email' not in session:
         flash('You must verify OTP first', 'danger')
-        return redirect(url_for('reset_request'))
+        return redirect(url_for('main.reset_request'))
     email = session['verified_email']
     if request.method == 'POST':
         new_pw = request.form.get('new_password') or ''
         if len(new_pw) < 6:
             flash('Password must be at least 6 characters', 'danger')
-            return redirect(url_for('reset_password'))
-        hashed = generate_password_hash(new_pw)
+            return redirect(url_for('main.reset_password'))
         try:
+            hashed = hasher.hash(new_pw)
             user = User.query.filter_by(email=email).first()
             if not user:
                 flash('User not found', 'danger')
-                return redirect(url_for('register'))
+                return redirect(url_for('main.register'))
             user.password_hash = hashed
             # cleanup OTPs
             OTPVerification.query.filter_by(email=email).delete()
             db.session.commit()
             session.pop('verified_email', None)
             flash('Password updated. Please login.', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         except Exception as e:
             db.session.rollback()
             print("Reset password error:", e)
             flash('Failed to update password', 'danger')
-            return redirect(url_for('reset_password'))
+            return redirect(url_for('main.reset_password'))
             
 
-    content = """
-    <div class="card form-wrap">
-      <h2>Set New Password</h2>
-      <form method="POST" autocomplete="off">
-        <label>New Password</label>
-        <div class="pw-wrap">
-          <input id="new_pw" type="password" name="new_password" required placeholder="New password">
-          <span class="pw-toggle" onclick="toggleInputPassword('new_pw', this)">SHOW</span>
-        </div>
-        <button class="btn btn-success" type="submit">Set Password</button>
-      </form>
-    </div>
-    """
-    return render_template_string(BASE_HTML, content=content)
+    return render_template('reset_password.html')
     
 
 # Dashboard
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
+    page_size = current_app.config['DASHBOARD_PAGE_SIZE']
+    home = home_currency()
+    etag, last_modified = page_validators(
+        'dashboard', home, fx_rates.version, request.args.get('after'), request.args.get('before'))
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+    after = parse_cursor(request.args.get('after'))
+    before = parse_cursor(request.args.get('before'))
+    next_cursor = prev_cursor = None
     try:
-        rows = Expense.query.filter_by(user_id=session['user_id']).order_by(Expense.date.desc(), Expense.id.desc()).all()
+        # Keyset pagination on (date, id): each page is an index range scan
+        # (two where it reaches the undated rows), however much history the
+        # user has.
+        rows, next_cursor, prev_cursor = fetch_page(session['user_id'], after, before, page_size)
+        # Totals come from the monthly rollup (a few rows per month of
+        # history), converted into the home currency in one batch
+        import numpy as np
         today = datetime.now().date()
-        total_year = db.session.query(func.coalesce(func.sum(Expense.amount), 0)).filter(
-            Expense.user_id == session['user_id'],
-            extract('year', Expense.date) == today.year
-        ).scalar() or 0
-        total_month = db.session.query(func.coalesce(func.sum(Expense.amount), 0)).filter(
-            Expense.user_id == session['user_id'],
-            extract('year', Expense.date) == today.year,
-            extract('month', Expense.date) == today.month
-        ).scalar() or 0
+        months, amounts, missing = converted_monthly_totals(session['user_id'], home, today)
+
+        def total_between(start, end):
+            in_period = (months >= np.datetime64(start)) & (months < np.datetime64(end))
+            return float(np.nansum(amounts[in_period]))
+
+        total_year = total_between(*year_range(today))
+        total_month = total_between(*month_range(today))
         # Get latest credit for user
-        credit_row = Credit.query.filter_by(user_id=session['user_id']).order_by(Credit.id.desc()).first()
-        credit_amount = float(credit_row.amount) if credit_row else 0.0
-        total_expenses = db.session.query(func.coalesce(func.sum(Expense.amount), 0)).filter(
-            Expense.user_id == session['user_id']
-        ).scalar() or 0.0
-        balance = credit_amount - float(total_expenses)
+        credit_row = latest_credit_query(session['user_id']).first()
+        credit_amount = converted_credit(credit_row, home) if credit_row else 0.0
+        if credit_amount is None:
+            missing.add(credit_row.currency or current_app.config['HOME_CURRENCY'])
+            credit_amount = 0.0
+        # All credits less all expenses, one ledger row per currency
+        balance, unconverted = converted_balance(ledger.current_balances(session['user_id']), home, today)
+        missing |= unconverted
     except Exception as e:
         print("Dashboard DB error:", e)
         rows = []
         total_year = total_month = 0
         credit_amount = 0.0
         balance = 0.0
+        missing = set()
+
+    # Pop flashed messages now: a streamed body renders after the session
+    # cookie has been sent, so popping them mid-stream would not stick.
+    flashes = get_flashed_messages(with_categories=True)
+    response = Response(stream_template(
+        'dashboard.html', rows=rows, total_month=total_month, total_year=total_year,
+        credit_amount=credit_amount, balance=balance,
+        home_currency=home, unconverted=sorted(missing), currencies=sorted({home, *fx_rates.currencies()}),
+        next_cursor=next_cursor, prev_cursor=prev_cursor,
+    ))
+    if flashes:
+        # A one-off page: a later 304 must not bring its messages back
+        response.cache_control.no_store = True
+        return response
+    return with_validators(response, etag, last_modified)
 
-    # Build rows HTML
-    rows_html = ""
-    for r in rows:
+SEARCH_PARAMS = ('q', 'country', 'currency', 'category', 'min_amount', 'max_amount', 'start', 'end')
+
+# Search expenses by text and filters, paged like the dashboard
+@bp.route('/search')
+@login_required
+def search_expenses():
+    page_size = current_app.config['DASHBOARD_PAGE_SIZE']
+    rows, error = [], None
+    next_cursor = prev_cursor = None
+    try:
+        filters = search.parse_filters(request.args)
+    except ValueError as e:
+        filters, error = {}, str(e)
+    # Echoed back into the form and the paging links
+    params = {k: request.args[k] for k in SEARCH_PARAMS if request.args.get(k)}
+    if filters:
+        after = parse_cursor(request.args.get('after'))
+        before = parse_cursor(request.args.get('before'))
         try:
-            amount_val = float(r.amount)
-        except Exception:
-            amount_val = 0.0
-        rows_html += f"""
-        <tr>
-          <td>{r.date}</td>
-          <td>{r.country or ''}</td>
-          <td>{r.category or ''}</td>
-          <td>{amount_val:.2f}</td>
-          <td>{r.description or ''}</td>
-          <td>
-            <form method="POST" action="{ url_for('delete', id=r.id) }" onsubmit="return confirmDelete();">
-              <button class="btn btn-danger" type="submit">Delete</button>
-            </form>
-          </td>
-        </tr>
-        """
-    content = f"""
-    <div class="card">
-      <h2>Dashboard</h2>
-      <div class="row" style="align-items:center;justify-content:space-between;margin-bottom:8px">
-        <div class="col small">This Month: <strong>{float(total_month):.2f}</strong></div>
-        <div class="col small">This Year: <strong>{float(total_year):.2f}</strong></div>
-        <div class="col small">Credit Amount: <strong>{credit_amount:.2f}</strong></div>
-        <div class="col small">Current Balance: <strong>{balance:.2f}</strong></div>
-        <div style="min-width:200px;text-align:right">
-          <a class="btn btn-primary" href="{ url_for('add_expense') }">Add Expense</a>
-          <a class="btn btn-success" href="{ url_for('add_credit') }">Credit Amount</a>
-        </div>
-      </div>
-      <div class="table-container">
-      <table class="table">
-        <thead><tr><th>Date</th><th>Country</th><th>Category</th><th>Amount</th><th>Description</th><th>Action</th></tr></thead>
-        <tbody>
-          {rows_html if rows_html else '<tr><td colspan="6" class="muted">No expenses yet.</td></tr>'}
-        </tbody>
-      </table>
-      </div>
-    </div>
-    """
-    return render_template_string(BASE_HTML, content=content)
+            rows, next_cursor, prev_cursor = fetch_page(
+                session['user_id'], after, before, page_size, query=search.search_query(session['user_id'], **filters))
+        except Exception as e:
+            db.session.rollback()
+            print("Search error:", e)
+            error = 'Search failed'
+    return render_template(
+        'search.html', rows=rows, params=params, error=error, searched=bool(filters),
+        countries=COUNTRIES, categories=CATEGORIES, next_cursor=next_cursor, prev_cursor=prev_cursor,
+    )
+
+
+# Currency the dashboard and statements show totals in
+@bp.route('/home_currency', methods=['POST'])
+@login_required
+def set_home_currency():
+    currency = (request.form.get('currency') or '').strip().upper()
+    if currency not in fx_rates.currencies() and currency != current_app.config['HOME_CURRENCY']:
+        flash('No exchange rates are loaded for that currency', 'danger')
+        return redirect(url_for('main.dashboard'))
+    try:
+        user = db.session.get(User, session['user_id'])
+        user.home_currency = currency
+        bump_data_version(user.id)
+        db.session.commit()
+        session['home_currency'] = currency
+        flash(f'Totals are now shown in {currency}', 'success')
+    except Exception as e:
+        db.session.rollback()
+        print('Home currency error:', e)
+        flash('Failed to change currency', 'danger')
+    return redirect(url_for('main.dashboard'))
 # Add credit amount
-@app.route('/add_credit', methods=['GET', 'POST'])
+@bp.route('/add_credit', methods=['GET', 'POST'])
 @login_required
 def add_credit():
     if request.method == 'POST':
         amount = request.form.get('amount')
         try:
-            credit = Credit(user_id=session['user_id'], amount=amount)
+            credit = Credit(user_id=session['user_id'], amount=Decimal(amount), currency=home_currency())
             db.session.add(credit)
+            db.session.flush()
+            ledger.post(credit.user_id, [(credit.currency, datetime.now().date(), credit.amount, 'credit', credit.id)])
+            bump_data_version(credit.user_id)
             db.session.commit()
             flash('Credit amount added!', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         except Exception as e:
             db.session.rollback()
             print('Add credit error:', e)
             flash('Failed to add credit', 'danger')
 
-    content = '''
-    <div class="card form-wrap">
-      <h2>Add Credit Amount</h2>
-      <form method="POST">
-        <label>Credit Amount</label>
-        <input type="number" name="amount" step="0.01" min="0" required placeholder="Enter credit amount">
-        <button class="btn btn-success" type="submit">Add Credit</button>
-      </form>
-    </div>
-    '''
-    return render_template_string(BASE_HTML, content=content)
+    return render_template('add_credit.html', home_currency=home_currency())
 
 # Add expense
-@app.route('/add', methods=['GET', 'POST'])
+@bp.route('/add', methods=['GET', 'POST'])
 @login_required
 def add_expense():
     if request.method == 'POST':
@@ -611,6 +878,7 @@ def add_expense():
       amount = request.form.get('amount') or ''
       date = request.form.get('date') or ''
       description = request.form.get('description') or ''
+      receipt_id = request.form.get('receipt_id', type=int)
       # Save last used country/currency in session
       session['last_country'] = country
       session['last_currency'] = currency
@@ -621,193 +889,855 @@ def add_expense():
           country=country,
           currency=currency,
           category=category,
-          amount=amount,
-          date=date,
+          amount=Decimal(amount),
+          date=datetime.strptime(date, '%Y-%m-%d').date(),
           description=description
         )
         db.session.add(exp)
+        db.session.flush()
+        deltas = {}
+        add_to_monthly_totals(deltas, exp.date, exp.currency, exp.amount)
+        apply_monthly_totals(exp.user_id, deltas)
+        ledger.post(exp.user_id, [(exp.currency, exp.date, -exp.amount, 'expense', exp.id)])
+        if receipt_id:
+          db.session.execute(update(Receipt).where(
+            Receipt.id == receipt_id, Receipt.user_id == exp.user_id, Receipt.expense_id.is_(None),
+          ).values(expense_id=exp.id))
+        bump_data_version(exp.user_id)
         db.session.commit()
+        invalidate_statements(exp.user_id, deltas)
         flash('Expense added!', 'success')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
       except Exception as e:
         db.session.rollback()
         print('Add expense error:', e)
         flash('Failed to add expense', 'danger')
 
-    # Data for dropdowns
-    countries = [
-        ('India', 'INR', '₹', ''),
-        ('United States', 'USD', '$', ''),
-        ('United Kingdom', 'GBP', '£', ''),
-        ('Canada', 'CAD', '$', ''),
-        ('Australia', 'AUD', '$', ''),
-        ('Germany', 'EUR', '€', ''),
-        ('France', 'EUR', '€', ''),
-        ('Japan', 'JPY', '¥', ''),
-        ('China', 'CNY', '¥', ''),
-        ('Singapore', 'SGD', '$', ''),
-        # ... (add more as needed)
-    ]
-    # Add more countries as needed, or use your full list
-    countries.sort(key=lambda x: x[0])
-    categories = [
-        'Food', 'Travel', 'Bills', 'Groceries', 'Shopping', 'Health', 'Education', 'Entertainment',
-        'Rent', 'Utilities', 'Transport', 'Fuel', 'Insurance', 'Gifts', 'Charity', 'Investment',
-        'Kids', 'Pets', 'Personal Care', 'Fitness', 'Phone', 'Internet', 'Subscriptions', 'Other'
-    ]
+    # Pre-fill from a processed receipt (?receipt=<id>)
+    receipt = None
+    if request.args.get('receipt', type=int):
+        receipt = Receipt.query.filter_by(
+            id=request.args.get('receipt', type=int), user_id=session['user_id'], status='ready').first()
     # Remember last used country/currency (from session)
-    last_country = session.get('last_country', 'India')
-    last_currency = session.get('last_currency', 'INR')
-    # today = datetime.now().date()
-    # Build country options with data attributes for currency
-    country_options = ''.join([
-        f'<option value="{c[0]}" data-currency="{c[1]}" data-symbol="{c[2]}" data-flag="{c[3]}"' + (' selected' if c[0] == last_country else '') + f'>{c[3]} {c[0]}</option>'
-        for c in countries
-    ])
-    category_options = ''.join([
-        f'<option value="{cat}">{cat}</option>' for cat in categories
-    ])
-    # The currency field will be auto-filled and readonly
-    content = f'''
-    <div class="card">
-      <h2>Add Expense</h2>
-      <form method="POST">
-        <div class="row">
-          <div class="col">
-            <label for="countrySelect">Country</label>
-            <select name="country" id="countrySelect" required>
-              <option value="" disabled>Select country</option>
-              {country_options}
-            </select>
-          </div>
-          <div class="col">
-            <label for="currencyInput">Currency</label>
-            <input type="text" name="currency" id="currencyInput" value="{last_currency}" readonly required>
-          </div>
-        </div>
-
-        <label>Category</label>
-        <select name="category" required>
-          <option value="" disabled selected>Select category</option>
-          {category_options}
-        </select>
-
-        <div class="row">
-          <div class="col">
-            <label>Amount</label>
-            <input type="text" name="amount" placeholder="0.00" required>
-          </div>
-          <div class="col">
-            <label>Date</label>
-            <input type="date" name="date" id="dateInput">
-          </div>
-        </div>
-
-        <label>Description</label>
-        <textarea name="description" placeholder="Optional note..."></textarea>
-
-        <button class="btn btn-success" type="submit">Save</button>
-        <button type="button" class="btn" onclick="calculateTotal()">Calculator</button>
-      </form>
-    </div>
-    <script>
-    // When country changes, update currency automatically
-    document.getElementById("countrySelect").addEventListener("change", function() {{
-      var selected = this.options[this.selectedIndex];
-      var currency = selected.getAttribute('data-currency') || '';
-      document.getElementById("currencyInput").value = currency;
-    }});
-    // On page load, set currency if a country is pre-selected and set date to today
-    window.addEventListener('DOMContentLoaded', function() {{
-      var select = document.getElementById("countrySelect");
-      var selected = select.options[select.selectedIndex];
-      if(selected && selected.getAttribute('data-currency')) {{
-        document.getElementById("currencyInput").value = selected.getAttribute('data-currency');
-      }}
-      // Set date input to today
-      var dateInput = document.getElementById('dateInput');
-      if(dateInput) {{
-        var today = new Date();
-        var yyyy = today.getFullYear();
-        var mm = String(today.getMonth() + 1).padStart(2, '0');
-        var dd = String(today.getDate()).padStart(2, '0');
-        dateInput.value = yyyy + '-' + mm + '-' + dd;
-      }}            
-    }});
-    </script>
-    '''
-    return render_template_string(BASE_HTML, content=content)
+    return render_template(
+        'add_expense.html', countries=COUNTRIES, categories=CATEGORIES, receipt=receipt,
+        last_country=session.get('last_country', 'India'),
+        last_currency=session.get('last_currency', 'INR'),
+    )
+
+# Bulk import from CSV/XLSX
+@bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_expenses():
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or XLSX file', 'danger')
+            return redirect(url_for('main.import_expenses'))
+        try:
+            result = load_expense_file(session['user_id'], upload.stream, upload.filename)
+            flash(f'Imported {result.imported} expenses', 'success' if result.imported else 'info')
+        except Exception as e:
+            db.session.rollback()
+            print('Import error:', e)
+            flash('Import failed; nothing was saved', 'danger')
+    return render_template('import.html', result=result, columns=importer.COLUMNS)
+
+# Receipts: list, and plain form upload (the page's script uses the chunked API)
+@bp.route('/receipts', methods=['GET', 'POST'])
+@login_required
+def receipts_page():
+    user_id = session['user_id']
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a receipt image', 'danger')
+        elif upload.mimetype not in RECEIPT_TYPES:
+            flash('Receipts must be JPEG, PNG, WebP or GIF images', 'danger')
+        else:
+            try:
+                _, created = receipt_store.save(user_id, upload.stream, upload.filename, upload.mimetype)
+                if created:
+                    flash('Receipt uploaded; it will be read in the background', 'success')
+                else:
+                    flash('You already uploaded this receipt', 'info')
+            except ValueError as e:
+                flash(str(e), 'danger')
+            except Exception as e:
+                db.session.rollback()
+                print('Receipt upload error:', e)
+                flash('Upload failed', 'danger')
+        return redirect(url_for('main.receipts_page'))
+    page_size = current_app.config['DASHBOARD_PAGE_SIZE']
+    query = Receipt.query.filter_by(user_id=user_id)
+    older = request.args.get('older', type=int)
+    if older:
+        query = query.filter(Receipt.id < older)
+    rows = query.order_by(Receipt.id.desc()).limit(page_size + 1).all()
+    return render_template(
+        'receipts.html', rows=rows[:page_size], older=rows[page_size - 1].id if len(rows) > page_size else None,
+        pending=any(r.status == 'pending' for r in rows), types=RECEIPT_TYPES,
+        max_mb=current_app.config['RECEIPT_MAX_MB'], chunk_size=receipt_store.chunk_bytes,
+    )
+
+# Receipt images: the original upload, or a derived image once processed
+@bp.route('/receipts/<int:receipt_id>/<kind>')
+@login_required
+def receipt_file(receipt_id, kind):
+    if kind != 'original' and kind not in IMAGE_KINDS:
+        abort(404)
+    receipt = Receipt.query.filter_by(id=receipt_id, user_id=session['user_id']).first_or_404()
+    if kind != 'original' and receipt.status != 'ready':
+        if receipt.status == 'failed':
+            abort(404)
+        return Response(RECEIPT_PLACEHOLDER_SVG, status=202, mimetype='image/svg+xml',
+                        headers={'Retry-After': '2', 'Cache-Control': 'no-store'})
+    path = receipt_store.path(receipt.sha256, kind)
+    if not os.path.exists(path):
+        abort(404)
+    # Content-addressed, so a URL's bytes never change while the receipt exists
+    response = send_file(
+        path, mimetype=receipt.content_type if kind == 'original' else 'image/jpeg',
+        etag=f'{receipt.sha256}.{kind}', max_age=86400, conditional=True,
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@bp.route('/receipts/<int:receipt_id>/delete', methods=['POST'])
+@login_required
+def delete_receipt(receipt_id):
+    try:
+        if receipt_store.delete(session['user_id'], receipt_id):
+            flash('Receipt deleted', 'success')
+    except Exception as e:
+        db.session.rollback()
+        print('Receipt delete error:', e)
+        flash('Delete failed', 'danger')
+    return redirect(url_for('main.receipts_page'))
+
+# Resumable receipt upload: POST {filename, size, content_type} to start, then
+# PATCH chunks with an Upload-Offset header; GET (or HEAD) reports the offset
+# to resume from. The chunk that completes the file answers with the receipt.
+@bp.route('/api/receipts/uploads', methods=['POST'])
+@api_login_required
+def receipt_upload_create():
+    payload = request.get_json(silent=True) or {}
+    size = payload.get('size')
+    content_type = payload.get('content_type')
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        return jsonify(error='"size" must be a positive integer'), 400
+    if size > receipt_store.max_bytes:
+        return jsonify(error=f"receipts are limited to {current_app.config['RECEIPT_MAX_MB']} MB"), 413
+    if content_type not in RECEIPT_TYPES:
+        return jsonify(error=f'"content_type" must be one of {", ".join(RECEIPT_TYPES)}'), 415
+    filename = str(payload.get('filename') or '')[:255]
+    upload_id = receipt_store.create_upload(session['user_id'], size, filename, content_type)
+    location = url_for('main.receipt_upload', upload_id=upload_id)
+    return (jsonify(id=upload_id, offset=0, size=size, chunk_size=receipt_store.chunk_bytes), 201,
+            {'Location': location, 'Upload-Offset': '0'})
+
+@bp.route('/api/receipts/uploads/<upload_id>', methods=['GET', 'PATCH'])
+@api_login_required
+def receipt_upload(upload_id):
+    user_id = session['user_id']
+    info = receipt_store.upload_info(user_id, upload_id)
+    if info is None:
+        return jsonify(error='unknown or expired upload'), 404
+    if 'receipt_id' in info:
+        receipt = db.session.get(Receipt, info['receipt_id'])
+        if receipt is None:
+            return jsonify(error='the receipt was deleted'), 410
+        return jsonify(id=upload_id, offset=info['size'], size=info['size'], receipt=receipt_json(receipt))
+    if request.method == 'GET':
+        return jsonify(id=upload_id, offset=info['offset'], size=info['size']), {'Upload-Offset': str(info['offset'])}
+
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify(error='Upload-Offset header required'), 400
+    length = request.content_length
+    if length is None:
+        return jsonify(error='Content-Length required'), 411
+    if length > receipt_store.chunk_bytes:
+        return jsonify(error=f'chunks are limited to {receipt_store.chunk_bytes} bytes'), 413
+    try:
+        offset = receipt_store.append(user_id, upload_id, offset, request.stream, length)
+    except UploadConflict as e:
+        return jsonify(error='offset mismatch', offset=e.offset), 409, {'Upload-Offset': str(e.offset)}
+    if offset < info['size']:
+        return jsonify(id=upload_id, offset=offset, size=info['size']), {'Upload-Offset': str(offset)}
+    try:
+        receipt, created = receipt_store.complete(user_id, upload_id)
+    except Exception as e:
+        db.session.rollback()
+        print('Receipt upload error:', e)
+        return jsonify(error='could not store the receipt'), 500
+    return (jsonify(id=upload_id, offset=offset, size=info['size'], receipt=receipt_json(receipt), duplicate=not created),
+            201 if created else 200, {'Upload-Offset': str(offset)})
+
+@bp.route('/api/receipts/<int:receipt_id>')
+@api_login_required
+def receipt_api(receipt_id):
+    receipt = Receipt.query.filter_by(id=receipt_id, user_id=session['user_id']).first()
+    if receipt is None:
+        return jsonify(error='not found'), 404
+    return jsonify(receipt_json(receipt))
 
 # Delete - POST only
-@app.route('/delete/<int:id>', methods=['POST'])
+@bp.route('/delete/<int:id>', methods=['POST'])
 @login_required
 def delete(id):
     try:
-        Expense.query.filter_by(id=id, user_id=session['user_id']).delete()
+        removed = db.session.execute(
+            sa_delete(Expense)
+            .where(Expense.id == id, Expense.user_id == session['user_id'])
+            .returning(Expense.id, Expense.date, Expense.currency, Expense.amount)
+        ).all()
+        deltas = {}
+        for _, exp_date, currency, amount in removed:
+            add_to_monthly_totals(deltas, exp_date, currency, -amount, count=-1)
+        apply_monthly_totals(session['user_id'], deltas)
+        post_reversals(session['user_id'], removed)
+        if removed:
+            bump_data_version(session['user_id'])
         db.session.commit()
+        invalidate_statements(session['user_id'], deltas)
         flash('Deleted', 'success')
     except Exception as e:
         db.session.rollback()
         print("Delete error:", e)
         flash('Delete failed', 'danger')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('main.dashboard'))
+
+# Batch create/delete for API clients (JSON in, per-item results out)
+@bp.route('/api/expenses/batch', methods=['POST'])
+@api_login_required
+def expenses_batch():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error='expected a JSON object with "create" and/or "delete"'), 400
+    creates = payload.get('create') or []
+    deletes = payload.get('delete') or []
+    if not isinstance(creates, list) or not isinstance(deletes, list):
+        return jsonify(error='"create" and "delete" must be arrays'), 400
+    if len(creates) + len(deletes) > current_app.config['API_BATCH_MAX_ITEMS']:
+        return jsonify(error=f"at most {current_app.config['API_BATCH_MAX_ITEMS']} items per batch"), 413
+
+    user_id = session['user_id']
+    created = [None] * len(creates)
+    valid, positions = [], []
+    for i, item in enumerate(creates):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('expected an object')
+            valid.append(importer.validate(item))
+            positions.append(i)
+        except ValueError as e:
+            created[i] = {'index': i, 'error': str(e)}
+    def is_id(item):
+        return isinstance(item, int) and not isinstance(item, bool)
+    delete_ids = {item for item in deletes if is_id(item)}
+
+    try:
+        deltas = {}
+        new_ids = create_expenses(user_id, valid, deltas)
+        removed = delete_expenses(user_id, delete_ids, deltas)
+        apply_monthly_totals(user_id, deltas)
+        if new_ids or removed:
+            bump_data_version(user_id)
+        db.session.commit()
+        invalidate_statements(user_id, deltas)
+    except Exception as e:
+        db.session.rollback()
+        print("Batch API error:", e)
+        return jsonify(error='batch failed; nothing was saved'), 500
+
+    for i, row_id in zip(positions, new_ids):
+        created[i] = {'index': i, 'id': row_id}
+    deleted = [
+        {'id': item, 'deleted': item in removed} if is_id(item)
+        else {'id': item, 'deleted': False, 'error': 'expected an integer id'}
+        for item in deletes
+    ]
+    return jsonify(created=created, deleted=deleted)
+
+# Balance now, or at the end of ?date=YYYY-MM-DD, per currency and in the home currency
+@bp.route('/api/balance')
+@api_login_required
+def balance_api():
+    today = datetime.now().date()
+    try:
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else None
+    except ValueError:
+        return jsonify(error='date must be YYYY-MM-DD'), 400
+    user_id = session['user_id']
+    balances = ledger.current_balances(user_id) if day is None or day >= today else ledger.balance_at(user_id, day)
+    home = home_currency()
+    total, missing = converted_balance(balances, home, min(day or today, today))
+    return jsonify(
+        date=(day or today).isoformat(), currency=home, balance=round(total, 2),
+        balances={currency or current_app.config['HOME_CURRENCY']: str(amount) for currency, amount in balances.items()},
+        unconverted=sorted(missing),
+    )
+
+# Statement formats: renderer name in statements.py, mimetype
+DOWNLOAD_FORMATS = {
+    'pdf': ('render_pdf', 'application/pdf'),
+    'csv': ('render_csv', 'text/csv'),
+    'xlsx': ('render_xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def statement_period(args):
+    """Parse ``?period=YYYY-MM`` / ``?year=YYYY`` into ``(name, start, end, title)``.
 
-# Download PDF
-@app.route('/download')
+    Without either it is the whole history. Returns None if malformed.
+    """
+    try:
+        if args.get('period'):
+            start, end = month_range(datetime.strptime(args['period'], '%Y-%m').date())
+            return start.strftime('%Y-%m'), start, end, start.strftime('%B %Y')
+        if args.get('year'):
+            start, end = year_range(datetime.strptime(args['year'], '%Y').date())
+            return str(start.year), start, end, str(start.year)
+    except ValueError:
+        return None
+    return 'all', None, None, None
+
+def period_args(name):
+    """The ``statement_period`` arguments for a period name it returned."""
+    if name == 'all':
+        return {}
+    return {'period': name} if '-' in name else {'year': name}
+
+def statement_render_args(user_id, fmt, home, start, end, title):
+    """Keyword arguments for the format's renderer: a PDF gets its title and
+    the converted total."""
+    if fmt != 'pdf':
+        return {}
+    import numpy as np
+    _, amounts, missing = converted_monthly_totals(user_id, home, datetime.now().date(), start, end)
+    return {'title': title, 'total': (float(np.nansum(amounts)), home, sorted(missing))}
+
+def submit_export(job):
+    _, start, end, title = statement_period(period_args(job.period))
+    export_runner.submit(job, start, end, statement_render_args(job.user_id, job.format, job.currency, start, end, title))
+
+def sweep_exports():
+    """Delete exports past retention and requeue stalled ones; returns how many were deleted."""
+    removed = export_runner.expire()
+    for job in export_runner.requeue_stale():
+        submit_export(job)
+    return removed
+
+export_sweeper = PeriodicTask(sweep_exports, 'EXPORT_SWEEP_SECONDS')
+
+def export_json(job):
+    return {
+        'id': job.id, 'status': job.status, 'format': job.format, 'period': job.period,
+        'rows_done': job.rows_done, 'rows_total': job.rows_total, 'size': job.size, 'error': job.error,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+        'download_url': url_for('main.export_file', job_id=job.id) if job.status == 'done' else None,
+    }
+
+# Download statement (PDF, CSV or XLSX) for a month, a year or everything
+@bp.route('/download')
 @login_required
 def download():
+    fmt = request.args.get('format', 'pdf').lower()
+    period = statement_period(request.args)
+    if fmt not in DOWNLOAD_FORMATS or period is None:
+        abort(404)
+    name, start, end, title = period
+    renderer_name, mimetype = DOWNLOAD_FORMATS[fmt]
+    user_id = session['user_id']
+    filename = 'expenses.' + fmt if name == 'all' else f'expenses-{name}.{fmt}'
+    home = home_currency()
+    # The PDF total is converted, so it also depends on the rates
+    etag, last_modified = page_validators(
+        'download', name, fmt, *((home, fx_rates.version) if fmt == 'pdf' else ()))
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+
+    version = statement_version_query(user_id, start, end).scalar()
+    if fmt == 'pdf':
+        version = f'{version}-{home}-{fx_rates.version}'
+    cached = statement_cache.open(user_id, name, fmt, version)
+    if cached is None:
+        # Rendered by an export job earlier
+        job = ExportJob.query.filter_by(user_id=user_id, period=name, format=fmt, version=str(version)).first()
+        cached = export_runner.open(job) if job is not None else None
+    if cached is not None:
+        response = send_file(cached, mimetype=mimetype, as_attachment=True, download_name=filename, conditional=False)
+        return with_validators(response, etag, last_modified)
+
+    # Too big to render before the worker timeout: hand it to a background job
+    rows_total = statement_row_count(user_id, start, end)
+    if rows_total > current_app.config['EXPORT_SYNC_MAX_ROWS']:
+        return start_export(user_id, name, fmt, str(version), home, filename, rows_total)
+
+    import statements
+    renderer = getattr(statements, renderer_name)
+    # yield_per streams results through a server-side cursor on Postgres
+    query = statement_query(user_id, start, end).yield_per(current_app.config['STATEMENT_BATCH_SIZE'])
+    failed = []
+
+    def rows():
+        # Rows arrive in server-side batches while the document streams out
+        try:
+            yield from query
+        except Exception as e:
+            failed.append(e)
+            print("Download query error:", e)
+            # Headers are gone already; failing the stream aborts the
+            # connection, so the client sees a truncated download instead
+            # of a complete-looking statement with rows missing
+            raise
+
+    body = metrics.timed(renderer(rows(), **statement_render_args(user_id, fmt, home, start, end, title)), fmt)
+    return with_validators(Response(
+        stream_with_context(statement_cache.store(user_id, name, fmt, version, body, complete=lambda: not failed)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    ), etag, last_modified)
+
+def start_export(user_id, period, fmt, version, home, filename, rows_total):
+    """Find or queue the export job for a statement and send the user to it."""
+    existing = ExportJob.query.filter_by(user_id=user_id, period=period, format=fmt, version=version).first()
+    if existing is None and export_runner.active(user_id) >= current_app.config['EXPORT_MAX_ACTIVE_PER_USER']:
+        flash('You already have statements being prepared; try again when they are done', 'danger')
+        return redirect(url_for('main.exports_page')), 303
+    try:
+        job, new = export_runner.job_for(user_id, period, fmt, version, home, filename, rows_total)
+        if new:
+            submit_export(job)
+    except Exception as e:
+        db.session.rollback()
+        print("Export error:", e)
+        flash('Could not start the export', 'danger')
+        return redirect(url_for('main.exports_page')), 303
+    if job.status != 'done':
+        flash('Your statement is being prepared; it will be listed here when ready', 'info')
+    return redirect(url_for('main.exports_page', job=job.id)), 303
+
+# Statements rendered in the background, with progress
+@bp.route('/exports')
+@login_required
+def exports_page():
+    jobs = ExportJob.query.filter_by(user_id=session['user_id']).order_by(ExportJob.id.desc()).limit(20).all()
+    return render_template('exports.html', jobs=jobs, highlight=request.args.get('job', type=int), period_args=period_args)
+
+@bp.route('/api/exports/<int:job_id>')
+@api_login_required
+def export_api(job_id):
+    job = ExportJob.query.filter_by(id=job_id, user_id=session['user_id']).first()
+    if job is None:
+        return jsonify(error='not found'), 404
+    return jsonify(export_json(job))
+
+@bp.route('/exports/<int:job_id>/download')
+@login_required
+def export_file(job_id):
+    job = ExportJob.query.filter_by(id=job_id, user_id=session['user_id']).first_or_404()
+    f = export_runner.open(job)
+    if f is None:
+        abort(404)
+    return send_file(f, mimetype=DOWNLOAD_FORMATS[job.format][1], as_attachment=True, download_name=job.filename)
+
+ANALYTICS_WINDOWS = (3, 6, 12, 24)
+
+def analytics_window(args):
+    months = args.get('months', 12, type=int)
+    return months if months in ANALYTICS_WINDOWS else 12
+
+# Spending by category and month
+@bp.route('/analytics')
+@login_required
+def analytics():
+    months = analytics_window(request.args)
+    home = home_currency()
     try:
-        data = Expense.query.filter_by(user_id=session['user_id']).order_by(Expense.date.desc()).all()
+        by_category, by_month, missing = analytics_breakdowns(session['user_id'], home, datetime.now().date(), months)
+        categories = list(by_category.itertuples())
+        trend = list(by_month.itertuples())
     except Exception as e:
-        print("Download query error:", e)
-        data = []
-
-    class PDF(FPDF):
-        def header(self):
-            self.set_font('Arial', 'B', 14)
-            self.cell(0, 10, 'Expense Statement', 0, 1, 'C')
-            self.ln(2)
-        def footer(self):
-            self.set_y(-15)
-            self.set_font('Arial', 'I', 8)
-            self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
-         
-
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(True, 15)
-    pdf.set_font('Arial', '', 11)
-
-    # Table header
-    pdf.cell(30, 8, 'Date', 1)
-    pdf.cell(30, 8, 'Country', 1)
-    pdf.cell(30, 8, 'Category', 1)
-    pdf.cell(25, 8, 'Amount', 1)
-    pdf.cell(30, 8, 'Currency', 1)
-    pdf.cell(45, 8, 'Description', 1)
-    pdf.ln()
-
-    for r in data:
-        pdf.cell(30, 8, str(r.date), 1)
-        pdf.cell(30, 8, r.country or '', 1)
-        pdf.cell(30, 8, r.category or '', 1)
-        pdf.cell(25, 8, str(r.amount), 1)
-        pdf.cell(30, 8, r.currency or '', 1)
-        pdf.cell(45, 8, (r.description or '')[:30], 1)
-        pdf.ln()
-        
-    total_amount = sum(float(r.amount) for r in data)
-    pdf.set_font('Arial', 'B', 11)
-    pdf.cell(90, 8, 'Total', 1)
-    pdf.cell(25, 8, f"{total_amount:.2f}", 1)
-    pdf.cell(75, 8, '', 1)
-    pdf.ln()    
-
-    # Save to temp file and send
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-        pdf.output(tmp.name)
-        tmp.seek(0)
-        return send_file(tmp.name, as_attachment=True, download_name='expenses.pdf')
-        
+        print("Analytics error:", e)
+        categories, trend, missing = [], [], set()
+    total = sum(row.amount for row in categories)
+    return render_template(
+        'analytics.html', months=months, windows=ANALYTICS_WINDOWS, home_currency=home,
+        categories=categories, trend=trend, total=total, unconverted=sorted(missing),
+    )
+
+# Chart images for the analytics page, rendered in the background
+@bp.route('/analytics/<kind>.<fmt>')
+@login_required
+def analytics_chart(kind, fmt):
+    if kind not in ('categories', 'trend') or fmt not in CHART_FORMATS:
+        abort(404)
+    user_id = session['user_id']
+    months = analytics_window(request.args)
+    home = home_currency()
+    today = datetime.now().date()
+    start, end = add_months(today, 1 - months), month_range(today)[1]
+    # The window moves with the calendar, so it is part of the name
+    name = f'{kind}-{months}m-{today:%Y-%m}'
+    version = f'{statement_version_query(user_id, start, end).scalar()}-{home}-{fx_rates.version}'
+    etag = f'{name}.{version}.{fmt}'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+    cached = charts.get(user_id, name, fmt, version)
+    if cached is not None:
+        return send_file(cached, mimetype=CHART_FORMATS[fmt], etag=etag, max_age=0)
+
+    if charts.pending(user_id, name, fmt, version):
+        # A poll while the render runs: nothing to compute again
+        return chart_placeholder()
+    by_category, by_month, _ = analytics_breakdowns(user_id, home, today, months)
+    if kind == 'categories':
+        labels, values = list(by_category.index), [float(v) for v in by_category['amount']]
+    else:
+        labels, values = [m.strftime('%b %Y') for m in by_month.index], [float(v) for v in by_month['amount']]
+    charts.submit(user_id, name, fmt, version, kind, labels, values, home)
+    return chart_placeholder()
+
+def chart_placeholder():
+    """Stand-in image while a chart renders; the page polls again."""
+    return Response(PLACEHOLDER_SVG, status=202, mimetype='image/svg+xml',
+                    headers={'Retry-After': '1', 'Cache-Control': 'no-store'})
+
+# Connection pool metrics (operators only)
+@bp.route('/admin/pool')
+@admin_required
+def pool_status():
+    return jsonify(pool_stats.snapshot(db.engine.pool))
+
+# Admission control slots, queue depth and rejections (operators only)
+@bp.route('/admin/admission')
+@admin_required
+def admission_status():
+    return jsonify(admission.stats())
+
+# Most recent statements slower than SLOW_QUERY_MS (operators only)
+@bp.route('/admin/slow-queries')
+@admin_required
+def slow_queries():
+    return jsonify(metrics.slow_query_log())
+
+# Recent request profiles (collapsed stacks, for flamegraph tools) (operators only)
+@bp.route('/admin/profiles')
+@admin_required
+def profiles():
+    return jsonify(profiler.list())
+
+@bp.route('/admin/profiles/<profile_id>')
+@admin_required
+def profile_file(profile_id):
+    path = profiler.path(profile_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=profile_id + '.folded')
+
+POOL_GAUGES = ('size', 'checked_out', 'overflow', 'wait_seconds_max')
+ADMISSION_GAUGES = ('slots', 'in_flight', 'waiting', 'max_waiting')
+
+# Prometheus scrape target (operators only; configure the scraper to send X-Admin-Token)
+@bp.route('/metrics')
+@admin_required
+def metrics_endpoint():
+    pool = pool_stats.snapshot(db.engine.pool)
+    sampled = [
+        (f'db_pool_{key}' + ('' if key in POOL_GAUGES or key.endswith('_total') else '_total'),
+         'gauge' if key in POOL_GAUGES else 'counter', f'Connection pool {key.replace("_", " ")}.',
+         [({}, value)])
+        for key, value in pool.items()
+    ]
+    gates = admission.stats()
+    for key in ('admitted', 'rejected_full', 'rejected_timeout') + ADMISSION_GAUGES:
+        sampled.append((
+            f'admission_{key}' + ('' if key in ADMISSION_GAUGES else '_total'),
+            'gauge' if key in ADMISSION_GAUGES else 'counter', f'Admission control {key.replace("_", " ")}.',
+            [({'endpoint': name}, stats[key]) for name, stats in gates.items()],
+        ))
+    return Response(metrics.expose(sampled), mimetype='text/plain; version=0.0.4')
+
+# --- CLI ---
+
+@bp.cli.command('import-expenses')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--email', required=True, help='Owner of the imported expenses.')
+def import_expenses_command(path, email):
+    """Bulk-load expenses for a user from a CSV or XLSX file.
+
+    The first row names the columns: date (YYYY-MM-DD) and amount are
+    required; category, currency, country and description are optional.
+    """
+    user = User.query.filter_by(email=email.strip().lower()).first()
+    if not user:
+        raise click.UsageError(f"No user with email {email}")
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        result = load_expense_file(user.id, f, path)
+    elapsed = time.perf_counter() - started
+    for line, message in result.errors:
+        click.echo(f"line {line}: {message}", err=True)
+    if result.failed > len(result.errors):
+        click.echo(f"... and {result.failed - len(result.errors)} more errors", err=True)
+    rate = result.imported / elapsed * 60 if elapsed else 0
+    click.echo(f"Imported {result.imported} rows ({result.failed} rejected) in {elapsed:.1f}s, {rate:,.0f} rows/min")
+
+@bp.cli.command('sweep-otps')
+def sweep_otps_command():
+    """Delete expired password-reset OTPs (workers also do this periodically)."""
+    click.echo(f"Removed {sweep_expired_otps()} expired OTPs.")
+
+@bp.cli.command('load-fx-rates')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def load_fx_rates_command(path):
+    """Load exchange rates from a local CSV file (date,currency,rate).
+
+    ``rate`` is units of the currency per one unit of FX_BASE_CURRENCY.
+    Rows for a (currency, date) already loaded are replaced.
+    """
+    with open(path, 'rb') as f:
+        try:
+            loaded = load_rates(read_rates(f))
+        except ValueError as e:
+            db.session.rollback()
+            raise SystemExit(f"{path}: {e}; nothing was loaded.")
+    db.session.commit()
+    fx_rates.invalidate()
+    click.echo(f"Loaded {loaded} rates; base currency {fx_rates.base}, currencies: {', '.join(fx_rates.currencies())}")
+
+@bp.cli.command('rollups')
+@click.argument('action', type=click.Choice(['rebuild', 'verify']))
+@click.option('--user-id', type=int, help='Only this user (default: everyone).')
+def rollups_command(action, user_id):
+    """Rebuild or verify expense_monthly_totals from expenses."""
+    month = month_start(Expense.date)
+    source = db.session.query(
+        Expense.user_id, month, func.coalesce(Expense.currency, ''),
+        func.sum(Expense.amount), func.count(Expense.id),
+    ).filter(Expense.date.isnot(None)).group_by(Expense.user_id, month, func.coalesce(Expense.currency, ''))
+    stored = MonthlyTotal.query
+    if user_id is not None:
+        source = source.filter(Expense.user_id == user_id)
+        stored = stored.filter_by(user_id=user_id)
+
+    expected = {}
+    for uid, m, currency, total, n in source:
+        if isinstance(m, str):  # SQLite hands dates back as text
+            m = datetime.strptime(m, '%Y-%m-%d').date()
+        expected[(uid, m, currency)] = (Decimal(total), n)
+
+    if action == 'rebuild':
+        stored.delete(synchronize_session=False)
+        db.session.add_all(
+            MonthlyTotal(user_id=uid, month=m, currency=currency, total=total, count=n)
+            for (uid, m, currency), (total, n) in expected.items()
+        )
+        db.session.commit()
+        # Versions restart at zero, so cached statements and finished exports
+        # keyed on them must go
+        statement_cache.clear(user_id)
+        charts.cache.clear(user_id)
+        export_runner.clear(user_id)
+        click.echo(f"Rebuilt {len(expected)} rollup rows.")
+        return
+
+    actual = {(r.user_id, r.month, r.currency): (r.total, r.count) for r in stored}
+    mismatches = 0
+    for key in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(key, (Decimal(0), 0))
+        have = actual.get(key, (Decimal(0), 0))
+        if want != have:
+            mismatches += 1
+            click.echo(f"user={key[0]} month={key[1]} currency={key[2]!r}: expected {want}, stored {have}")
+    if mismatches:
+        raise SystemExit(f"{mismatches} rollup rows out of sync; run `flask rollups rebuild`.")
+    click.echo(f"OK: {len(actual)} rollup rows match expenses.")
+
+@bp.cli.command('ledger')
+@click.argument('action', type=click.Choice(['rebuild', 'verify', 'snapshot']))
+@click.option('--user-id', type=int, help='Only this user (default: everyone).')
+@click.option('--as-of', type=click.DateTime(['%Y-%m-%d']), help='Snapshot date (default: end of last month).')
+def ledger_command(action, user_id, as_of):
+    """Rebuild or verify the balance ledger, or take balance snapshots."""
+    if action == 'rebuild':
+        ledger.rebuild(user_id)
+        db.session.commit()
+        click.echo("Rebuilt the ledger from credits and expenses.")
+        return
+    if action == 'snapshot':
+        as_of = as_of.date() if as_of else ledger.previous_month_end(datetime.now().date())
+        if user_id is not None:
+            ledger.snapshot(user_id, as_of)
+            db.session.commit()
+            click.echo(f"Snapshot taken at {as_of}.")
+            return
+        click.echo(f"Took {ledger.take_snapshots(as_of)} snapshots at {as_of}.")
+        return
+
+    expected = ledger.expected_balances(user_id)
+    stored = LedgerBalance.query
+    if user_id is not None:
+        stored = stored.filter_by(user_id=user_id)
+    actual = {(r.user_id, r.currency): r.balance for r in stored}
+    mismatches = 0
+    for key in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(key, Decimal(0))
+        have = actual.get(key, Decimal(0))
+        if want != have:
+            mismatches += 1
+            click.echo(f"user={key[0]} currency={key[1]!r}: expected {want}, stored {have}")
+    if mismatches:
+        raise SystemExit(f"{mismatches} ledger balances out of sync; run `flask ledger rebuild`.")
+    click.echo(f"OK: {len(actual)} ledger balances match credits and expenses.")
+
+@bp.cli.command('exports')
+@click.argument('action', type=click.Choice(['sweep']))
+def exports_command(action):
+    """Delete expired statement exports and requeue stalled ones."""
+    requeued = export_runner.requeue_stale()
+    for job in requeued:
+        submit_export(job)
+    click.echo(f"Deleted {export_runner.expire()} expired exports, requeued {len(requeued)}.")
+    # Requeued jobs render in this process's pool; wait for them before exiting
+    export_runner.shutdown(wait=True)
+
+@bp.cli.command('receipts')
+@click.argument('action', type=click.Choice(['sweep', 'gc']))
+def receipts_command(action):
+    """Sweep abandoned uploads and requeue stuck receipts, or delete stored
+    files no receipt refers to."""
+    if action == 'gc':
+        click.echo(f"Removed {receipt_store.collect_garbage()} unreferenced receipt files.")
+        return
+    removed, requeued = receipt_store.sweep()
+    click.echo(f"Removed {removed} abandoned uploads, requeued {requeued} receipts.")
+    # Requeued work runs in this process's pool; wait for it before exiting
+    receipt_store.shutdown(wait=True)
+
+def explain(query):
+    """Return the database's plan for a Query as a list of text lines."""
+    conn = db.session.connection()
+    compiled = query.statement.compile(dialect=conn.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    if conn.dialect.name == 'sqlite':
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+    return [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}", params)]
+
+def seq_scans(plan):
+    """Lines of a plan that read a whole table instead of an index range."""
+    return [
+        line for line in plan
+        if 'Seq Scan' in line
+        or (line.startswith('SCAN ') and ' USING ' not in line and ' VIRTUAL TABLE INDEX ' not in line)
+    ]
+
+@bp.cli.command('check-query-plans')
+@click.option('--user-id', type=int, default=1, show_default=True, help='User id to plan the queries for.')
+@click.option('--verbose', is_flag=True, help='Print every plan, not just failures.')
+def check_query_plans_command(user_id, verbose):
+    """EXPLAIN the hot queries and fail if any falls back to a full table scan.
+
+    Run against a seeded database. On Postgres, sequential scans are
+    disabled for the check so a small table can't mask a missing index:
+    a Seq Scan in the plan then means no index can serve the query.
+    """
+    today = datetime.now().date()
+    cursor = (today, 2**31 - 1)
+    hot = {
+        'dashboard page': expense_page_query(user_id).limit(51),
+        'dashboard page (older)': expense_page_query(user_id, after=cursor).limit(51),
+        'dashboard page (newer)': expense_page_query(user_id, before=(today, 0)).limit(51),
+        'dashboard page (undated)': expense_page_query(user_id, after=(None, 2**31 - 1), undated=True).limit(51),
+        'dashboard totals': monthly_totals_query(user_id),
+        'latest credit': latest_credit_query(user_id).limit(1),
+        'current balance': ledger.balances_query(user_id),
+        'balance since snapshot': ledger.dated_sums_query(user_id, today, after=month_range(today)[0]),
+        'balance late entries': ledger.late_sums_query(user_id, month_range(today)[0], 2**31 - 1),
+        'statement': statement_query(user_id),
+        'statement (month)': statement_query(user_id, *month_range(today)),
+        'statement version': statement_version_query(user_id, *month_range(today)),
+        'statement undated count': Expense.query.filter_by(user_id=user_id, date=None),
+        'analytics': analytics_query(user_id, add_months(today, -11), month_range(today)[1]),
+        'search': expense_page_query(user_id, query=search.search_query(user_id, text='food')).limit(51),
+        'receipts page': Receipt.query.filter_by(user_id=user_id).order_by(Receipt.id.desc()).limit(51),
+    }
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(db.text('SET LOCAL enable_seqscan = off'))
+    failures = 0
+    for name, query in hot.items():
+        plan = explain(query)
+        bad = seq_scans(plan)
+        failures += bool(bad)
+        click.echo(f"{'FAIL' if bad else 'ok  '} {name}")
+        if bad or verbose:
+            click.echo('\n'.join('    ' + line for line in plan))
+    db.session.rollback()
+    if failures:
+        raise SystemExit(f"{failures} hot queries fall back to a sequential scan.")
+
+def create_app(config_object=Config, **overrides):
+    """Build the application. gunicorn and the flask CLI both call this.
+
+    The schema is owned by Flask-Migrate (`flask db upgrade`); nothing here
+    touches the database.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.config.update(overrides)
+    hops = app.config['TRUSTED_PROXY_HOPS']
+    if hops:
+        # remote_addr (and the scheme) as the client sent them, not the proxy's
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    # Templates are compiled once per process; the bytecode cache lets fresh
+    # workers skip Jinja's parse/compile step as well.
+    os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])}
+
+    db.init_app(app)
+    # Timing starts before admission control so shed requests are counted,
+    # and admission comes next so they cost nothing else
+    metrics.init_app(app)
+    admission.init_app(app)
+    profiler.init_app(app)
+    # Flask-Migrate (and alembic under it) only serves the `flask db ...`
+    # commands. Register it when the app is built by the flask CLI (inside a
+    # click context) so web workers don't pay for importing it.
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    mail_queue.init_app(app)
+    hasher.init_app(app)
+    statement_cache.init_app(app)
+    fx_rates.init_app(app)
+    charts.init_app(app)
+    receipt_store.init_app(app)
+    export_runner.init_app(app)
+    rate_limits.init_app(app)
+    otp_sweeper.init_app(app)
+    balance_snapshotter.init_app(app)
+    receipt_sweeper.init_app(app)
+    cache_sweeper.init_app(app)
+    export_sweeper.init_app(app)
+    with app.app_context():
+        install_pool_events(db.engine)
+        metrics.install_sql_events(db.engine)
+
+    app.register_blueprint(bp)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(seed_bench_command)
+    return app
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)), debug=True)
+    create_app().run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)), debug=True)
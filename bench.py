@@ -0,0 +1,503 @@
+"""Benchmarks, run through the Flask CLI: ``flask bench <name>``.
+
+``flask seed-bench`` fills the configured database with synthetic users;
+``flask bench run`` drives the main pages against users of several sizes
+and records (or checks against) a JSON baseline.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from passwords import PasswordHasher
+
+bench_cli = AppGroup('bench', help='Performance benchmarks.')
+
+
+@bench_cli.command('hash')
+@click.option('--method', 'methods', multiple=True,
+              default=['pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1'],
+              show_default=True, help='Werkzeug hash method/cost to measure (repeatable).')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, show_default=True,
+              help='Process pool size.')
+@click.option('--seconds', type=float, default=3.0, show_default=True,
+              help='How long to run each method.')
+def bench_hash(methods, workers, seconds):
+    """Login (password verification) throughput at each work factor."""
+    click.echo(f"{'method':<24} {'logins/s':>10} {'per core':>10} {'ms/login':>10}")
+    for method in methods:
+        hasher = PasswordHasher(method=method, workers=workers)
+        hasher.max_pending = workers * 4
+        hasher.timeout = 60
+        executor, _ = hasher._pool()
+        pw_hash = generate_password_hash('correct horse', method)
+        # Warm the pool so process start-up isn't measured
+        list(executor.map(check_password_hash, [pw_hash] * workers, ['correct horse'] * workers))
+
+        done = 0
+        in_flight = set()
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            while len(in_flight) < hasher.max_pending:
+                in_flight.add(executor.submit(check_password_hash, pw_hash, 'correct horse'))
+            finished = {f for f in in_flight if f.done()}
+            done += len(finished)
+            in_flight -= finished
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - started
+        hasher.shutdown()
+
+        rate = done / elapsed
+        click.echo(f"{method:<24} {rate:>10.1f} {rate / workers:>10.1f} {1000 * workers / rate if rate else 0:>10.1f}")
+
+
+STARTUP_PROBE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+application = app.create_app()
+t2 = time.perf_counter()
+response = application.test_client().get(sys.argv[1])
+t3 = time.perf_counter()
+heavy = [name for name in ('fpdf', 'flask_mail', 'numpy', 'pandas', 'matplotlib') if name in sys.modules]
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1, 'first_request': t3 - t2,
+                  'status': response.status_code, 'heavy_modules': heavy}))
+'''
+
+
+@bench_cli.command('startup')
+@click.option('--runs', type=int, default=5, show_default=True)
+@click.option('--path', default='/login', show_default=True, help='URL for the first request.')
+def bench_startup(runs, path):
+    """Cold import, create_app() and first-request latency of a fresh worker."""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE, path],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    for key in ('import', 'create_app', 'first_request'):
+        values = [s[key] * 1000 for s in samples]
+        click.echo(f"{key:<14} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+    click.echo(f"first request status: {samples[-1]['status']}")
+    click.echo(f"heavy modules loaded by first request: {', '.join(samples[-1]['heavy_modules']) or 'none'}")
+
+
+@bench_cli.command('batch')
+@click.option('--items', type=int, default=50, show_default=True, help='Expenses per sync.')
+@click.option('--rounds', type=int, default=10, show_default=True)
+def bench_batch(items, rounds):
+    """Create/delete throughput: /add + /delete forms vs /api/expenses/batch.
+
+    Writes to the configured database as a throwaway user, removed afterwards.
+    """
+    from models import (
+        db, User, Expense, MonthlyTotal, Credit, LedgerEntry, LedgerBalance, BalanceSnapshot, Receipt, ExportJob,
+    )
+
+    user = User(email='bench-batch@example.invalid', password_hash='!')
+    db.session.add(user)
+    db.session.commit()
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user.id
+    expense = {'date': '2026-01-15', 'amount': '12.50', 'category': 'Food',
+               'currency': 'INR', 'country': 'India', 'description': 'bench'}
+
+    def form_round():
+        for _ in range(items):
+            client.post('/add', data=expense)
+        ids = [row_id for (row_id,) in db.session.query(Expense.id).filter_by(user_id=user.id)]
+        db.session.rollback()
+        for row_id in ids:
+            client.post(f'/delete/{row_id}')
+
+    def batch_round():
+        created = client.post('/api/expenses/batch', json={'create': [expense] * items}).get_json()['created']
+        client.post('/api/expenses/batch', json={'delete': [c['id'] for c in created]})
+
+    try:
+        click.echo(f"{'path':<8} {'items/s':>10} {'ms/sync':>10}")
+        for name, run in (('form', form_round), ('batch', batch_round)):
+            run()  # warm up
+            started = time.perf_counter()
+            for _ in range(rounds):
+                run()
+            elapsed = time.perf_counter() - started
+            # Each round creates and deletes `items` expenses
+            click.echo(f"{name:<8} {2 * items * rounds / elapsed:>10.1f} {1000 * elapsed / rounds:>10.1f}")
+    finally:
+        for model in (Receipt, ExportJob, Expense, MonthlyTotal, Credit, LedgerEntry, LedgerBalance, BalanceSnapshot):
+            model.query.filter_by(user_id=user.id).delete()
+        db.session.delete(db.session.get(User, user.id))
+        db.session.commit()
+
+
+@bench_cli.command('admission')
+@click.option('--downloads', type=int, default=10, show_default=True,
+              help='Statement downloads to make one after another.')
+def bench_admission(downloads):
+    """Check that admission slots come back after each /download.
+
+    Serves the app on a real threaded WSGI server (the test client closes
+    responses itself, which servers don't always do) and downloads one
+    statement repeatedly, so all but the first come from the statement
+    cache as file responses. Fails on any 503. Uses a throwaway user,
+    removed afterwards.
+    """
+    import threading
+    import urllib.error
+    import urllib.request
+
+    from werkzeug.serving import make_server
+
+    from models import db
+
+    app = current_app._get_current_object()
+    gate = app.extensions['admission'].gates.get(('main.download', None))
+    if gate is None:
+        raise click.ClickException("ADMISSION_LIMITS has no limit for main.download.")
+    if app.extensions['statement_cache'].max_bytes <= 0:
+        raise click.ClickException("The statement cache is disabled (STATEMENT_CACHE_MAX_MB=0).")
+    downloads = max(downloads, gate.slots + 1)
+    delete_bench_users('admission-')
+    user_id = seed_user(BENCH_EMAIL.format('admission-1'), 50, 1, '!', random.Random(1))
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'user_id': user_id})
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    refused = 0
+    try:
+        for n in range(downloads):
+            request = urllib.request.Request(
+                f'http://127.0.0.1:{server.server_port}/download?format=csv',
+                headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"})
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            refused += status == 503
+            click.echo(f"download {n + 1}: HTTP {status}")
+    finally:
+        server.shutdown()
+        thread.join()
+        db.session.rollback()
+        delete_bench_users('admission-')
+    if refused:
+        raise SystemExit(f"{refused} of {downloads} downloads were refused; admission slots are leaking.")
+    click.echo(f"All {downloads} downloads admitted ({gate.slots} slots).")
+
+
+# Synthetic users are recognisable by this address pattern and removed by
+# `flask seed-bench --clear`
+BENCH_EMAIL = 'bench-{}@example.invalid'
+BENCH_PASSWORD = 'bench-password'
+SEED_BATCH = 5000
+
+
+def delete_bench_users(prefix=''):
+    """Remove synthetic bench users (those whose name starts with ``prefix``)
+    and their data; returns the count."""
+    from models import (
+        db, User, Expense, MonthlyTotal, Credit, OTPVerification, LedgerEntry, LedgerBalance, BalanceSnapshot,
+        Receipt, ExportJob,
+    )
+
+    pattern = BENCH_EMAIL.format(prefix + '%')
+    ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.email.like(pattern))]
+    for model in (Receipt, ExportJob, Expense, MonthlyTotal, Credit, LedgerEntry, LedgerBalance, BalanceSnapshot):
+        model.query.filter(model.user_id.in_(ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(ids)).delete(synchronize_session=False)
+    OTPVerification.query.filter(OTPVerification.email.like(pattern)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(ids)
+
+
+def seed_user(email, expenses, credits, password_hash, rng, months=24):
+    """Create one user with ``expenses`` expenses spread over the last
+    ``months`` months, ``credits`` credits and matching rollups and ledger."""
+    from sqlalchemy import insert
+
+    import ledger
+    from app import CATEGORIES, COUNTRIES
+    from models import db, User, Expense, MonthlyTotal, Credit
+
+    user = User(email=email, password_hash=password_hash)
+    db.session.add(user)
+    db.session.flush()
+    today = date.today()
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    batch = []
+    for n in range(expenses):
+        country, currency, _, _ = rng.choice(COUNTRIES)
+        day = today - timedelta(days=rng.randrange(months * 30))
+        amount = Decimal(rng.randrange(100, 50000)) / 100
+        batch.append({
+            'user_id': user.id, 'amount': amount, 'category': rng.choice(CATEGORIES),
+            'currency': currency, 'country': country, 'description': f'bench expense {n}', 'date': day,
+        })
+        total = totals[day.replace(day=1), currency]
+        total[0] += amount
+        total[1] += 1
+        if len(batch) >= SEED_BATCH:
+            db.session.execute(insert(Expense), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Expense), batch)
+    if totals:
+        db.session.execute(insert(MonthlyTotal), [
+            {'user_id': user.id, 'month': month, 'currency': currency, 'total': total, 'count': count}
+            for (month, currency), (total, count) in totals.items()
+        ])
+    if credits:
+        now = datetime.now()
+        db.session.execute(insert(Credit), [
+            {'user_id': user.id, 'amount': Decimal(rng.randrange(1000, 500000)) / 100,
+             'created_at': now - timedelta(days=rng.randrange(months * 30))}
+            for _ in range(credits)
+        ])
+    ledger.rebuild(user.id)
+    db.session.commit()
+    return user.id
+
+
+@click.command('seed-bench')
+@click.option('--users', type=int, default=10, show_default=True)
+@click.option('--expenses', type=int, default=1000, show_default=True, help='Expenses per user.')
+@click.option('--credits', type=int, default=20, show_default=True, help='Credits per user.')
+@click.option('--seed', type=int, default=1, show_default=True, help='Random seed, for repeatable data.')
+@click.option('--clear', is_flag=True, help='Only delete existing bench users.')
+@with_appcontext
+def seed_bench_command(users, expenses, credits, seed, clear):
+    """Bulk-generate synthetic users, expenses and credits for benchmarking.
+
+    Existing bench users are replaced. They all share the password
+    'bench-password'.
+    """
+    removed = delete_bench_users()
+    if clear:
+        click.echo(f"Removed {removed} bench users.")
+        return
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(BENCH_PASSWORD, current_app.config['PASSWORD_HASH_METHOD'])
+    started = time.perf_counter()
+    for n in range(users):
+        seed_user(BENCH_EMAIL.format(f'user-{n}'), expenses, credits, password_hash, rng)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Seeded {users} users x {expenses} expenses + {credits} credits in {elapsed:.1f}s "
+               f"({users * expenses / elapsed if elapsed else 0:.0f} expenses/s).")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb():
+    """Peak RSS of this process since it started (or, on Linux, since the
+    last ``reset_peak_rss``)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def reset_peak_rss():
+    """Start a new peak-RSS window; False where that isn't possible (only
+    Linux can reset it), in which case the peak only ever grows."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Metrics `--baseline` checks. Each may exceed the baseline by --threshold;
+# latencies also get --slack-ms so sub-millisecond noise can't fail a run.
+TRACKED = ('p50_ms', 'p95_ms', 'queries', 'peak_rss_mb')
+
+
+def run_scenarios(user_id, email, requests, warmup):
+    """Time each scenario for one seeded user: ``{name: ([(ms, queries), ...], peak_mb)}``.
+
+    ``peak_mb`` is the scenario's own peak RSS, or None where the peak
+    can't be reset between scenarios.
+    """
+    from models import db, Expense
+
+    metrics = current_app.extensions['metrics']
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    today = date.today().isoformat()
+    results = {}
+
+    def timed(name, endpoint, call, clear_flashes=False):
+        samples = []
+        windowed = reset_peak_rss()
+        for n in range(warmup + requests):
+            queries = metrics.queries(endpoint)
+            started = time.perf_counter()
+            response = call(n)
+            response.get_data()
+            response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise click.ClickException(f"{name}: HTTP {response.status_code}")
+            if n >= warmup:
+                samples.append((elapsed, metrics.queries(endpoint) - queries))
+            if clear_flashes:
+                # Flashes would otherwise pile up in the session cookie
+                with client.session_transaction() as session:
+                    session.pop('_flashes', None)
+        results[name] = samples, round(peak_rss_mb(), 1) if windowed else None
+
+    expense = {'date': today, 'amount': '12.50', 'category': 'Food', 'currency': 'INR',
+               'country': 'India', 'description': 'bench-add'}
+    timed('dashboard', 'main.dashboard', lambda n: client.get('/dashboard'))
+    timed('download', 'main.download', lambda n: client.get('/download?format=pdf'))
+    timed('add_expense', 'main.add_expense', lambda n: client.post('/add', data=expense), clear_flashes=True)
+    # Delete what add_expense created, so the user ends where it started
+    added = [row_id for (row_id,) in db.session.query(Expense.id).filter_by(user_id=user_id, description='bench-add')]
+    db.session.rollback()
+    timed('delete', 'main.delete', lambda n: client.post(f'/delete/{added[n]}'), clear_flashes=True)
+    login_client = current_app.test_client()
+    timed('login', 'main.login', lambda n: login_client.post(
+        '/login', data={'email': email, 'password': BENCH_PASSWORD}))
+    # A fresh address and client IP per request keeps the OTP rate limits out of the way
+    timed('reset_request', 'main.reset_request', lambda n: current_app.test_client().post(
+        '/reset_request', data={'email': BENCH_EMAIL.format(f'size-reset-{n}')},
+        environ_base={'REMOTE_ADDR': f'10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}'}))
+    return results
+
+
+def compare(results, baseline, threshold, slack_ms):
+    """List of regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for size, scenarios in results.items():
+        for name, stats in scenarios.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None:
+                continue
+            for metric in TRACKED:
+                if metric not in previous or metric not in stats:
+                    continue
+                limit = previous[metric] * (1 + threshold)
+                if metric.endswith('_ms'):
+                    limit += slack_ms
+                if stats[metric] > limit:
+                    regressions.append(
+                        f"{size} expenses / {name}: {metric} {stats[metric]} > {previous[metric]} (+{threshold:.0%})")
+    return regressions
+
+
+@bench_cli.command('run')
+@click.option('--sizes', default='100,1000,10000', show_default=True,
+              help='Comma-separated expense counts; one bench user is seeded per size.')
+@click.option('--requests', type=int, default=20, show_default=True, help='Timed requests per scenario.')
+@click.option('--warmup', type=int, default=2, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results here as JSON.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Fail if a tracked metric regressed against this earlier --output.')
+@click.option('--threshold', type=float, default=0.25, show_default=True,
+              help='Allowed relative regression against the baseline.')
+@click.option('--slack-ms', type=float, default=2.0, show_default=True,
+              help='Absolute latency slack added to the threshold.')
+@click.option('--seed', type=int, default=1, show_default=True)
+def bench_run(sizes, requests, warmup, output, baseline, threshold, slack_ms, seed):
+    """p50/p95 latency, queries per request and peak RSS for the main pages.
+
+    Drives dashboard, download (PDF, rendered in the request: statement
+    cache off, no background export), add_expense, delete, login and
+    reset_request through the test client for a user with each number of
+    expenses. Peak RSS is per scenario on Linux; elsewhere only the whole
+    run's peak is recorded. Writes to the configured database, as throwaway
+    users that are removed afterwards. OTP mail is not sent.
+    """
+    from models import db
+
+    sizes = [int(size) for size in sizes.split(',') if size.strip()]
+    current_app.config['MAIL_SUPPRESS_SEND'] = True
+    cache = current_app.extensions['statement_cache']
+    cache_bytes, cache.max_bytes = cache.max_bytes, 0
+    # Every size renders in the request rather than redirecting to an export job
+    sync_rows = current_app.config['EXPORT_SYNC_MAX_ROWS']
+    current_app.config['EXPORT_SYNC_MAX_ROWS'] = max(sync_rows, *sizes)
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(BENCH_PASSWORD, current_app.config['PASSWORD_HASH_METHOD'])
+    results = {}
+    # Scenario peaks are reset between scenarios, so the run's is their maximum
+    run_peak_mb = 0.0
+    try:
+        delete_bench_users('size-')
+        click.echo(f"{'expenses':>9} {'scenario':<14} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8} {'peak MB':>8}")
+        for size in sizes:
+            email = BENCH_EMAIL.format(f'size-{size}')
+            user_id = seed_user(email, size, max(1, size // 50), password_hash, rng)
+            scenarios = results[str(size)] = {}
+            for name, (samples, peak_mb) in run_scenarios(user_id, email, requests, warmup).items():
+                latencies = [ms for ms, _ in samples]
+                stats = scenarios[name] = {
+                    'p50_ms': round(percentile(latencies, 50), 2),
+                    'p95_ms': round(percentile(latencies, 95), 2),
+                    'queries': round(statistics.mean(q for _, q in samples), 1),
+                }
+                if peak_mb is not None:
+                    stats['peak_rss_mb'] = peak_mb
+                    run_peak_mb = max(run_peak_mb, peak_mb)
+                click.echo(f"{size:>9} {name:<14} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+                           f"{stats['queries']:>8} {stats.get('peak_rss_mb', '-'):>8}")
+    finally:
+        cache.max_bytes = cache_bytes
+        current_app.config['EXPORT_SYNC_MAX_ROWS'] = sync_rows
+        db.session.rollback()
+        delete_bench_users('size-')
+
+    run_peak_mb = max(run_peak_mb, peak_rss_mb())
+    click.echo(f"Peak RSS for the run: {run_peak_mb:.1f} MB")
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'database': db.engine.dialect.name, 'python': sys.version.split()[0],
+                    'requests': requests, 'created_at': datetime.now().isoformat(timespec='seconds'),
+                    'peak_rss_mb': round(run_peak_mb, 1),
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        click.echo(f"Wrote {output}")
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)['results'], threshold, slack_ms)
+        for line in regressions:
+            click.echo(line)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} benchmark metrics regressed past the baseline.")
+        click.echo("No regressions against the baseline.")
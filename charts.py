@@ -0,0 +1,115 @@
+"""Analytics chart rendering off the request path.
+
+Charts are drawn with matplotlib in a small process pool, so a render
+neither holds a gunicorn worker nor competes with it for the GIL. Finished
+images go into an on-disk cache keyed by user, chart and data version;
+until one is ready the route serves ``PLACEHOLDER_SVG`` and the page polls.
+With the cache disabled (``CHART_CACHE_MAX_MB=0``) each process keeps its
+last ``MEMORY_IMAGES`` finished images in memory instead, so polls still
+find them.
+"""
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from statement_cache import StatementCache
+
+CHART_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# Finished images kept per process when the on-disk cache is disabled
+MEMORY_IMAGES = 64
+
+PLACEHOLDER_SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="800" height="400">'
+    b'<rect width="100%" height="100%" fill="#f8fafc"/>'
+    b'<text x="50%" y="50%" text-anchor="middle" font-family="sans-serif" '
+    b'font-size="16" fill="#64748b">Rendering chart...</text></svg>'
+)
+
+
+def render_chart(kind, labels, values, currency, fmt):
+    """Draw one chart and return the image bytes. Runs in a pool process."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 4), dpi=100)
+    ax = fig.add_subplot()
+    if kind == 'categories':
+        ax.barh(labels[::-1], values[::-1], color='#4f46e5')
+        ax.set_xlabel(currency)
+    else:
+        ax.plot(labels, values, marker='o', color='#4f46e5')
+        ax.set_ylabel(currency)
+        ax.tick_params(axis='x', labelrotation=45)
+    ax.grid(axis='x' if kind == 'categories' else 'y', alpha=0.3)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt)
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    def __init__(self, app=None):
+        self.cache = StatementCache(config_prefix='CHART_CACHE')
+        self.workers = 1
+        self._executor = None
+        self._pending = {}
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.init_app(app)
+        self.workers = app.config.get('CHART_WORKERS', self.workers)
+        app.extensions['chart_renderer'] = self
+
+    def get(self, user_id, name, fmt, version):
+        """An open file for a rendered chart, or None if it isn't ready."""
+        if self.cache.enabled:
+            return self.cache.open(user_id, name, fmt, version)
+        with self._lock:
+            image = self._images.get((user_id, name, fmt, version))
+        return io.BytesIO(image) if image is not None else None
+
+    def pending(self, user_id, name, fmt, version):
+        """Whether this chart is being drawn right now."""
+        with self._lock:
+            return (user_id, name, fmt, version) in self._pending
+
+    def submit(self, user_id, name, fmt, version, *chart):
+        """Queue a render unless the same chart is already being drawn.
+
+        ``chart`` is ``(kind, labels, values, currency)`` for ``render_chart``.
+        """
+        key = (user_id, name, fmt, version)
+        with self._lock:
+            if key in self._pending:
+                return
+            if self._executor is None:
+                # Created on first use so each gunicorn worker gets its own pool
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._executor.submit(render_chart, *chart, fmt)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._finished(key, f))
+
+    def _finished(self, key, future):
+        try:
+            image = future.result()
+            if self.cache.enabled:
+                self.cache.put(*key, image)
+            else:
+                with self._lock:
+                    self._images[key] = image
+                    while len(self._images) > MEMORY_IMAGES:
+                        self._images.popitem(last=False)
+        except Exception as e:
+            print("Chart render error:", e)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,123 @@
+"""Engine and connection-pool settings from the environment, plus pool metrics.
+
+Settings (all optional):
+
+    DB_POOL_SIZE             persistent connections per process (5)
+    DB_MAX_OVERFLOW          extra connections allowed under load (10)
+    DB_POOL_TIMEOUT          seconds to wait for a free connection (30)
+    DB_POOL_RECYCLE          replace connections older than this, seconds (1800)
+    DB_POOL_PRE_PING         test connections on checkout (True)
+    DB_STATEMENT_TIMEOUT_MS  Postgres statement_timeout, 0 = none (0)
+    DB_PGBOUNCER             running behind pgbouncer in transaction mode (False)
+
+Each gunicorn worker holds up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections,
+so size them against Postgres ``max_connections`` divided by worker count.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+def env_flag(name, default):
+    return os.getenv(name, str(default)) == 'True'
+
+
+class PoolStats:
+    """Process-wide counters fed by pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            self.timeouts += timed_out
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            data = {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+            }
+        if isinstance(pool, QueuePool):
+            data.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        return data
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return conn
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``database_uri`` from DB_* variables."""
+    if not database_uri.startswith('postgresql'):
+        # SQLite (local dev/benchmarks) keeps SQLAlchemy's defaults
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+    }
+    connect_args = {}
+    timeout_ms = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    if env_flag('DB_PGBOUNCER', False):
+        # Transaction pooling: the server connection changes between
+        # transactions, so nothing session-scoped can be relied on. pgbouncer
+        # rejects the 'options' startup parameter (the timeout is set per
+        # transaction instead, see install_pool_events) and server-side
+        # prepared statements would land on the wrong backend. psycopg2
+        # never prepares; psycopg 3 does unless told not to.
+        if database_uri.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = None
+    elif timeout_ms:
+        connect_args['options'] = f'-c statement_timeout={timeout_ms}'
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def install_pool_events(engine):
+    """Hook pool metrics (and pgbouncer-mode statement timeouts) into ``engine``."""
+    event.listen(engine.pool, 'checkout', lambda *a: pool_stats.incr('checkouts'))
+    event.listen(engine.pool, 'connect', lambda *a: pool_stats.incr('connects'))
+    event.listen(engine.pool, 'invalidate', lambda *a: pool_stats.incr('invalidations'))
+
+    timeout_ms = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    if engine.dialect.name == 'postgresql' and timeout_ms and env_flag('DB_PGBOUNCER', False):
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {timeout_ms}')
@@ -0,0 +1,303 @@
+"""Statement exports rendered in the background.
+
+A statement too large to render within one request becomes an
+``ExportJob`` row. It is rendered by the same functions as /download, but in
+a process pool whose processes open their own database connections. The job
+row tracks progress (``rows_done`` of ``rows_total``, the latter read from
+the monthly rollups) for the page to poll.
+
+Rows are fetched in keyset batches of ``STATEMENT_BATCH_SIZE`` on (date, id),
+each one a short query of its own. So no transaction or cursor stays open
+for the length of a render, and progress can be committed between batches.
+
+Finished files live under ``EXPORT_DIR`` until ``EXPORT_RETENTION_SECONDS``
+after they were rendered. A job is keyed by user, period, format and data
+version (as the statement cache is), so a repeated request for an unchanged
+statement gets the existing job instead of a second render.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Expense, ExportJob
+from statement_cache import STALE_PART_SECONDS
+
+# Progress is written at most this often while a job runs
+PROGRESS_SECONDS = 1.0
+ACTIVE = ('queued', 'running')
+
+# The pool process's own app, for database access (see _init_worker)
+_worker_app = None
+
+
+# --- rendering (runs in pool processes) ---
+
+def _init_worker(config):
+    global _worker_app
+    from flask import Flask
+
+    _worker_app = Flask(__name__)
+    _worker_app.config.update(config)
+    db.init_app(_worker_app)
+
+
+def statement_batches(query, size):
+    """Run a statement query (newest first) as keyset batches of ``size``
+    rows on (date, id); undated rows come last."""
+    passes = (
+        (query.filter(Expense.date.isnot(None)), tuple_(Expense.date, Expense.id), lambda r: (r.date, r.id)),
+        (query.filter(Expense.date.is_(None)), Expense.id, lambda r: r.id),
+    )
+    for rows, key, position in passes:
+        last = None
+        while True:
+            batch = (rows if last is None else rows.filter(key < last)).limit(size).all()
+            if batch:
+                yield batch
+            if len(batch) < size:
+                break
+            last = position(batch[-1])
+
+
+def run_export(job_id, path, start, end, render_args, batch_size, retention):
+    """Render one job into ``path``; returns False if another process had
+    already claimed it."""
+    import statements
+    from app import DOWNLOAD_FORMATS, statement_query
+
+    with _worker_app.app_context():
+        now = datetime.now()
+        claimed = db.session.execute(update(ExportJob).where(
+            ExportJob.id == job_id, ExportJob.status == 'queued',
+        ).values(status='running', attempts=ExportJob.attempts + 1, started_at=now, updated_at=now)).rowcount
+        db.session.commit()
+        if not claimed:
+            return False
+        job = db.session.get(ExportJob, job_id)
+        user_id, fmt = job.user_id, job.format
+        renderer = getattr(statements, DOWNLOAD_FORMATS[fmt][0])
+        done = 0
+        reported = time.monotonic()
+
+        def rows():
+            nonlocal done, reported
+            for batch in statement_batches(statement_query(user_id, start, end), batch_size):
+                yield from batch
+                done += len(batch)
+                if time.monotonic() - reported >= PROGRESS_SECONDS:
+                    _set(job_id, rows_done=done)
+                    reported = time.monotonic()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, part = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in renderer(rows(), **render_args):
+                    f.write(chunk)
+                size = f.tell()
+            os.replace(part, path)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Export {job_id} error:", e)
+            _set(job_id, status='failed', error=f'{type(e).__name__}: {e}'[:255], finished_at=datetime.now(),
+                 expires_at=datetime.now() + timedelta(seconds=retention))
+            return True
+        finally:
+            _remove(part)
+        finished = datetime.now()
+        if not _set(job_id, status='done', rows_done=done, rows_total=done, size=size, error=None,
+                    finished_at=finished, expires_at=finished + timedelta(seconds=retention)):
+            # The job was deleted (see ExportRunner.clear) while it rendered
+            _remove(path)
+        return True
+
+
+def _set(job_id, **values):
+    """Update a job row and commit; returns whether the row still exists."""
+    updated = db.session.execute(
+        update(ExportJob).where(ExportJob.id == job_id).values(updated_at=datetime.now(), **values)).rowcount
+    db.session.commit()
+    return bool(updated)
+
+
+# --- jobs (in the web process) ---
+
+class ExportRunner:
+    def __init__(self, app=None):
+        self.directory = None
+        self.workers = 1
+        self.retention = 86400
+        self.requeue_after = 300
+        self.max_attempts = 3
+        self.batch_size = 500
+        self._config = {}
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('EXPORT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'expense_tracker_exports')
+        self.workers = app.config.get('EXPORT_WORKERS', self.workers)
+        self.retention = app.config.get('EXPORT_RETENTION_SECONDS', self.retention)
+        self.requeue_after = app.config.get('EXPORT_REQUEUE_SECONDS', self.requeue_after)
+        self.max_attempts = app.config.get('EXPORT_MAX_ATTEMPTS', self.max_attempts)
+        self.batch_size = app.config.get('STATEMENT_BATCH_SIZE', self.batch_size)
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        if 'pool_size' in options:
+            # A pool process renders one job at a time
+            options.update(pool_size=1, max_overflow=0)
+        self._config = {
+            'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+            'SQLALCHEMY_ENGINE_OPTIONS': options,
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        }
+        app.extensions['exports'] = self
+
+    def path(self, job):
+        return os.path.join(self.directory, str(int(job.user_id)), f'{job.id}.{job.format}')
+
+    def job_for(self, user_id, period, fmt, version, currency, filename, rows_total):
+        """The job for this statement, created (or reset, after a failure or
+        a lost file) if need be. Commits; returns ``(job, new)``, where
+        ``new`` means the caller should ``submit`` it."""
+        table = ExportJob.__table__
+        insert = sqlite_insert if db.session.get_bind().dialect.name == 'sqlite' else pg_insert
+        new = db.session.execute(
+            insert(table).values(
+                user_id=user_id, period=period, format=fmt, version=version, currency=currency,
+                filename=filename, status='queued', rows_done=0, rows_total=rows_total, attempts=0,
+                created_at=datetime.now(), updated_at=datetime.now(),
+            ).on_conflict_do_nothing(index_elements=['user_id', 'period', 'format', 'version']).returning(table.c.id)
+        ).scalar() is not None
+        job = ExportJob.query.filter_by(user_id=user_id, period=period, format=fmt, version=version).one()
+        if job.status == 'failed' or (job.status == 'done' and not os.path.exists(self.path(job))):
+            job.status, job.rows_done, job.rows_total, job.attempts, job.error = 'queued', 0, rows_total, 0, None
+            job.started_at, job.finished_at, job.expires_at = None, None, None
+            job.updated_at = datetime.now()
+            new = True
+        db.session.commit()
+        return job, new
+
+    def active(self, user_id):
+        """How many of the user's jobs are queued or running."""
+        return ExportJob.query.filter(ExportJob.user_id == user_id, ExportJob.status.in_(ACTIVE)).count()
+
+    def open(self, job):
+        """An open file for a finished job, or None."""
+        if job.status != 'done':
+            return None
+        try:
+            return open(self.path(job), 'rb')
+        except FileNotFoundError:
+            return None
+
+    def submit(self, job, start, end, render_args):
+        """Queue a job for rendering unless it is queued here already.
+
+        ``render_args`` are the renderer's keyword arguments (title and total
+        for a PDF).
+        """
+        with self._lock:
+            if job.id in self._pending:
+                return
+            if self._executor is None:
+                # Created on first use so each gunicorn worker gets its own pool
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker, initargs=(self._config,))
+            future = self._executor.submit(
+                run_export, job.id, self.path(job), start, end, render_args, self.batch_size, self.retention)
+            self._pending.add(job.id)
+        job_id = job.id
+        future.add_done_callback(lambda f: self._finished(job_id, f))
+
+    def _finished(self, job_id, future):
+        try:
+            future.result()
+        except BrokenExecutor:
+            # A pool process died mid-render; start a fresh pool next time.
+            # The job stops reporting progress, so the sweep requeues it.
+            with self._lock:
+                self._executor = None
+        except Exception as e:
+            print(f"Export {job_id} error:", e)
+        finally:
+            with self._lock:
+                self._pending.discard(job_id)
+
+    def requeue_stale(self):
+        """Jobs that have been queued or running without progress for
+        ``EXPORT_REQUEUE_SECONDS`` (their process died or was restarted):
+        reset to queued and returned for resubmission, or failed after
+        ``EXPORT_MAX_ATTEMPTS`` tries. Commits."""
+        stale = ExportJob.query.filter(
+            ExportJob.status.in_(ACTIVE), ExportJob.updated_at < datetime.now() - timedelta(seconds=self.requeue_after),
+        ).order_by(ExportJob.updated_at).limit(100).all()
+        requeued = []
+        for job in stale:
+            if job.attempts >= self.max_attempts:
+                job.status, job.error = 'failed', 'gave up after repeated attempts'
+                job.finished_at = datetime.now()
+                job.expires_at = job.finished_at + timedelta(seconds=self.retention)
+            else:
+                job.status, job.rows_done = 'queued', 0
+                requeued.append(job)
+            job.updated_at = datetime.now()
+        db.session.commit()
+        return requeued
+
+    def expire(self):
+        """Delete jobs past retention with their files, and renders abandoned
+        mid-write; returns how many jobs were deleted. Commits."""
+        expired = db.session.execute(
+            delete(ExportJob).where(ExportJob.expires_at < datetime.now())
+            .returning(ExportJob.id, ExportJob.user_id, ExportJob.format)
+        ).all()
+        db.session.commit()
+        for job in expired:
+            _remove(self.path(job))
+        cutoff = time.time() - STALE_PART_SECONDS
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if name.endswith('.part') and os.stat(path).st_mtime < cutoff:
+                        _remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(expired)
+
+    def clear(self, user_id=None):
+        """Delete every job and its file (for one user, or for everyone), e.g.
+        when data versions restart. Commits."""
+        query = ExportJob.query
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        query.delete(synchronize_session=False)
+        db.session.commit()
+        path = self.directory if user_id is None else os.path.join(self.directory, str(int(user_id)))
+        shutil.rmtree(path, ignore_errors=True)
+
+    def shutdown(self, wait=False):
+        """Stop the pool; with ``wait``, after finishing queued work."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,167 @@
+"""Currency conversion from the local ``fx_rates`` table.
+
+Rates are loaded from a file with ``flask load-fx-rates`` (no network
+access needed) and stored as units of each currency per one unit of
+``FX_BASE_CURRENCY``, one row per currency and day. Each process keeps the
+whole table in NumPy arrays, refreshed every ``FX_CACHE_SECONDS``, and
+converts whole columns of amounts at once: one ``searchsorted`` per
+currency finds the rate in effect on each date.
+"""
+import csv
+import io
+import threading
+import time
+import zlib
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, FxRate
+
+
+class FxRates:
+    def __init__(self, app=None):
+        self.base = 'USD'
+        self.ttl = 300
+        # Currency of amounts recorded without one (legacy rows)
+        self.default = 'INR'
+        self._table = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.base = app.config.get('FX_BASE_CURRENCY', self.base).upper()
+        self.ttl = app.config.get('FX_CACHE_SECONDS', self.ttl)
+        self.default = app.config.get('HOME_CURRENCY', self.default).upper()
+        self.invalidate()
+        app.extensions['fx_rates'] = self
+
+    def invalidate(self):
+        with self._lock:
+            self._table = None
+
+    def _rates(self):
+        """``({currency: (dates, rates)}, version)``, reloaded once stale."""
+        with self._lock:
+            if self._table is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._table = self._load()
+                self._loaded_at = time.monotonic()
+            return self._table
+
+    def _load(self):
+        import numpy as np
+
+        rows = db.session.query(FxRate.currency, FxRate.date, FxRate.rate).order_by(FxRate.currency, FxRate.date)
+        table = {}
+        checksum = 0
+        for currency, group in groupby(rows, key=itemgetter(0)):
+            group = list(group)
+            dates = np.array([r[1] for r in group], dtype='datetime64[D]')
+            rates = np.array([float(r[2]) for r in group], dtype=np.float64)
+            table[currency] = (dates, rates)
+            checksum = zlib.crc32(dates.tobytes() + rates.tobytes(), zlib.crc32(currency.encode(), checksum))
+        return table, f'{checksum:08x}'
+
+    @property
+    def version(self):
+        """Changes whenever the loaded rate table does."""
+        return self._rates()[1]
+
+    def currencies(self):
+        return sorted(set(self._rates()[0]) | {self.base})
+
+    def _rate_on(self, table, currency, dates):
+        import numpy as np
+
+        if currency == self.base:
+            return np.ones(len(dates))
+        if currency not in table:
+            return np.full(len(dates), np.nan)
+        known_dates, rates = table[currency]
+        # Latest rate on or before each date; before the first known rate,
+        # fall back to the first one
+        idx = np.searchsorted(known_dates, dates, side='right') - 1
+        return rates[np.maximum(idx, 0)]
+
+    def convert(self, amounts, currencies, dates, to, default=None):
+        """Convert parallel sequences of amounts into currency ``to``.
+
+        Amounts with an empty currency are taken to be in ``default`` (the
+        configured ``HOME_CURRENCY`` unless given), whatever ``to`` is.
+        Returns ``(converted, missing)``: a float array with NaN where no
+        rate is known, and the set of currencies that had no rate.
+        """
+        import numpy as np
+
+        table = self._rates()[0]
+        to = to.upper()
+        amounts = np.asarray([float(a or 0) for a in amounts], dtype=np.float64)
+        default = (default or self.default).upper()
+        currencies = np.asarray([(c or default).upper() for c in currencies], dtype=object)
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        if not len(amounts):
+            return amounts, set()
+
+        native = currencies == to
+        if native.all():
+            return amounts, set()
+        source = np.ones(len(amounts))
+        for currency in np.unique(currencies[~native]):
+            mask = currencies == currency
+            source[mask] = self._rate_on(table, currency, dates[mask])
+        target = self._rate_on(table, to, dates)
+        converted = np.where(native, amounts, amounts / source * target)
+        missing = set(currencies[np.isnan(converted)])
+        return converted, missing
+
+
+def read_rates(stream):
+    """Yield ``(date, currency, rate)`` from a ``date,currency,rate`` CSV file."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = [c.strip().lower() for c in next(reader, [])]
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        raw = dict(zip(header, row))
+        try:
+            day = datetime.strptime(raw.get('date', '').strip(), '%Y-%m-%d').date()
+            rate = Decimal(raw.get('rate', '').strip())
+        except (ValueError, InvalidOperation):
+            raise ValueError(f"line {reader.line_num}: expected YYYY-MM-DD date and numeric rate")
+        currency = raw.get('currency', '').strip().upper()
+        if not currency or len(currency) > 10 or not rate.is_finite() or rate <= 0:
+            raise ValueError(f"line {reader.line_num}: bad currency or rate")
+        yield day, currency, rate
+
+
+def load_rates(rows, batch_size=5000):
+    """Upsert ``(date, currency, rate)`` rows into fx_rates; returns the count."""
+    table = FxRate.__table__
+    insert = sqlite_insert if db.session.get_bind().dialect.name == 'sqlite' else pg_insert
+    loaded = 0
+    batch = {}  # keyed so a repeated (currency, date) in one statement can't conflict with itself
+
+    def flush():
+        stmt = insert(table).values(list(batch.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.currency, table.c.date], set_={'rate': stmt.excluded.rate},
+        )
+        db.session.execute(stmt)
+
+    for day, currency, rate in rows:
+        batch[currency, day] = {'date': day, 'currency': currency, 'rate': rate}
+        if len(batch) >= batch_size:
+            flush()
+            loaded += len(batch)
+            batch = {}
+    if batch:
+        flush()
+        loaded += len(batch)
+    return loaded
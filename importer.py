@@ -0,0 +1,156 @@
+"""Bulk expense import from CSV or XLSX files.
+
+Rows are parsed as a stream, validated against the ``expenses`` columns and
+loaded in batches: Postgres ``COPY`` where available, a batched
+``executemany`` INSERT otherwise (SQLite). The whole import, including the
+monthly rollup update, is one transaction that the caller commits.
+"""
+import csv
+import io
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from models import db, Expense
+
+# Column -> max length for the free-text columns
+TEXT_LIMITS = {'category': 100, 'currency': 10, 'country': 100, 'description': None}
+COLUMNS = ('date', 'amount') + tuple(TEXT_LIMITS)
+MAX_AMOUNT = Decimal('9999999999.99')  # Numeric(12, 2)
+MAX_REPORTED_ERRORS = 200
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []  # (line number, message), capped at MAX_REPORTED_ERRORS
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def read_rows(stream, filename):
+    """Yield ``(line number, {column: raw value})`` from a CSV or XLSX file."""
+    if filename.lower().endswith('.xlsx'):
+        return _xlsx_rows(stream)
+    return _csv_rows(stream)
+
+
+def _normalise_header(cells):
+    return [str(c or '').strip().lower() for c in cells]
+
+
+def _csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = _normalise_header(next(reader, []))
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            yield reader.line_num, dict(zip(header, row))
+
+
+def _xlsx_rows(stream):
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the sheet XML instead of loading it all
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = _normalise_header(next(rows, []))
+        for line, row in enumerate(rows, start=2):
+            if any(cell not in (None, '') for cell in row):
+                yield line, dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def validate(raw):
+    """Turn one raw row into ``expenses`` column values, or raise ValueError."""
+    value = raw.get('date')
+    if isinstance(value, datetime):
+        day = value.date()
+    elif isinstance(value, date):
+        day = value
+    else:
+        try:
+            day = datetime.strptime(str(value or '').strip(), '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"date {value!r} is not YYYY-MM-DD")
+
+    try:
+        amount = Decimal(str(raw.get('amount') or '').strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"amount {raw.get('amount')!r} is not a number")
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"amount {amount} is out of range")
+
+    row = {'date': day, 'amount': amount}
+    for column, limit in TEXT_LIMITS.items():
+        text = str(raw.get(column) or '').strip()
+        if limit and len(text) > limit:
+            raise ValueError(f"{column} is longer than {limit} characters")
+        row[column] = text
+    row['currency'] = row['currency'].upper()
+    return row
+
+
+def import_expenses(user_id, rows, add_to_totals, batch_size=5000):
+    """Validate and load ``rows`` for ``user_id`` in the current transaction.
+
+    ``add_to_totals(deltas, date, currency, amount)`` accumulates the rollup
+    deltas; they are returned alongside the result for the caller to apply
+    before committing.
+    """
+    result = ImportResult()
+    deltas = {}
+    dialect = db.session.get_bind().dialect
+    load = _copy_batch if dialect.name == 'postgresql' and dialect.driver in COPY_DRIVERS else _insert_batch
+    batch = []
+    for line, raw in rows:
+        try:
+            row = validate(raw)
+        except ValueError as e:
+            result.error(line, str(e))
+            continue
+        row['user_id'] = user_id
+        batch.append(row)
+        add_to_totals(deltas, row['date'], row['currency'], row['amount'])
+        if len(batch) >= batch_size:
+            load(batch)
+            result.imported += len(batch)
+            batch = []
+    if batch:
+        load(batch)
+        result.imported += len(batch)
+    return result, deltas
+
+
+# Postgres drivers whose cursors can COPY: psycopg2 (copy_expert) and
+# psycopg 3 (copy); anything else loads with executemany INSERTs
+COPY_DRIVERS = ('psycopg2', 'psycopg')
+_COPY_COLUMNS = ('user_id', 'date', 'amount', 'category', 'currency', 'country', 'description')
+
+
+def _copy_batch(batch):
+    buf = io.StringIO()
+    # Quote text so empty values load as '' (like the /add form), not NULL
+    writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC)
+    for row in batch:
+        writer.writerow([row[c] for c in _COPY_COLUMNS])
+    buf.seek(0)
+    sql = f"COPY expenses ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    # Same connection (and transaction) as the ORM session
+    connection = db.session.connection()
+    raw = connection.connection.driver_connection
+    with raw.cursor() as cursor:
+        if connection.dialect.driver == 'psycopg':
+            with cursor.copy(sql) as copy:
+                copy.write(buf.getvalue())
+        else:
+            cursor.copy_expert(sql, buf)
+
+
+def _insert_batch(batch):
+    db.session.execute(Expense.__table__.insert(), batch)
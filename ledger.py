@@ -0,0 +1,206 @@
+"""Per-user ledger of credits and expenses.
+
+Every credit and expense is appended to ``ledger_entries`` with a signed
+amount and the running balance of the user's money in that currency after
+it; deleting an expense appends a reversal dated like the expense. The
+latest balance per currency is kept in ``ledger_balances``, so the current
+balance is a primary-key read however long the history.
+
+``balance_snapshots`` hold each user's balances at month ends. The balance
+on any past date is the nearest earlier snapshot plus the entries dated
+between it and that date, plus any backdated entries posted after the
+snapshot was taken: two short index range scans.
+
+Postings lock the user's row, so concurrent writes for one user can't
+compute running balances from the same starting point.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from sqlalchemy import Date, func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, User, Expense, Credit, LedgerEntry, LedgerBalance, BalanceSnapshot
+
+
+def _lock_user(user_id):
+    # FOR UPDATE is left out on SQLite, which serialises writers anyway
+    db.session.execute(select(User.id).where(User.id == user_id).with_for_update())
+
+
+def _upsert(table, rows, keys, columns):
+    insert = sqlite_insert if db.session.get_bind().dialect.name == 'sqlite' else pg_insert
+    stmt = insert(table).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c[k] for k in keys], set_={c: stmt.excluded[c] for c in columns},
+    ))
+
+
+def post(user_id, entries):
+    """Append ``(currency, day, amount, kind, ref_id)`` entries in the current
+    transaction. Amounts are signed: credits positive, expenses negative."""
+    entries = list(entries)
+    if not entries:
+        return
+    _lock_user(user_id)
+    balances = dict(db.session.query(LedgerBalance.currency, LedgerBalance.balance).filter(
+        LedgerBalance.user_id == user_id))
+    rows = []
+    touched = set()
+    for currency, day, amount, kind, ref_id in entries:
+        currency = currency or ''
+        amount = Decimal(str(amount))
+        balances[currency] = balances.get(currency, Decimal(0)) + amount
+        touched.add(currency)
+        rows.append({
+            'user_id': user_id, 'currency': currency, 'entry_date': day, 'kind': kind,
+            'ref_id': ref_id, 'amount': amount, 'balance': balances[currency],
+        })
+    db.session.execute(LedgerEntry.__table__.insert(), rows)
+    _upsert(LedgerBalance.__table__,
+            [{'user_id': user_id, 'currency': c, 'balance': balances[c]} for c in touched],
+            ('user_id', 'currency'), ('balance',))
+
+
+def balances_query(user_id):
+    return db.session.query(LedgerBalance.currency, LedgerBalance.balance).filter(LedgerBalance.user_id == user_id)
+
+
+def current_balances(user_id):
+    """``{currency: balance}`` as of now."""
+    return dict(balances_query(user_id))
+
+
+def dated_sums_query(user_id, through, after=None):
+    """Per-currency sums of entries dated in ``(after, through]``."""
+    query = db.session.query(LedgerEntry.currency, func.sum(LedgerEntry.amount)).filter(
+        LedgerEntry.user_id == user_id, LedgerEntry.entry_date <= through)
+    if after is not None:
+        query = query.filter(LedgerEntry.entry_date > after)
+    return query.group_by(LedgerEntry.currency)
+
+
+def late_sums_query(user_id, as_of, last_entry_id):
+    """Per-currency sums of entries dated up to ``as_of`` but posted after
+    entry ``last_entry_id`` (backdated expenses, reversals)."""
+    return db.session.query(LedgerEntry.currency, func.sum(LedgerEntry.amount)).filter(
+        LedgerEntry.user_id == user_id, LedgerEntry.id > last_entry_id, LedgerEntry.entry_date <= as_of,
+    ).group_by(LedgerEntry.currency)
+
+
+def balance_at(user_id, day):
+    """``{currency: balance}`` at the end of ``day``."""
+    balances = defaultdict(Decimal)
+    as_of = db.session.query(BalanceSnapshot.as_of).filter(
+        BalanceSnapshot.user_id == user_id, BalanceSnapshot.as_of <= day,
+    ).order_by(BalanceSnapshot.as_of.desc()).limit(1).scalar()
+    if as_of is None:
+        parts = [dated_sums_query(user_id, day)]
+    else:
+        last_entry_id = 0
+        for currency, balance, last_entry_id in db.session.query(
+                BalanceSnapshot.currency, BalanceSnapshot.balance, BalanceSnapshot.last_entry_id).filter(
+                BalanceSnapshot.user_id == user_id, BalanceSnapshot.as_of == as_of):
+            balances[currency] += balance
+        parts = [dated_sums_query(user_id, day, after=as_of), late_sums_query(user_id, as_of, last_entry_id)]
+    for part in parts:
+        for currency, amount in part:
+            balances[currency] += Decimal(amount)
+    return dict(balances)
+
+
+def previous_month_end(today):
+    return today.replace(day=1) - timedelta(days=1)
+
+
+def snapshot(user_id, as_of):
+    """(Re)take the user's snapshot at the end of ``as_of``; returns the
+    number of currencies in it."""
+    _lock_user(user_id)
+    last_entry_id = db.session.query(func.max(LedgerEntry.id)).filter(LedgerEntry.user_id == user_id).scalar()
+    if last_entry_id is None:
+        return 0
+    BalanceSnapshot.query.filter_by(user_id=user_id, as_of=as_of).delete(synchronize_session=False)
+    # Computed from the previous snapshot, so each one costs about a month of entries
+    balances = balance_at(user_id, as_of)
+    if balances:
+        db.session.execute(BalanceSnapshot.__table__.insert(), [
+            {'user_id': user_id, 'as_of': as_of, 'currency': currency, 'balance': balance,
+             'last_entry_id': last_entry_id}
+            for currency, balance in balances.items()
+        ])
+    return len(balances)
+
+
+def take_snapshots(as_of, user_id=None):
+    """Snapshot everyone with ledger entries (or one user) who has no
+    snapshot at ``as_of`` yet, committing per user; returns how many."""
+    missing = db.session.query(LedgerBalance.user_id).distinct().filter(
+        ~select(BalanceSnapshot.user_id).where(
+            BalanceSnapshot.user_id == LedgerBalance.user_id, BalanceSnapshot.as_of == as_of,
+        ).exists())
+    if user_id is not None:
+        missing = missing.filter(LedgerBalance.user_id == user_id)
+    taken = 0
+    for (uid,) in missing.all():
+        snapshot(uid, as_of)
+        db.session.commit()
+        taken += 1
+    return taken
+
+
+def expected_balances(user_id=None):
+    """``{(user_id, currency): balance}`` recomputed from credits and expenses."""
+    balances = defaultdict(Decimal)
+    for model, sign in ((Credit, 1), (Expense, -1)):
+        query = db.session.query(model.user_id, func.coalesce(model.currency, ''), func.sum(model.amount)).filter(
+            model.user_id.isnot(None)).group_by(model.user_id, func.coalesce(model.currency, ''))
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        for uid, currency, total in query:
+            balances[uid, currency] += sign * Decimal(total or 0)
+    return dict(balances)
+
+
+def rebuild(user_id=None):
+    """Replace the ledger (or one user's) with entries for every credit and
+    expense, in date order, in the current transaction."""
+    for model in (LedgerEntry, LedgerBalance, BalanceSnapshot):
+        query = model.query
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        query.delete(synchronize_session=False)
+
+    def day_of(column):
+        return func.coalesce(func.date(column, type_=Date), func.current_date())
+
+    credits = select(
+        Credit.user_id, func.coalesce(Credit.currency, '').label('currency'),
+        day_of(Credit.created_at).label('entry_date'), literal('credit').label('kind'),
+        Credit.id.label('ref_id'), Credit.amount.label('amount'),
+    ).where(Credit.user_id.isnot(None), Credit.amount.isnot(None))
+    expenses = select(
+        Expense.user_id, func.coalesce(Expense.currency, '').label('currency'),
+        func.coalesce(Expense.date, day_of(Expense.created_at)).label('entry_date'),
+        literal('expense').label('kind'), Expense.id.label('ref_id'), (-Expense.amount).label('amount'),
+    ).where(Expense.user_id.isnot(None), Expense.amount.isnot(None))
+    if user_id is not None:
+        credits = credits.where(Credit.user_id == user_id)
+        expenses = expenses.where(Expense.user_id == user_id)
+    source = union_all(credits, expenses).subquery()
+    running = func.sum(source.c.amount).over(
+        partition_by=(source.c.user_id, source.c.currency),
+        order_by=(source.c.entry_date, source.c.kind, source.c.ref_id),
+    )
+    columns = ('user_id', 'currency', 'entry_date', 'kind', 'ref_id', 'amount')
+    db.session.execute(LedgerEntry.__table__.insert().from_select(
+        columns + ('balance',),
+        select(*(source.c[c] for c in columns), running).order_by(source.c.entry_date, source.c.kind, source.c.ref_id),
+    ))
+    totals = select(LedgerEntry.user_id, LedgerEntry.currency, func.sum(LedgerEntry.amount)).group_by(
+        LedgerEntry.user_id, LedgerEntry.currency)
+    if user_id is not None:
+        totals = totals.where(LedgerEntry.user_id == user_id)
+    db.session.execute(LedgerBalance.__table__.insert().from_select(('user_id', 'currency', 'balance'), totals))
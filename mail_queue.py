@@ -0,0 +1,132 @@
+"""Background delivery for outgoing mail.
+
+Request handlers hand a ``flask_mail.Message`` to ``MailQueue.enqueue`` and
+return straight away. A small pool of worker threads delivers the messages
+over SMTP connections that stay open between sends, retrying failures with
+exponential backoff. Each job's delivery status can be looked up by id.
+"""
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class MailQueue:
+    def __init__(self, app=None, mail=None):
+        self.app = None
+        self.mail = mail
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._status = OrderedDict()
+        self._workers = []
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail=None):
+        self.app = app
+        self.mail = mail or self.mail
+        self.worker_count = app.config.get('MAIL_QUEUE_WORKERS', 2)
+        self.max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', 4)
+        self.backoff = app.config.get('MAIL_RETRY_BACKOFF', 2.0)
+        self.idle_timeout = app.config.get('MAIL_CONNECTION_IDLE', 60)
+        self.status_limit = app.config.get('MAIL_STATUS_LIMIT', 1000)
+        app.extensions['mail_queue'] = self
+
+    def enqueue(self, message, on_failure=None):
+        """Queue ``message`` for delivery and return its job id.
+
+        ``on_failure(message, error)`` is called from a worker thread if the
+        message is still undelivered after the last attempt.
+        """
+        self._start_workers()
+        job_id = next(self._ids)
+        self._set_status(job_id, state='queued', attempts=0, error=None)
+        self._queue.put((job_id, message, on_failure, 0))
+        return job_id
+
+    def status(self, job_id):
+        """Delivery status for a job, or None if unknown to this process."""
+        with self._lock:
+            status = self._status.get(job_id)
+            return dict(status) if status else None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _set_status(self, job_id, **fields):
+        with self._lock:
+            status = self._status.setdefault(job_id, {})
+            status.update(fields, updated_at=time.time())
+            self._status.move_to_end(job_id)
+            while len(self._status) > self.status_limit:
+                self._status.popitem(last=False)
+
+    def start(self):
+        """Set up Flask-Mail and the workers if that hasn't happened yet.
+
+        ``flask_mail.Message`` looks up the Mail extension for its default
+        sender, so call this before building a message.
+        """
+        self._start_workers()
+
+    def _start_workers(self):
+        # Started lazily so threads are created in the serving process, not
+        # in a parent that gunicorn forks workers from.
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            if self.mail is None:
+                from flask_mail import Mail
+                self.mail = Mail(self.app)
+            for n in range(self.worker_count):
+                worker = threading.Thread(target=self._run, name=f'mail-queue-{n}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        with self.app.app_context():
+            conn = None
+            while True:
+                try:
+                    job = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    # Don't hold an idle SMTP session open indefinitely
+                    conn = self._close(conn)
+                    continue
+                conn = self._deliver(conn, *job)
+
+    def _deliver(self, conn, job_id, message, on_failure, attempts):
+        attempts += 1
+        self._set_status(job_id, state='sending', attempts=attempts)
+        try:
+            if conn is None:
+                conn = self.mail.connect().__enter__()
+            conn.send(message)
+        except Exception as e:
+            conn = self._close(conn)
+            if attempts < self.max_attempts:
+                delay = self.backoff * 2 ** (attempts - 1)
+                self._set_status(job_id, state='retrying', error=str(e))
+                timer = threading.Timer(delay, self._queue.put, args=((job_id, message, on_failure, attempts),))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._set_status(job_id, state='failed', error=str(e))
+                if on_failure is not None:
+                    on_failure(message, e)
+            return conn
+        self._set_status(job_id, state='sent', error=None)
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
@@ -0,0 +1,232 @@
+"""Request, SQL and render instrumentation, exported in Prometheus text format.
+
+Every request is timed from ``before_request`` to ``teardown_request`` (for a
+streamed response that is after the last chunk) into a latency histogram per
+endpoint and method. SQL is timed with the engine's ``before_cursor_execute``
+and ``after_cursor_execute`` events: the running query count and time of the
+current request are kept in ``g.sql_queries`` / ``g.sql_seconds`` and folded
+into per-endpoint totals when it ends. Statements slower than
+``SLOW_QUERY_MS`` are printed and kept (with the endpoint that issued them)
+in a short in-memory log.
+
+Everything is per process: each gunicorn worker reports its own numbers, so
+scrape every worker or sum over the ``pid`` label.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label tuple."""
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self, extra):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = _labels(zip(self.labels, label_values), extra)
+            for bound, n in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{_wrap(labels + [("le", _number(bound))])} {n}'
+            yield f'{self.name}_bucket{_wrap(labels + [("le", "+Inf")])} {count}'
+            yield f'{self.name}_sum{_wrap(labels)} {_number(total)}'
+            yield f'{self.name}_count{_wrap(labels)} {count}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, amount, *label_values):
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._series.get(label_values, 0)
+
+    def expose(self, extra):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in sorted(self._series.items()):
+            yield f'{self.name}{_wrap(_labels(zip(self.labels, label_values), extra))} {_number(value)}'
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.slow_query_seconds = 0.2
+        self.slow_queries = deque(maxlen=100)
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Time from request start to the last byte sent.',
+            ('endpoint', 'method'))
+        self.requests = Counter('http_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+        self.request_queries = Histogram(
+            'http_request_sql_queries', 'SQL statements executed per request.',
+            ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.sql_queries = Counter('sql_queries_total', 'SQL statements executed.', ('endpoint',))
+        self.sql_seconds = Counter('sql_query_seconds_total', 'Time spent executing SQL.', ('endpoint',))
+        self.slow_query_count = Counter('sql_slow_queries_total', 'SQL statements over SLOW_QUERY_MS.', ('endpoint',))
+        self.render_seconds = Histogram(
+            'statement_render_seconds', 'Time spent producing a statement download (cache misses only).',
+            ('format',))
+        self._families = [
+            self.request_latency, self.requests, self.request_queries, self.sql_queries,
+            self.sql_seconds, self.slow_query_count, self.render_seconds,
+        ]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_query_seconds = app.config.get('SLOW_QUERY_MS', 200) / 1000
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        app.extensions['metrics'] = self
+
+    def install_sql_events(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor)
+
+    # --- requests ---
+
+    def _before(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+
+    def _after(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        status = 500 if exc is not None else g.pop('metrics_status', 500)
+        with self._lock:
+            self.request_latency.observe(elapsed, endpoint, request.method)
+            self.requests.inc(1, endpoint, request.method, str(status))
+            self.request_queries.observe(g.get('sql_queries', 0), endpoint)
+
+    # --- SQL ---
+
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('metrics_query_started')
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        endpoint = None
+        if has_request_context():
+            endpoint = request.endpoint or 'unmatched'
+            g.sql_queries = g.get('sql_queries', 0) + 1
+            g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+        endpoint = endpoint or 'none'
+        slow = elapsed >= self.slow_query_seconds
+        with self._lock:
+            self.sql_queries.inc(1, endpoint)
+            self.sql_seconds.inc(elapsed, endpoint)
+            if slow:
+                self.slow_query_count.inc(1, endpoint)
+                self.slow_queries.append({
+                    'at': time.time(), 'endpoint': endpoint,
+                    'ms': round(elapsed * 1000, 1), 'statement': statement,
+                })
+        if slow:
+            print(f"Slow query ({elapsed * 1000:.0f} ms) in {endpoint}:", ' '.join(statement.split()))
+
+    # --- renders ---
+
+    def timed(self, chunks, fmt):
+        """Pass ``chunks`` through, recording the time spent producing them.
+
+        Only time inside the generator counts, not time the client takes to
+        read what was already sent.
+        """
+        spent = 0.0
+        chunks = iter(chunks)
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                spent += time.perf_counter() - started
+            yield chunk
+        with self._lock:
+            self.render_seconds.observe(spent, fmt)
+
+    # --- export ---
+
+    def queries(self, endpoint):
+        """SQL statements issued by ``endpoint`` so far in this process."""
+        with self._lock:
+            return self.sql_queries.get(endpoint)
+
+    def slow_query_log(self):
+        with self._lock:
+            return list(self.slow_queries)
+
+    def expose(self, sampled=()):
+        """The Prometheus text exposition, plus ``sampled`` families read by
+        the caller: ``(name, type, help, [(labels dict, value), ...])``."""
+        extra = [('pid', str(os.getpid()))]
+        lines = []
+        with self._lock:
+            for family in self._families:
+                lines.extend(family.expose(extra))
+        for name, kind, help_text, samples in sampled:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_wrap(_labels(labels.items(), extra))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs, extra):
+    pairs = list(pairs)
+    names = {name for name, _ in pairs}
+    return pairs + [pair for pair in extra if pair[0] not in names]
+
+
+def _wrap(labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}' if labels else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -51,6 +51,20 @@ def get_metadata():
     return target_db.metadata
 
 
+# Search structures from migration 0010 that the models don't describe:
+# Postgres' generated tsvector column and its indexes, SQLite's FTS5 tables
+SEARCH_COLUMNS = {'search_vector'}
+SEARCH_INDEXES = {'ix_expenses_search_vector', 'ix_expenses_search_trgm'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name.startswith('expenses_fts'):
+        return False
+    if reflected and compare_to is None and (name in SEARCH_COLUMNS or name in SEARCH_INDEXES):
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +79,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -93,6 +108,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,70 @@
+"""baseline schema
+
+Captures the tables that were previously created by ``db.create_all()`` at
+startup. Tables that already exist are left alone, so databases created that
+way can simply run ``flask db upgrade``.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('email', sa.String(length=255), nullable=False, unique=True),
+            sa.Column('password_hash', sa.String(length=255), nullable=False),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+    if 'otp_verification' not in existing:
+        op.create_table(
+            'otp_verification',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('email', sa.String(length=255)),
+            sa.Column('otp', sa.String(length=10)),
+            sa.Column('expires_at', sa.DateTime()),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+    if 'expenses' not in existing:
+        op.create_table(
+            'expenses',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE')),
+            sa.Column('amount', sa.Numeric(12, 2)),
+            sa.Column('category', sa.String(length=100)),
+            sa.Column('currency', sa.String(length=10)),
+            sa.Column('country', sa.String(length=100)),
+            sa.Column('description', sa.Text()),
+            sa.Column('date', sa.Date()),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+    if 'credits' not in existing:
+        op.create_table(
+            'credits',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE')),
+            sa.Column('amount', sa.Numeric(12, 2)),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+
+
+def downgrade():
+    op.drop_table('credits')
+    op.drop_table('expenses')
+    op.drop_table('otp_verification')
+    op.drop_table('users')
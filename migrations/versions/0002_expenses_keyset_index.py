@@ -0,0 +1,24 @@
+"""index expenses on (user_id, date, id) for dashboard keyset pagination
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_expenses_user_date_id', 'expenses', ['user_id', 'date', 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_expenses_user_date_id', table_name='expenses')
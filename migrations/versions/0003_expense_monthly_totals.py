@@ -0,0 +1,42 @@
+"""per-user monthly expense rollup table
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'expense_monthly_totals',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('month', sa.Date(), primary_key=True),
+        sa.Column('currency', sa.String(length=10), primary_key=True),
+        sa.Column('total', sa.Numeric(14, 2), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+    )
+    # Backfill from existing expenses
+    if op.get_bind().dialect.name == 'sqlite':
+        month = "date(date, 'start of month')"
+    else:
+        month = "CAST(date_trunc('month', date) AS date)"
+    op.execute(
+        "INSERT INTO expense_monthly_totals (user_id, month, currency, total, count) "
+        f"SELECT user_id, {month}, COALESCE(currency, ''), SUM(amount), COUNT(*) "
+        "FROM expenses WHERE date IS NOT NULL AND user_id IS NOT NULL "
+        f"GROUP BY user_id, {month}, COALESCE(currency, '')"
+    )
+
+
+def downgrade():
+    op.drop_table('expense_monthly_totals')
@@ -0,0 +1,29 @@
+"""user-scoped indexes on expenses and credits
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:40:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_expenses_user_id_id', 'expenses', ['user_id', 'id'], if_not_exists=True)
+    # credits has no date column; created_at is its timeline
+    op.create_index('ix_credits_user_created_id', 'credits', ['user_id', 'created_at', 'id'], if_not_exists=True)
+    op.create_index('ix_credits_user_id_id', 'credits', ['user_id', 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_credits_user_id_id', table_name='credits')
+    op.drop_index('ix_credits_user_created_id', table_name='credits')
+    op.drop_index('ix_expenses_user_id_id', table_name='expenses')
@@ -0,0 +1,26 @@
+"""data version counter on expense_monthly_totals
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('expense_monthly_totals') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('expense_monthly_totals') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,37 @@
+"""fx rate table, home currency on users, currency on credits
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'fx_rates',
+        sa.Column('currency', sa.String(length=10), primary_key=True),
+        sa.Column('date', sa.Date(), primary_key=True),
+        sa.Column('rate', sa.Numeric(18, 8), nullable=False),
+    )
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('home_currency', sa.String(length=10)))
+    with op.batch_alter_table('credits') as batch_op:
+        batch_op.add_column(sa.Column('currency', sa.String(length=10)))
+
+
+def downgrade():
+    with op.batch_alter_table('credits') as batch_op:
+        batch_op.drop_column('currency')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('home_currency')
+    op.drop_table('fx_rates')
@@ -0,0 +1,28 @@
+"""per-user data version for conditional GET
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('data_updated_at', sa.DateTime()))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('data_updated_at')
+        batch_op.drop_column('data_version')
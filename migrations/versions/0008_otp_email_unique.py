@@ -0,0 +1,31 @@
+"""one OTP row per email, indexed for lookup and expiry sweeps
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 12:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep only the newest OTP per email (older ones could never be used)
+    op.execute(
+        "DELETE FROM otp_verification WHERE email IS NULL OR id NOT IN "
+        "(SELECT max_id FROM (SELECT MAX(id) AS max_id FROM otp_verification GROUP BY email) AS latest)"
+    )
+    op.create_index('ux_otp_verification_email', 'otp_verification', ['email'], unique=True, if_not_exists=True)
+    op.create_index('ix_otp_verification_expires_at', 'otp_verification', ['expires_at'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_otp_verification_expires_at', table_name='otp_verification')
+    op.drop_index('ux_otp_verification_email', table_name='otp_verification')
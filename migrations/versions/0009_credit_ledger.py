@@ -0,0 +1,75 @@
+"""credit/expense ledger with running balances and balance snapshots
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ledger_entries',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('currency', sa.String(length=10), nullable=False),
+        sa.Column('entry_date', sa.Date(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('ref_id', sa.Integer()),
+        sa.Column('amount', sa.Numeric(14, 2), nullable=False),
+        sa.Column('balance', sa.Numeric(14, 2), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index('ix_ledger_entries_user_date', 'ledger_entries', ['user_id', 'entry_date'])
+    op.create_index('ix_ledger_entries_user_id_id', 'ledger_entries', ['user_id', 'id'])
+    op.create_table(
+        'ledger_balances',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('currency', sa.String(length=10), primary_key=True),
+        sa.Column('balance', sa.Numeric(14, 2), nullable=False),
+    )
+    op.create_table(
+        'balance_snapshots',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('as_of', sa.Date(), primary_key=True),
+        sa.Column('currency', sa.String(length=10), primary_key=True),
+        sa.Column('balance', sa.Numeric(14, 2), nullable=False),
+        sa.Column('last_entry_id', sa.Integer(), nullable=False),
+    )
+    # Backfill: every existing credit and expense, running balances in date
+    # order (same as `flask ledger rebuild`)
+    op.execute(
+        "INSERT INTO ledger_entries (user_id, currency, entry_date, kind, ref_id, amount, balance) "
+        "SELECT user_id, currency, entry_date, kind, ref_id, amount, "
+        "SUM(amount) OVER (PARTITION BY user_id, currency ORDER BY entry_date, kind, ref_id) "
+        "FROM ("
+        "SELECT user_id, COALESCE(currency, '') AS currency, "
+        "COALESCE(date(created_at), CURRENT_DATE) AS entry_date, 'credit' AS kind, id AS ref_id, amount "
+        "FROM credits WHERE user_id IS NOT NULL AND amount IS NOT NULL "
+        "UNION ALL "
+        "SELECT user_id, COALESCE(currency, ''), COALESCE(date, date(created_at), CURRENT_DATE), "
+        "'expense', id, -amount "
+        "FROM expenses WHERE user_id IS NOT NULL AND amount IS NOT NULL"
+        ") AS source ORDER BY entry_date, kind, ref_id"
+    )
+    op.execute(
+        "INSERT INTO ledger_balances (user_id, currency, balance) "
+        "SELECT user_id, currency, SUM(amount) FROM ledger_entries GROUP BY user_id, currency"
+    )
+
+
+def downgrade():
+    op.drop_table('balance_snapshots')
+    op.drop_table('ledger_balances')
+    op.drop_index('ix_ledger_entries_user_id_id', table_name='ledger_entries')
+    op.drop_index('ix_ledger_entries_user_date', table_name='ledger_entries')
+    op.drop_table('ledger_entries')
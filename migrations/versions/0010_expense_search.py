@@ -0,0 +1,69 @@
+"""full-text and substring search over expense description and category
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 13:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+# Keep in step with search.SEARCH_TEXT_SQL
+SEARCH_TEXT = "(coalesce(description, '') || ' ' || coalesce(category, ''))"
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # btree_gin lets user_id lead the GIN indexes, so a search only
+        # touches the searching user's postings
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+        op.execute(
+            "ALTER TABLE expenses ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('simple', {SEARCH_TEXT})) STORED"
+        )
+        op.execute("CREATE INDEX ix_expenses_search_vector ON expenses USING gin (user_id, search_vector)")
+        op.execute(f"CREATE INDEX ix_expenses_search_trgm ON expenses USING gin (user_id, {SEARCH_TEXT} gin_trgm_ops)")
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE expenses_fts USING fts5("
+        "description, category, content='expenses', content_rowid='id')"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_insert AFTER INSERT ON expenses BEGIN "
+        "INSERT INTO expenses_fts (rowid, description, category) VALUES (new.id, new.description, new.category); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_delete AFTER DELETE ON expenses BEGIN "
+        "INSERT INTO expenses_fts (expenses_fts, rowid, description, category) "
+        "VALUES ('delete', old.id, old.description, old.category); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER expenses_fts_update AFTER UPDATE OF description, category ON expenses BEGIN "
+        "INSERT INTO expenses_fts (expenses_fts, rowid, description, category) "
+        "VALUES ('delete', old.id, old.description, old.category); "
+        "INSERT INTO expenses_fts (rowid, description, category) VALUES (new.id, new.description, new.category); "
+        "END"
+    )
+    op.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_expenses_search_trgm")
+        op.execute("DROP INDEX ix_expenses_search_vector")
+        op.execute("ALTER TABLE expenses DROP COLUMN search_vector")
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute(f"DROP TRIGGER expenses_fts_{trigger}")
+    op.execute("DROP TABLE expenses_fts")
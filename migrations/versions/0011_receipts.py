@@ -0,0 +1,47 @@
+"""receipt uploads, stored once per content hash
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'receipts',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('expense_id', sa.Integer(), sa.ForeignKey('expenses.id', ondelete='SET NULL')),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('filename', sa.String(length=255)),
+        sa.Column('content_type', sa.String(length=100)),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('width', sa.Integer()),
+        sa.Column('height', sa.Integer()),
+        sa.Column('amount', sa.Numeric(12, 2)),
+        sa.Column('date', sa.Date()),
+        sa.Column('category', sa.String(length=100)),
+        sa.Column('error', sa.String(length=255)),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        sa.Column('processed_at', sa.DateTime()),
+    )
+    op.create_index('ux_receipts_user_sha256', 'receipts', ['user_id', 'sha256'], unique=True)
+    op.create_index('ix_receipts_user_id_id', 'receipts', ['user_id', 'id'])
+    op.create_index('ix_receipts_sha256_status', 'receipts', ['sha256', 'status'])
+    op.create_index('ix_receipts_status_created_at', 'receipts', ['status', 'created_at'])
+    op.create_index('ix_receipts_expense_id', 'receipts', ['expense_id'])
+
+
+def downgrade():
+    op.drop_table('receipts')
@@ -0,0 +1,48 @@
+"""background statement export jobs
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'export_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('period', sa.String(length=10), nullable=False),
+        sa.Column('format', sa.String(length=10), nullable=False),
+        sa.Column('version', sa.String(length=100), nullable=False),
+        sa.Column('currency', sa.String(length=10)),
+        sa.Column('filename', sa.String(length=100), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('rows_done', sa.Integer(), nullable=False),
+        sa.Column('rows_total', sa.Integer()),
+        sa.Column('size', sa.BigInteger()),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.String(length=255)),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        sa.Column('started_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+        sa.Column('finished_at', sa.DateTime()),
+        sa.Column('expires_at', sa.DateTime()),
+    )
+    op.create_index('ux_export_jobs_key', 'export_jobs', ['user_id', 'period', 'format', 'version'], unique=True)
+    op.create_index('ix_export_jobs_user_id_id', 'export_jobs', ['user_id', 'id'])
+    op.create_index('ix_export_jobs_status_updated_at', 'export_jobs', ['status', 'updated_at'])
+    op.create_index('ix_export_jobs_expires_at', 'export_jobs', ['expires_at'])
+
+
+def downgrade():
+    op.drop_table('export_jobs')
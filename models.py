@@ -0,0 +1,184 @@
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+# ---------- Models ----------
+class User(db.Model):
+    __tablename__ = 'users'
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(255), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    # Currency totals are shown in; NULL means the configured HOME_CURRENCY
+    home_currency = db.Column(db.String(10))
+    # Bumped with every change to the user's expenses, credits or settings;
+    # drives the ETag/Last-Modified of their pages. data_updated_at is UTC.
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    data_updated_at = db.Column(db.DateTime)
+    expenses = db.relationship('Expense', backref='user', cascade='all, delete-orphan', lazy=True)
+
+class OTPVerification(db.Model):
+    __tablename__ = 'otp_verification'
+    __table_args__ = (
+        # One live OTP per address, replaced by upsert on each request
+        db.Index('ux_otp_verification_email', 'email', unique=True),
+        db.Index('ix_otp_verification_expires_at', 'expires_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(255))
+    otp = db.Column(db.String(10))
+    expires_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+class Expense(db.Model):
+  __tablename__ = 'expenses'
+  __table_args__ = (
+    # Backs the dashboard's keyset pagination on (date, id) per user
+    db.Index('ix_expenses_user_date_id', 'user_id', 'date', 'id'),
+    db.Index('ix_expenses_user_id_id', 'user_id', 'id'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+  amount = db.Column(db.Numeric(12,2))
+  category = db.Column(db.String(100))
+  currency = db.Column(db.String(10))
+  country = db.Column(db.String(100))
+  description = db.Column(db.Text)
+  date = db.Column(db.Date)
+  created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+# New Credit model
+class Credit(db.Model):
+  __tablename__ = 'credits'
+  __table_args__ = (
+    db.Index('ix_credits_user_created_id', 'user_id', 'created_at', 'id'),
+    db.Index('ix_credits_user_id_id', 'user_id', 'id'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+  amount = db.Column(db.Numeric(12,2))
+  # The owner's home currency when the credit was added; NULL means HOME_CURRENCY
+  currency = db.Column(db.String(10))
+  created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+# Per-user, per-month, per-currency expense totals. Kept in step with
+# `expenses` by every write path so the dashboard never has to scan history.
+class MonthlyTotal(db.Model):
+  __tablename__ = 'expense_monthly_totals'
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+  month = db.Column(db.Date, primary_key=True)  # first day of the month
+  currency = db.Column(db.String(10), primary_key=True, default='')
+  total = db.Column(db.Numeric(14,2), nullable=False, default=0)
+  count = db.Column(db.Integer, nullable=False, default=0)
+  # Bumped by every write to the month; cached statements are keyed on it
+  version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+# Exchange rates loaded by `flask load-fx-rates`: units of `currency` per one unit
+# of FX_BASE_CURRENCY on `date` (see fx.py)
+class FxRate(db.Model):
+  __tablename__ = 'fx_rates'
+  currency = db.Column(db.String(10), primary_key=True)
+  date = db.Column(db.Date, primary_key=True)
+  rate = db.Column(db.Numeric(18,8), nullable=False)
+
+# The user's money as a ledger (see ledger.py): every credit (+) and expense (-)
+# is appended with the running balance in its currency after it. Deleting an
+# expense appends a reversal rather than touching earlier entries.
+class LedgerEntry(db.Model):
+  __tablename__ = 'ledger_entries'
+  __table_args__ = (
+    # Balance at a date: entries dated after the nearest snapshot...
+    db.Index('ix_ledger_entries_user_date', 'user_id', 'entry_date'),
+    # ...and entries posted after it
+    db.Index('ix_ledger_entries_user_id_id', 'user_id', 'id'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+  # '' means HOME_CURRENCY (rows from before currencies were recorded)
+  currency = db.Column(db.String(10), nullable=False, default='')
+  entry_date = db.Column(db.Date, nullable=False)
+  kind = db.Column(db.String(10), nullable=False)  # credit, expense, reversal or import
+  # The credit or expense posted; NULL for imports, posted per day and currency
+  ref_id = db.Column(db.Integer)
+  amount = db.Column(db.Numeric(14,2), nullable=False)
+  balance = db.Column(db.Numeric(14,2), nullable=False)
+  created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+# Current balance per user and currency: the running balance of the latest entry
+class LedgerBalance(db.Model):
+  __tablename__ = 'ledger_balances'
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+  currency = db.Column(db.String(10), primary_key=True, default='')
+  balance = db.Column(db.Numeric(14,2), nullable=False, default=0)
+
+# Balance per currency at the end of `as_of`, counting entries up to id
+# `last_entry_id`. Taken at month ends so a past balance never needs more
+# than about a month of entries.
+class BalanceSnapshot(db.Model):
+  __tablename__ = 'balance_snapshots'
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+  as_of = db.Column(db.Date, primary_key=True)
+  currency = db.Column(db.String(10), primary_key=True, default='')
+  balance = db.Column(db.Numeric(14,2), nullable=False)
+  last_entry_id = db.Column(db.Integer, nullable=False)
+
+# An uploaded receipt image (see receipts.py). The file is stored once per
+# content hash however many times it is uploaded; `amount`, `date` and
+# `category` are what extraction read off it, used to pre-fill an expense.
+class Receipt(db.Model):
+  __tablename__ = 'receipts'
+  __table_args__ = (
+    # Uploading the same file twice returns the existing receipt
+    db.Index('ux_receipts_user_sha256', 'user_id', 'sha256', unique=True),
+    db.Index('ix_receipts_user_id_id', 'user_id', 'id'),
+    # Finding finished copies of a file, and pending work after a restart
+    db.Index('ix_receipts_sha256_status', 'sha256', 'status'),
+    db.Index('ix_receipts_status_created_at', 'status', 'created_at'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+  expense_id = db.Column(db.Integer, db.ForeignKey('expenses.id', ondelete='SET NULL'), index=True)
+  sha256 = db.Column(db.String(64), nullable=False)
+  filename = db.Column(db.String(255))
+  content_type = db.Column(db.String(100))
+  size = db.Column(db.Integer, nullable=False)
+  status = db.Column(db.String(10), nullable=False, default='pending')  # pending, ready or failed
+  width = db.Column(db.Integer)
+  height = db.Column(db.Integer)
+  amount = db.Column(db.Numeric(12,2))
+  date = db.Column(db.Date)
+  category = db.Column(db.String(100))
+  error = db.Column(db.String(255))
+  created_at = db.Column(db.DateTime, server_default=db.func.now())
+  processed_at = db.Column(db.DateTime)
+
+# A statement rendered in the background (see exports.py). One job per user,
+# period, format and data version, so asking again for an unchanged
+# statement reuses the job and its file until it expires.
+class ExportJob(db.Model):
+  __tablename__ = 'export_jobs'
+  __table_args__ = (
+    db.Index('ux_export_jobs_key', 'user_id', 'period', 'format', 'version', unique=True),
+    db.Index('ix_export_jobs_user_id_id', 'user_id', 'id'),
+    # Jobs whose worker went quiet, and jobs past retention
+    db.Index('ix_export_jobs_status_updated_at', 'status', 'updated_at'),
+    db.Index('ix_export_jobs_expires_at', 'expires_at'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+  period = db.Column(db.String(10), nullable=False)  # 'all', 'YYYY' or 'YYYY-MM'
+  format = db.Column(db.String(10), nullable=False)
+  version = db.Column(db.String(100), nullable=False)
+  currency = db.Column(db.String(10))  # the PDF total's currency
+  filename = db.Column(db.String(100), nullable=False)
+  status = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done or failed
+  rows_done = db.Column(db.Integer, nullable=False, default=0)
+  rows_total = db.Column(db.Integer)
+  size = db.Column(db.BigInteger)
+  attempts = db.Column(db.Integer, nullable=False, default=0)
+  error = db.Column(db.String(255))
+  created_at = db.Column(db.DateTime, server_default=db.func.now())
+  started_at = db.Column(db.DateTime)
+  updated_at = db.Column(db.DateTime)  # last progress; a running job that stops updating is requeued
+  finished_at = db.Column(db.DateTime)
+  expires_at = db.Column(db.DateTime)
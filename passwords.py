@@ -0,0 +1,78 @@
+"""Password hashing off the request thread.
+
+Werkzeug's password hashes are deliberately CPU-heavy. Run on the request
+thread, a burst of logins starves every other request the worker could be
+serving, so hashing and verification go to a bounded process pool instead.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasher:
+    def __init__(self, app=None, method=None, workers=None):
+        self.method = method
+        self.workers = workers
+        self._executor = None
+        self._slots = None
+        self._prefix = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Work factor, as a Werkzeug method string, e.g. 'scrypt:32768:8:1'
+        # or 'pbkdf2:sha256:600000'
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method or 'scrypt:32768:8:1')
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers if self.workers is not None else os.cpu_count() or 1)
+        self._prefix = None
+        # Requests waiting on a hash beyond this many block until one finishes
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', self.workers * 4)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 30)
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pw_hash, password):
+        return self._run(check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """True if ``pw_hash`` was made with a different method or cost."""
+        return pw_hash.split('$', 1)[0] != self.prefix
+
+    @property
+    def prefix(self):
+        # Werkzeug fills in defaults ('pbkdf2:sha256' -> 'pbkdf2:sha256:600000'),
+        # so take the prefix from a real hash rather than the config string.
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._prefix
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=self.timeout):
+            raise TimeoutError('password hashing pool is saturated')
+        try:
+            return executor.submit(fn, *args).result(timeout=self.timeout)
+        finally:
+            slots.release()
+
+    def _pool(self):
+        # Created on first use so each gunicorn worker gets its own pool
+        # rather than inheriting one from the master.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+            return self._executor, self._slots
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
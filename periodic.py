@@ -0,0 +1,45 @@
+"""Periodic background jobs that run inside each worker process."""
+import threading
+import time
+
+
+class PeriodicTask:
+    """Calls ``fn()`` every ``<CONFIG_KEY>`` seconds on a daemon thread.
+
+    The thread starts with the first request a process serves, so each
+    gunicorn worker runs its own after the fork. An interval of 0 disables
+    the task (run it from cron with the matching CLI command instead).
+    """
+
+    def __init__(self, fn, config_key, default=300, app=None):
+        self.fn = fn
+        self.config_key = config_key
+        self.default = default
+        self.app = None
+        self.interval = default
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get(self.config_key, self.default)
+        app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.fn.__name__, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.fn()
+            except Exception as e:
+                print(f"{self.fn.__name__} error:", e)
@@ -0,0 +1,156 @@
+"""Opt-in stack-sampling profiler for single requests.
+
+A request is profiled when it carries ``X-Profile: 1`` together with a valid
+``X-Admin-Token``, or at random with probability ``PROFILE_SAMPLE_RATE``. While
+it runs (for a streamed response, until the last chunk is sent) a helper
+thread snapshots the handling thread's Python stack every
+``PROFILE_INTERVAL_MS``, so time in Jinja, FPDF, the database driver or our
+own code all shows up without instrumenting any of them.
+
+Profiles are written to ``PROFILE_DIR`` in the collapsed-stack format
+(``outer;inner;leaf <samples>`` per line) that flamegraph.pl, speedscope and
+inferno read directly; only the newest ``PROFILE_KEEP`` are kept. The file
+name is returned in the ``X-Profile-Id`` response header.
+"""
+import hmac
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+PROFILE_SUFFIX = '.folded'
+
+
+class StackSampler:
+    """Samples one thread's stack on a background thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, app=None):
+        self.directory = None
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.keep = 50
+        self.admin_token = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(
+            tempfile.gettempdir(), 'expense_tracker_profiles')
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', self.sample_rate)
+        self.interval = app.config.get('PROFILE_INTERVAL_MS', self.interval * 1000) / 1000
+        self.keep = app.config.get('PROFILE_KEEP', self.keep)
+        self.admin_token = app.config.get('ADMIN_TOKEN')
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        app.extensions['profiler'] = self
+
+    def _requested(self):
+        if request.headers.get('X-Profile') == '1' and self.admin_token:
+            supplied = request.headers.get('X-Admin-Token', '')
+            if hmac.compare_digest(supplied.encode(), self.admin_token.encode()):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before(self):
+        if not self._requested():
+            return
+        endpoint = re.sub(r'[^\w.-]', '_', request.endpoint or 'unmatched')
+        g.profile_name = f'{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{os.getpid()}-{os.urandom(3).hex()}'
+        g.profile_sampler = StackSampler(threading.get_ident(), self.interval).start()
+
+    def _after(self, response):
+        if 'profile_name' in g:
+            response.headers['X-Profile-Id'] = g.profile_name
+        return response
+
+    def _teardown(self, exc):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        sampler.stop()
+        try:
+            self._save(g.pop('profile_name'), sampler)
+        except OSError as e:
+            print("Profile save error:", e)
+
+    def _save(self, name, sampler):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name + PROFILE_SUFFIX)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(sampler.collapsed())
+        self._prune()
+
+    def _prune(self):
+        for entry in self.list()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, entry['id'] + PROFILE_SUFFIX))
+            except FileNotFoundError:
+                pass
+
+    def list(self):
+        """Saved profiles, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(PROFILE_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append({'id': name[:-len(PROFILE_SUFFIX)], 'bytes': st.st_size, 'mtime': st.st_mtime})
+        return sorted(entries, key=lambda e: e['mtime'], reverse=True)
+
+    def path(self, profile_id):
+        """Path of a saved profile, or None (also for anything that isn't a plain id)."""
+        if not re.fullmatch(r'[\w.-]+', profile_id) or profile_id.startswith('.'):
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_SUFFIX)
+        return path if os.path.isfile(path) else None
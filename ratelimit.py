@@ -0,0 +1,83 @@
+"""In-memory token-bucket rate limits.
+
+Each bucket holds up to ``burst`` tokens and refills at ``burst / period``
+tokens per second; a request spends one. State lives in the worker process
+(no database or network round trip on the hot path), so with N gunicorn
+workers a client can get at most N times the configured allowance.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def parse_limit(text):
+    """``'5/600'`` -> ``(5, 600.0)``: 5 requests per 600 seconds."""
+    count, _, period = str(text).partition('/')
+    return int(count), float(period or 60)
+
+
+class TokenBuckets:
+    def __init__(self, limit, max_keys=100000):
+        self.burst, self.period = parse_limit(limit) if isinstance(limit, str) else limit
+        self.rate = self.burst / self.period
+        # Least recently touched keys are dropped beyond this; a dropped key
+        # just starts again with a full bucket
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def wait(self, key):
+        """Seconds until ``key`` has a token (0 if it has one now); spends nothing."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def hit(self, key):
+        """Spend a token for ``key``. Returns 0 if allowed, else seconds until
+        a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RateLimits:
+    """Named token-bucket limits, configured from ``<NAME>_LIMIT`` settings."""
+
+    def __init__(self, app=None, **defaults):
+        self.defaults = defaults
+        self.buckets = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        max_keys = app.config.get('RATE_LIMIT_MAX_KEYS', 100000)
+        self.buckets = {
+            name: TokenBuckets(app.config.get(f'{name.upper()}_LIMIT', default), max_keys)
+            for name, default in self.defaults.items()
+        }
+        app.extensions['rate_limits'] = self
+
+    def hit(self, **keys):
+        """Spend one token from each named bucket, e.g. ``hit(otp_send_ip=addr)``.
+
+        Returns the longest wait in seconds if any bucket is empty, else 0.
+        A refused request spends nothing, so requests turned away for one
+        key (a flooded email address) don't drain the others (the IP
+        buckets of everyone else asking for it).
+        """
+        wait = max((self.buckets[name].wait(key) for name, key in keys.items()), default=0.0)
+        if wait:
+            return wait
+        return max((self.buckets[name].hit(key) for name, key in keys.items()), default=0.0)
@@ -0,0 +1,540 @@
+"""Receipt uploads: resumable, stored by content, processed in the background.
+
+Clients can upload a receipt in chunks: an upload is created with the file's
+total size, then each chunk is written at the offset the server reports, so
+an interrupted upload resumes where it stopped (the API is in app.py). Chunks
+go to ``<RECEIPT_DIR>/uploads/<user id>/<upload id>.part`` with the upload's
+size and name in a ``.json`` file next to it, so any worker on the host can
+take the next chunk.
+
+A finished file is stored as ``blobs/<sha256>``; content that is already
+there is not stored again, and a user uploading the same file twice gets
+the receipt they already have. Downscaling to ``RECEIPT_MAX_PX``, the
+thumbnail and extraction run in a process pool, so the upload request returns
+as soon as the bytes are on disk. The derived images are keyed by hash too:
+content any user has had processed is not processed again.
+
+Extraction is pluggable. ``RECEIPT_EXTRACTOR`` names a ``module:function``
+that takes the downscaled PIL image and returns a dict with any of
+``amount``, ``date`` and ``category``; ``receipts:tesseract_extractor`` runs a
+local Tesseract install through pytesseract. Leave it empty to skip
+extraction.
+"""
+import fcntl
+import hashlib
+import importlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Receipt
+
+# Accepted uploads and the mimetype the original is served with
+RECEIPT_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/gif')
+# Derived images, all JPEG: the downscaled copy shown on its own, and the thumbnail
+IMAGE_KINDS = ('display', 'thumb')
+# Images that would decode to more pixels than this are refused (decompression bombs)
+MAX_PIXELS = 60_000_000
+COPY_BUFSIZE = 64 * 1024
+# Stored files younger than this are left alone by garbage collection
+STALE_BLOB_SECONDS = 3600
+
+PLACEHOLDER_SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="256" height="256">'
+    b'<rect width="100%" height="100%" fill="#f8fafc"/>'
+    b'<text x="50%" y="50%" text-anchor="middle" font-family="sans-serif" '
+    b'font-size="16" fill="#64748b">Processing...</text></svg>'
+)
+
+
+class UploadConflict(Exception):
+    """A chunk was sent for an offset other than where the upload stands."""
+
+    def __init__(self, offset):
+        super().__init__(f'upload is at offset {offset}')
+        self.offset = offset
+
+
+# --- processing (runs in pool processes) ---
+
+def process_image(original, display, thumb, max_px, thumb_px, extractor):
+    """Write the downscaled copy and thumbnail of ``original`` and run the
+    extractor over it; returns the image size and what was extracted."""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        source = Image.open(original)
+    except UnidentifiedImageError:
+        raise ValueError('not a readable image') from None
+    with source:
+        width, height = source.size
+        # Only the header has been read so far
+        if width * height > MAX_PIXELS:
+            raise ValueError(f'image is too large ({width}x{height})')
+        # JPEGs are decoded straight at a reduced scale: far less work than
+        # decoding a phone photo in full and then shrinking it
+        source.draft('RGB', (max_px, max_px))
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    image.thumbnail((max_px, max_px))
+    _save_jpeg(image, display, quality=85)
+    small = image.copy()
+    small.thumbnail((thumb_px, thumb_px))
+    _save_jpeg(small, thumb, quality=80)
+    result = {'width': width, 'height': height}
+    if extractor:
+        try:
+            result['extracted'] = dict(load_extractor(extractor)(image) or {})
+        except Exception as e:
+            result['extract_error'] = _describe(e)
+    return result
+
+
+@lru_cache(maxsize=None)
+def load_extractor(spec):
+    """The function named by a ``module:function`` string."""
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _save_jpeg(image, path, quality):
+    # Written aside and renamed, so readers never see half an image
+    fd, part = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, 'JPEG', quality=quality, optimize=True)
+        os.replace(part, path)
+    finally:
+        _remove(part)
+
+
+# --- extraction ---
+
+AMOUNT_RE = re.compile(r'(?<![\d.,])(\d{1,3}(?:,\d{3})+|\d+)\.(\d{2})(?!\d)')
+TOTAL_RE = re.compile(r'\b(grand total|total|amount due|balance due|net amount|amount payable)\b', re.I)
+DATE_RES = (
+    (re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b'), (0, 1, 2)),
+    # Day first, as printed on most receipts outside the US
+    (re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b'), (2, 1, 0)),
+)
+CATEGORY_KEYWORDS = {
+    'Groceries': ('grocery', 'supermarket', 'hypermarket', 'mart', 'fresh'),
+    'Food': ('restaurant', 'cafe', 'coffee', 'pizza', 'burger', 'kitchen', 'bakery', 'dine'),
+    'Fuel': ('petrol', 'diesel', 'fuel', 'filling station'),
+    'Health': ('pharmacy', 'chemist', 'clinic', 'hospital', 'medical'),
+    'Transport': ('taxi', 'metro', 'railway', 'parking', 'toll'),
+    'Utilities': ('electricity', 'water bill', 'gas bill'),
+    'Phone': ('mobile recharge', 'prepaid', 'postpaid'),
+    'Shopping': ('apparel', 'fashion', 'electronics', 'store'),
+}
+
+
+def parse_receipt_text(text):
+    """Best guesses at the amount, date and category in OCR'd receipt text.
+
+    The amount is the last one on a "total" line, else the largest on the
+    receipt; the date is the first that parses; the category comes from
+    keywords such as "pharmacy" or "petrol".
+    """
+    found = {}
+    total, largest = None, None
+    for line in text.splitlines():
+        amounts = [Decimal(m.group(1).replace(',', '') + '.' + m.group(2)) for m in AMOUNT_RE.finditer(line)]
+        if not amounts:
+            continue
+        largest = max(amounts + ([largest] if largest is not None else []))
+        if TOTAL_RE.search(line) and 'sub' not in line.lower():
+            total = amounts[-1]
+    if total is not None or largest is not None:
+        found['amount'] = total if total is not None else largest
+    for pattern, order in DATE_RES:
+        for match in pattern.finditer(text):
+            parts = [int(match.group(i + 1)) for i in order]
+            try:
+                found['date'] = date(*parts)
+            except ValueError:
+                continue
+            break
+        if 'date' in found:
+            break
+    lowered = text.lower()
+    for category, words in CATEGORY_KEYWORDS.items():
+        if any(word in lowered for word in words):
+            found['category'] = category
+            break
+    return found
+
+
+def tesseract_extractor(image):
+    """Extractor using a local Tesseract install (needs pytesseract)."""
+    import pytesseract
+
+    return parse_receipt_text(pytesseract.image_to_string(image.convert('L')))
+
+
+def clean_extracted(extracted):
+    """Extractor output as Receipt column values; anything unusable is dropped."""
+    values = {}
+    try:
+        amount = Decimal(str(extracted['amount'])).quantize(Decimal('0.01'))
+        if 0 < amount < Decimal('1e10'):
+            values['amount'] = amount
+    except (KeyError, InvalidOperation, ValueError):
+        pass
+    day = extracted.get('date')
+    if isinstance(day, str):
+        try:
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+        except ValueError:
+            day = None
+    if isinstance(day, datetime):
+        day = day.date()
+    if isinstance(day, date):
+        values['date'] = day
+    if isinstance(extracted.get('category'), str) and extracted['category'].strip():
+        values['category'] = extracted['category'].strip()[:100]
+    return values
+
+
+# --- storage ---
+
+class ReceiptStore:
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.max_bytes = 20 * 1024 * 1024
+        self.chunk_bytes = 5 * 1024 * 1024
+        self.workers = 1
+        self.extractor = ''
+        self.max_px = 1600
+        self.thumb_px = 256
+        self.upload_ttl = 86400
+        self.requeue_after = 600
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('RECEIPT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'expense_tracker_receipts')
+        self.max_bytes = app.config.get('RECEIPT_MAX_MB', 20) * 1024 * 1024
+        self.chunk_bytes = app.config.get('RECEIPT_CHUNK_MB', 5) * 1024 * 1024
+        self.workers = app.config.get('RECEIPT_WORKERS', self.workers)
+        self.extractor = app.config.get('RECEIPT_EXTRACTOR', self.extractor)
+        self.max_px = app.config.get('RECEIPT_MAX_PX', self.max_px)
+        self.thumb_px = app.config.get('RECEIPT_THUMB_PX', self.thumb_px)
+        self.upload_ttl = app.config.get('RECEIPT_UPLOAD_EXPIRE_SECONDS', self.upload_ttl)
+        self.requeue_after = app.config.get('RECEIPT_REQUEUE_SECONDS', self.requeue_after)
+        app.extensions['receipts'] = self
+
+    def path(self, sha256, kind='original'):
+        name = sha256 if kind == 'original' else f'{sha256}.{kind}.jpg'
+        return os.path.join(self.directory, 'blobs', sha256[:2], name)
+
+    # --- uploads ---
+
+    def _upload_dir(self, user_id):
+        return os.path.join(self.directory, 'uploads', str(int(user_id)))
+
+    def _upload_paths(self, user_id, upload_id):
+        base = os.path.join(self._upload_dir(user_id), upload_id)
+        return base + '.part', base + '.json'
+
+    def create_upload(self, user_id, size, filename, content_type):
+        """Start a resumable upload of ``size`` bytes; returns its id."""
+        upload_id = uuid.uuid4().hex
+        part, meta = self._upload_paths(user_id, upload_id)
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        open(part, 'wb').close()
+        with open(meta, 'w', encoding='utf-8') as f:
+            json.dump({'size': size, 'filename': filename, 'content_type': content_type}, f)
+        return upload_id
+
+    def upload_info(self, user_id, upload_id):
+        """An upload's ``size``, ``filename``, ``content_type`` and current
+        ``offset`` (plus ``receipt_id`` once complete), or None."""
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            return None
+        part, meta = self._upload_paths(user_id, upload_id)
+        try:
+            with open(meta, encoding='utf-8') as f:
+                info = json.load(f)
+            info['offset'] = info['size'] if 'receipt_id' in info else os.path.getsize(part)
+        except (OSError, ValueError):
+            return None
+        return info
+
+    def append(self, user_id, upload_id, offset, stream, length):
+        """Write ``length`` bytes from ``stream`` at ``offset``; returns the
+        new offset (short if the client went away mid-chunk).
+
+        Raises UploadConflict when ``offset`` isn't the end of what has been
+        received (a retried or concurrent chunk) or the chunk would overrun
+        the declared size.
+        """
+        info = self.upload_info(user_id, upload_id)
+        if info is None or 'receipt_id' in info:
+            raise FileNotFoundError(upload_id)
+        part, _ = self._upload_paths(user_id, upload_id)
+        with open(part, 'r+b') as f:
+            # Chunks for one upload are written one at a time, whichever worker gets them
+            fcntl.flock(f, fcntl.LOCK_EX)
+            current = os.fstat(f.fileno()).st_size
+            if offset != current or offset + length > info['size']:
+                raise UploadConflict(current)
+            f.seek(offset)
+            try:
+                _copy(stream, f, length)
+            finally:
+                f.flush()
+            return f.tell()
+
+    def complete(self, user_id, upload_id):
+        """Store a fully received upload; returns ``(receipt, created)``."""
+        info = self.upload_info(user_id, upload_id)
+        part, meta = self._upload_paths(user_id, upload_id)
+        digest = hashlib.sha256()
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_BUFSIZE), b''):
+                digest.update(chunk)
+        receipt, created = self.add(user_id, part, digest.hexdigest(), info['size'],
+                                    info['filename'], info['content_type'])
+        # Kept until it expires, so a client retrying the last chunk gets the receipt
+        with open(meta, 'w', encoding='utf-8') as f:
+            json.dump({**info, 'receipt_id': receipt.id}, f)
+        return receipt, created
+
+    def save(self, user_id, stream, filename, content_type):
+        """Store a whole file from ``stream`` (a plain form upload); returns
+        ``(receipt, created)``. Raises ValueError if it is too large."""
+        directory = self._upload_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        fd, part = tempfile.mkstemp(dir=directory, suffix='.part')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                size = _copy(stream, f, self.max_bytes + 1, digest)
+            if size > self.max_bytes:
+                raise ValueError(f'Receipts are limited to {self.max_bytes // (1024 * 1024)} MB')
+            return self.add(user_id, part, digest.hexdigest(), size, filename, content_type)
+        finally:
+            _remove(part)
+
+    def add(self, user_id, path, sha256, size, filename, content_type):
+        """Move the file at ``path`` into the blob store (unless that content
+        is already there) and record a receipt for it.
+
+        Commits, then queues processing; returns ``(receipt, created)``.
+        """
+        blob = self.path(sha256)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if os.path.exists(blob):
+            _remove(path)
+        else:
+            os.replace(path, blob)
+        table = Receipt.__table__
+        insert = sqlite_insert if db.session.get_bind().dialect.name == 'sqlite' else pg_insert
+        created = db.session.execute(
+            insert(table).values(
+                user_id=user_id, sha256=sha256, filename=(filename or '')[:255], content_type=content_type,
+                size=size, status='pending', created_at=datetime.now(),
+            ).on_conflict_do_nothing(index_elements=['user_id', 'sha256']).returning(table.c.id)
+        ).scalar() is not None
+        if created:
+            self._reuse_results(sha256)
+        else:
+            # Uploading content that failed before tries it again
+            db.session.execute(update(Receipt).where(
+                Receipt.user_id == user_id, Receipt.sha256 == sha256, Receipt.status == 'failed',
+            ).values(status='pending', error=None))
+        receipt = Receipt.query.filter_by(user_id=user_id, sha256=sha256).one()
+        db.session.commit()
+        if receipt.status == 'pending':
+            self.submit(sha256)
+        return receipt, created
+
+    def _reuse_results(self, sha256):
+        # Someone already had this content processed: copy their results
+        done = Receipt.query.filter_by(sha256=sha256, status='ready').first()
+        if done is None or not all(os.path.exists(self.path(sha256, kind)) for kind in IMAGE_KINDS):
+            return
+        db.session.execute(update(Receipt).where(Receipt.sha256 == sha256, Receipt.status == 'pending').values(
+            status='ready', width=done.width, height=done.height, amount=done.amount, date=done.date,
+            category=done.category, error=done.error, processed_at=datetime.now(),
+        ))
+
+    def delete(self, user_id, receipt_id):
+        """Delete one of the user's receipts, and its files unless another
+        receipt has the same content. Commits; returns False if not found."""
+        sha256 = db.session.execute(
+            delete(Receipt).where(Receipt.id == receipt_id, Receipt.user_id == user_id).returning(Receipt.sha256)
+        ).scalar()
+        if sha256 is None:
+            return False
+        db.session.commit()
+        if db.session.query(Receipt.id).filter_by(sha256=sha256).first() is None:
+            self._remove_files(sha256)
+        return True
+
+    def _remove_files(self, sha256):
+        for kind in ('original',) + IMAGE_KINDS:
+            _remove(self.path(sha256, kind))
+
+    # --- background processing ---
+
+    def submit(self, sha256):
+        """Queue processing of stored content unless it is queued here already."""
+        with self._lock:
+            if sha256 in self._pending:
+                return
+            if self._executor is None:
+                # Created on first use so each gunicorn worker gets its own pool
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._executor.submit(
+                process_image, self.path(sha256), self.path(sha256, 'display'), self.path(sha256, 'thumb'),
+                self.max_px, self.thumb_px, self.extractor,
+            )
+            self._pending.add(sha256)
+        future.add_done_callback(lambda f: self._finished(sha256, f))
+
+    def _finished(self, sha256, future):
+        try:
+            with self.app.app_context():
+                self._record(sha256, future)
+        except Exception as e:
+            db.session.rollback()
+            print("Receipt processing error:", e)
+        finally:
+            with self._lock:
+                self._pending.discard(sha256)
+
+    def _record(self, sha256, future):
+        values = {'processed_at': datetime.now()}
+        try:
+            result = future.result()
+        except BrokenExecutor:
+            # A pool process died (e.g. killed mid-decode); start a fresh pool
+            # next time and leave the receipt pending for the sweep to retry
+            with self._lock:
+                self._executor = None
+            return
+        except Exception as e:
+            values.update(status='failed', error=_describe(e))
+        else:
+            values.update(status='ready', width=result['width'], height=result['height'],
+                          error=result.get('extract_error'), **clean_extracted(result.get('extracted') or {}))
+        db.session.execute(update(Receipt).where(Receipt.sha256 == sha256, Receipt.status == 'pending').values(**values))
+        db.session.commit()
+
+    def sweep(self):
+        """Drop abandoned uploads and requeue receipts still pending after
+        ``RECEIPT_REQUEUE_SECONDS`` (their worker was restarted, say).
+        Returns ``(uploads removed, receipts requeued)``."""
+        removed = 0
+        cutoff = time.time() - self.upload_ttl
+        uploads = os.path.join(self.directory, 'uploads')
+        for root, _, names in os.walk(uploads):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    expired = os.stat(path).st_mtime < cutoff
+                except FileNotFoundError:
+                    continue
+                if not expired:
+                    continue
+                # A part's mtime moves with every chunk; a finished upload is just its .json
+                if name.endswith('.part'):
+                    _remove(path)
+                    removed += 1
+                elif not os.path.exists(path[:-len('.json')] + '.part'):
+                    _remove(path)
+        stale = db.session.query(Receipt.sha256).filter(
+            Receipt.status == 'pending', Receipt.created_at < datetime.now() - timedelta(seconds=self.requeue_after),
+        ).distinct().limit(100).all()
+        for (sha256,) in stale:
+            if os.path.exists(self.path(sha256)):
+                self.submit(sha256)
+            else:
+                db.session.execute(update(Receipt).where(Receipt.sha256 == sha256, Receipt.status == 'pending').values(
+                    status='failed', error='file missing', processed_at=datetime.now()))
+        db.session.commit()
+        return removed, len(stale)
+
+    def collect_garbage(self):
+        """Delete stored files no receipt refers to any more (e.g. after a
+        user was deleted); returns how many contents were removed."""
+        removed = 0
+        # Newer files may belong to an upload whose receipt isn't committed yet
+        cutoff = time.time() - STALE_BLOB_SECONDS
+        blobs = os.path.join(self.directory, 'blobs')
+        try:
+            prefixes = os.listdir(blobs)
+        except FileNotFoundError:
+            return 0
+        for prefix in prefixes:
+            try:
+                names = os.listdir(os.path.join(blobs, prefix))
+            except NotADirectoryError:
+                continue
+            stored = {name for name in names if '.' not in name and _mtime(os.path.join(blobs, prefix, name)) < cutoff}
+            if not stored:
+                continue
+            known = {sha for (sha,) in db.session.query(Receipt.sha256).filter(
+                Receipt.sha256.in_(stored)).distinct()}
+            for sha256 in stored - known:
+                self._remove_files(sha256)
+                removed += 1
+        return removed
+
+    def shutdown(self, wait=False):
+        """Stop the pool; with ``wait``, after finishing (and recording) queued work."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _copy(stream, f, limit, digest=None):
+    """Copy up to ``limit`` bytes from ``stream`` to ``f``; returns how many."""
+    copied = 0
+    while copied < limit:
+        chunk = stream.read(min(COPY_BUFSIZE, limit - copied))
+        if not chunk:
+            break
+        f.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        copied += len(chunk)
+    return copied
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return float('inf')
+
+
+def _describe(error):
+    return f'{type(error).__name__}: {error}'[:255]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,103 @@
+"""Expense search: free text over description and category, plus filters.
+
+On Postgres, migration 0010 adds a generated ``expenses.search_vector``
+tsvector and a trigram index over the same text, both GIN indexes led by
+``user_id`` (btree_gin). A search term matches whole words through the
+tsvector or any substring (``groc`` -> Groceries) through the trigram index.
+On SQLite an FTS5 external-content table, ``expenses_fts``, kept in step by
+triggers, prefix-matches each word instead.
+
+``search_query`` only filters; callers page through the results in
+dashboard order with ``fetch_page``'s keyset cursor.
+"""
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import false, literal_column, or_, select, table
+
+from models import db, Expense
+
+# Must match the indexed expression in migration 0010 for the trigram index to apply
+SEARCH_TEXT_SQL = "(coalesce(expenses.description, '') || ' ' || coalesce(expenses.category, ''))"
+MAX_QUERY_LENGTH = 200
+
+
+def parse_filters(args):
+    """Validated search filters from request args; raises ValueError."""
+    filters = {}
+    text = (args.get('q') or '').strip()
+    if len(text) > MAX_QUERY_LENGTH:
+        raise ValueError(f'search text is limited to {MAX_QUERY_LENGTH} characters')
+    if text:
+        filters['text'] = text
+    for name in ('country', 'currency', 'category'):
+        if (args.get(name) or '').strip():
+            filters[name] = args[name].strip()
+    for name in ('min_amount', 'max_amount'):
+        if (args.get(name) or '').strip():
+            try:
+                filters[name] = Decimal(args[name].strip())
+            except InvalidOperation:
+                raise ValueError(f'{name.replace("_", " ")} must be a number')
+            if not filters[name].is_finite():
+                raise ValueError(f'{name.replace("_", " ")} must be a number')
+    for name in ('start', 'end'):
+        if (args.get(name) or '').strip():
+            try:
+                filters[name] = datetime.strptime(args[name].strip(), '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f'{name} date must be YYYY-MM-DD')
+    return filters
+
+
+def _fts5_query(text):
+    """Every word of ``text`` as a quoted prefix term (no FTS5 syntax gets through)."""
+    words = re.findall(r'\w+', text)
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def text_filter(text):
+    """SQL condition matching ``text`` against description and category."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        vector = literal_column('expenses.search_vector')
+        return or_(
+            vector.op('@@')(db.func.websearch_to_tsquery('simple', text)),
+            literal_column(SEARCH_TEXT_SQL).ilike(f'%{_escape_like(text)}%', escape='\\'),
+        )
+    match = _fts5_query(text)
+    if not match:
+        # No words to look up (e.g. only punctuation): nothing matches, as
+        # with websearch_to_tsquery on Postgres
+        return false()
+    fts = table('expenses_fts')
+    return Expense.id.in_(
+        select(literal_column('rowid')).select_from(fts).where(literal_column('expenses_fts').op('MATCH')(match))
+    )
+
+
+def search_query(user_id, text=None, country=None, currency=None, category=None,
+                 min_amount=None, max_amount=None, start=None, end=None):
+    """The user's expenses matching every given filter (``end`` inclusive)."""
+    query = Expense.query.filter(Expense.user_id == user_id)
+    if text:
+        query = query.filter(text_filter(text))
+    if country:
+        query = query.filter(Expense.country == country)
+    if currency:
+        query = query.filter(Expense.currency == currency.upper())
+    if category:
+        query = query.filter(Expense.category == category)
+    if min_amount is not None:
+        query = query.filter(Expense.amount >= min_amount)
+    if max_amount is not None:
+        query = query.filter(Expense.amount <= max_amount)
+    if start is not None:
+        query = query.filter(Expense.date >= start)
+    if end is not None:
+        query = query.filter(Expense.date <= end)
+    return query
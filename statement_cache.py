@@ -0,0 +1,168 @@
+"""On-disk cache of rendered statements.
+
+Statements are stored as ``<dir>/<user id>/<period>.<version>.<format>``,
+where ``version`` is the user's data version for the period (see
+``statement_version_query`` in app.py), so an add or delete in the period
+changes the key and a stale file can never be served. Writers also drop the files
+for the periods they touch so they don't sit around until evicted.
+
+Eviction is least-recently-used by file mtime (hits touch the file) once the
+directory grows past ``STATEMENT_CACHE_MAX_MB``. It walks the whole tree, so
+a write doesn't run it; each process keeps a running total of the size as of
+its last walk plus what it wrote since, and evicts only when that crosses
+the budget. The directory can be shared by every worker on a host, so the
+periodic sweep (``STATEMENT_CACHE_SWEEP_SECONDS``) also evicts, catching what
+the other workers wrote, and clears out abandoned ``.part`` files. Analytics charts use a second instance configured
+by ``CHART_CACHE_*``.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Unfinished writes older than this belong to a worker that died mid-render
+STALE_PART_SECONDS = 3600
+# Eviction goes down to this fraction of the budget, so the next walk waits
+# until the cache has grown by the rest again
+EVICT_TO = 0.9
+
+
+class StatementCache:
+    def __init__(self, app=None, config_prefix='STATEMENT_CACHE'):
+        self.config_prefix = config_prefix
+        self.directory = None
+        self.max_bytes = 0
+        # Size of the directory as of the last evict() plus what this process
+        # has written since; None until the first walk
+        self._bytes = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        self.directory = app.config.get(f'{prefix}_DIR') or os.path.join(
+            tempfile.gettempdir(), f'expense_tracker_{prefix.lower()}')
+        self.max_bytes = app.config.get(f'{prefix}_MAX_MB', 512) * 1024 * 1024
+        app.extensions[prefix.lower()] = self
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.directory, str(int(user_id)))
+
+    def _path(self, user_id, period, fmt, version):
+        return os.path.join(self._user_dir(user_id), f'{period}.{version}.{fmt}')
+
+    def open(self, user_id, period, fmt, version):
+        """Return an open binary file for a cached statement, or None."""
+        if not self.enabled:
+            return None
+        path = self._path(user_id, period, fmt, version)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return f
+
+    def store(self, user_id, period, fmt, version, chunks, complete=lambda: True):
+        """Pass ``chunks`` through while saving them under the given key.
+
+        The file only becomes visible once every chunk has been written and
+        ``complete()`` agrees; a client disconnect or a failed query leaves
+        nothing behind.
+        """
+        if not self.enabled:
+            yield from chunks
+            return
+        directory = self._user_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        fd, part = tempfile.mkstemp(dir=directory, suffix='.part')
+        saved = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+                size = f.tell()
+            if complete():
+                os.replace(part, self._path(user_id, period, fmt, version))
+                saved = True
+        finally:
+            if not saved:
+                _remove(part)
+        if not saved:
+            return
+        with self._lock:
+            over = self._bytes is None or self._bytes + size > self.max_bytes
+            if not over:
+                self._bytes += size
+        if over:
+            self.evict()
+
+    def put(self, user_id, period, fmt, version, data):
+        """Save ``data`` (bytes) under the given key."""
+        for _ in self.store(user_id, period, fmt, version, [data]):
+            pass
+
+    def invalidate(self, user_id, months):
+        """Drop cached statements covering any of ``months`` (dates)."""
+        periods = {'all'}
+        for month in months:
+            periods.add(month.strftime('%Y-%m'))
+            periods.add(str(month.year))
+        try:
+            names = os.listdir(self._user_dir(user_id))
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.split('.', 1)[0] in periods:
+                _remove(os.path.join(self._user_dir(user_id), name))
+
+    def clear(self, user_id=None):
+        """Drop every cached statement (for one user, or for everyone)."""
+        path = self.directory if user_id is None else self._user_dir(user_id)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def evict(self):
+        """If the cache is over its budget, delete least recently used files
+        until it is back under ``EVICT_TO`` of it; also delete unfinished
+        writes abandoned by a dead worker."""
+        entries = []
+        total = 0
+        now = time.time()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith('.part'):
+                    if now - st.st_mtime > STALE_PART_SECONDS:
+                        _remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                _remove(path)
+                total -= size
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+        with self._lock:
+            self._bytes = total
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,325 @@
+"""Expense statement rendering for the /download route.
+
+Renderers take an iterable of ``Expense`` rows and yield ``bytes`` chunks, so
+the route can stream them straight to the client without building the whole
+document (or a temp file) first.
+"""
+import csv
+import io
+import re
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+from fpdf import FPDF
+
+# Column order for the CSV/XLSX exports; matches what /import accepts
+EXPORT_COLUMNS = ('date', 'amount', 'category', 'currency', 'country', 'description')
+# Rows rendered between flushes to the client
+FLUSH_EVERY = 500
+
+
+def latin1(text):
+    """Core PDF fonts are latin-1 only; replace anything they can't draw."""
+    return (text or '').encode('latin-1', 'replace').decode('latin-1')
+
+
+class StatementPDF(FPDF):
+    """FPDF that writes each finished page out immediately.
+
+    Stock FPDF keeps every page in memory until ``output()``. Here a page's
+    objects are appended to ``self.buffer`` as soon as the page is closed and
+    ``drain()`` hands them out, so only the page being laid out is held in
+    memory. Object offsets are counted from the start of the document
+    (including bytes already drained) so the xref table stays valid.
+    """
+
+    def __init__(self, *args, heading='Expense Statement', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.heading = heading
+        self._drained = 0
+
+    def header(self):
+        self.set_font('Arial', 'B', 14)
+        self.cell(0, 10, latin1(self.heading), 0, 1, 'C')
+        self.ln(2)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+
+    def drain(self):
+        """Return (and forget) everything written since the last drain."""
+        data = self.buffer.encode('latin-1')
+        self._drained += len(data)
+        self.buffer = ''
+        return data
+
+    def _offset(self):
+        return self._drained + len(self.buffer)
+
+    def open(self):
+        super().open()
+        # The header has to precede the first page object we emit
+        self._putheader()
+
+    def _newobj(self):
+        self.n += 1
+        self.offsets[self.n] = self._offset()
+        self._out(str(self.n) + ' 0 obj')
+
+    def _endpage(self):
+        super()._endpage()
+        self._putpage(self.page)
+
+    def _putpage(self, n):
+        # Same objects FPDF._putpages writes per page (we use no links,
+        # orientation changes or page-count aliases)
+        self._newobj()
+        self._out('<</Type /Page')
+        self._out('/Parent 1 0 R')
+        self._out('/Resources 2 0 R')
+        self._out('/Contents ' + str(self.n + 1) + ' 0 R>>')
+        self._out('endobj')
+        content = self.pages[n].encode('latin-1')
+        self.pages[n] = ''
+        if self.compress:
+            content = zlib.compress(content)
+            stream_filter = '/Filter /FlateDecode '
+        else:
+            stream_filter = ''
+        self._newobj()
+        self._out('<<' + stream_filter + '/Length ' + str(len(content)) + '>>')
+        self._putstream(content)
+        self._out('endobj')
+
+    def _putpages(self):
+        # Page objects are already out; only the page tree root is left
+        if self.def_orientation == 'P':
+            w_pt, h_pt = self.fw_pt, self.fh_pt
+        else:
+            w_pt, h_pt = self.fh_pt, self.fw_pt
+        self.offsets[1] = self._offset()
+        self._out('1 0 obj')
+        self._out('<</Type /Pages')
+        self._out('/Kids [' + ''.join(f'{3 + 2 * i} 0 R ' for i in range(self.page)) + ']')
+        self._out('/Count ' + str(self.page))
+        self._out('/MediaBox [0 0 %.2f %.2f]' % (w_pt, h_pt))
+        self._out('>>')
+        self._out('endobj')
+
+    def _putresources(self):
+        self._putfonts()
+        self._putimages()
+        self.offsets[2] = self._offset()
+        self._out('2 0 obj')
+        self._out('<<')
+        self._putresourcedict()
+        self._out('>>')
+        self._out('endobj')
+
+    def _enddoc(self):
+        self._putpages()
+        self._putresources()
+        self._newobj()
+        self._out('<<')
+        self._putinfo()
+        self._out('>>')
+        self._out('endobj')
+        self._newobj()
+        self._out('<<')
+        self._putcatalog()
+        self._out('>>')
+        self._out('endobj')
+        xref_offset = self._offset()
+        self._out('xref')
+        self._out('0 ' + str(self.n + 1))
+        self._out('0000000000 65535 f ')
+        for i in range(1, self.n + 1):
+            self._out('%010d 00000 n ' % self.offsets[i])
+        self._out('trailer')
+        self._out('<<')
+        self._puttrailer()
+        self._out('>>')
+        self._out('startxref')
+        self._out(xref_offset)
+        self._out('%%EOF')
+        self.state = 3
+
+
+def render_pdf(rows, title=None, total=None):
+    """Yield a PDF statement for ``rows`` page by page.
+
+    ``title`` names the statement period in the page heading, e.g.
+    ``'September 2026'``. ``total`` is ``(amount, currency, unconverted
+    currencies)`` for the converted total line; without it the raw amounts
+    are summed.
+    """
+    pdf = StatementPDF(heading=f'Expense Statement - {title}' if title else 'Expense Statement')
+    pdf.set_auto_page_break(True, 15)
+    pdf.add_page()
+    pdf.set_font('Arial', '', 11)
+
+    # Table header
+    pdf.cell(30, 8, 'Date', 1)
+    pdf.cell(30, 8, 'Country', 1)
+    pdf.cell(30, 8, 'Category', 1)
+    pdf.cell(25, 8, 'Amount', 1)
+    pdf.cell(30, 8, 'Currency', 1)
+    pdf.cell(45, 8, 'Description', 1)
+    pdf.ln()
+
+    raw_total = 0.0
+    for r in rows:
+        pdf.cell(30, 8, str(r.date), 1)
+        pdf.cell(30, 8, latin1(r.country), 1)
+        pdf.cell(30, 8, latin1(r.category), 1)
+        pdf.cell(25, 8, str(r.amount), 1)
+        pdf.cell(30, 8, latin1(r.currency), 1)
+        pdf.cell(45, 8, latin1((r.description or '')[:30]), 1)
+        pdf.ln()
+        raw_total += float(r.amount or 0)
+        # A page break flushes the finished page into the buffer
+        if pdf.buffer:
+            yield pdf.drain()
+
+    pdf.set_font('Arial', 'B', 11)
+    if total is None:
+        pdf.cell(90, 8, 'Total', 1)
+        pdf.cell(25, 8, f"{raw_total:.2f}", 1)
+        pdf.cell(75, 8, '', 1)
+    else:
+        amount, currency, unconverted = total
+        pdf.cell(90, 8, latin1(f'Total ({currency})'), 1)
+        pdf.cell(25, 8, f"{amount:.2f}", 1)
+        pdf.cell(75, 8, latin1(f"excludes {', '.join(unconverted)} (no rate)" if unconverted else ''), 1)
+    pdf.ln()
+    pdf.close()
+    yield pdf.drain()
+
+
+def _export_values(r):
+    return (r.date.isoformat() if r.date else '', r.amount, r.category or '',
+            r.currency or '', r.country or '', r.description or '')
+
+
+def render_csv(rows):
+    """Yield a CSV export of ``rows`` in chunks of FLUSH_EVERY rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    # Header goes out before the first query batch is fetched
+    yield buf.getvalue().encode('utf-8')
+    buf.seek(0)
+    buf.truncate()
+    for n, r in enumerate(rows, start=1):
+        writer.writerow(_export_values(r))
+        if n % FLUSH_EVERY == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+class _Sink:
+    """Write-only file object whose contents are handed out by ``drain()``.
+
+    ZipFile falls back to streaming mode (data descriptors, no seeking) when
+    given an object like this, which is what lets the XLSX go out as it is
+    written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+_XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Expenses" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Characters XML 1.0 does not allow, even escaped
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, str):
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_XML_ILLEGAL.sub("", value))}</t></is></c>'
+    if value is None:
+        return '<c/>'
+    return f'<c><v>{value}</v></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(v) for v in values) + '</row>'
+
+
+def render_xlsx(rows):
+    """Yield an XLSX export of ``rows`` with constant memory.
+
+    The workbook is a minimal SpreadsheetML package whose single sheet uses
+    inline strings, so rows can be written in order without the shared
+    string table a full writer would keep in memory.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as package:
+        for name, xml in _XLSX_STATIC.items():
+            package.writestr(name, xml)
+        with package.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xlsx_row(EXPORT_COLUMNS)
+            ).encode('utf-8'))
+            yield sink.drain()
+            for n, r in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(_export_values(r)).encode('utf-8'))
+                if n % FLUSH_EVERY == 0:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()